@@ -0,0 +1 @@
+"""Benchmarks for the ingestion worker. Run from apps/ingestion-worker with `python -m benchmarks.<name>`."""
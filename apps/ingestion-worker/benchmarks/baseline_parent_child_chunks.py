@@ -0,0 +1,72 @@
+"""
+The parent/child chunk builder as it was before chunk_windows, kept as the
+benchmark's baseline. It joins each run of text chunks with their <<<id>>>
+markers, splits the whole run twice (parents, then children) and recovers
+the parent/child relation by scanning every piece for markers. Logging is
+left out so only the work is timed.
+"""
+
+import re
+from uuid import uuid4
+
+from schemas.index import Child_Chunks, Chunk, Parent_Chunks
+from utils.chunk_splitter import get_splitter
+
+_MARKER = re.compile(r"<<</?(\d+)>>>")
+
+
+def _marked_ids(content: str) -> list[int]:
+    return sorted({int(match.group(1)) for match in _MARKER.finditer(content)})
+
+
+def create_parent_child_chunks(
+    chunks: list[Chunk],
+) -> tuple[list[Parent_Chunks], list[Child_Chunks]]:
+    combined: list[tuple[str, str]] = []
+    text = ""
+    for chunk in chunks:
+        marked = f"<<<{chunk['id']}>>>{chunk['content']}<<</{chunk['id']}>>>"
+        if chunk["type"] == "text":
+            text += marked
+            continue
+        if text:
+            combined.append(("text", text))
+            text = ""
+        combined.append(("table", marked))
+    if text:
+        combined.append(("text", text))
+
+    parent_splitter = get_splitter(2000, 200, mode="langchain")
+    child_splitter = get_splitter(500, 100, mode="langchain")
+
+    parent_chunks: list[Parent_Chunks] = []
+    for kind, content in combined:
+        pieces = parent_splitter.split_text(content) if kind == "text" else [content]
+        parent_chunks.extend(
+            {"content": piece, "children_ids": _marked_ids(piece), "id": str(uuid4())}
+            for piece in pieces
+        )
+
+    child_parent_mapping: dict[int, list[str]] = {}
+    for parent in parent_chunks:
+        for child_id in parent["children_ids"]:
+            child_parent_mapping.setdefault(child_id, []).append(parent["id"])
+
+    child_chunks: list[Child_Chunks] = []
+    for kind, content in combined:
+        pieces = child_splitter.split_text(content) if kind == "text" else [content]
+        for piece in pieces:
+            parent_ids = [
+                parent_id
+                for child_id in _marked_ids(piece)
+                for parent_id in child_parent_mapping[child_id]
+            ]
+            child_chunks.append(
+                {
+                    "content": _MARKER.sub("", piece),
+                    "parent_ids": list(dict.fromkeys(parent_ids)),
+                    "id": str(uuid4()),
+                }
+            )
+
+    return parent_chunks, child_chunks
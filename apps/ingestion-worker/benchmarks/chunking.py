@@ -0,0 +1,166 @@
+"""
+Chunking benchmark: time each stage of lib.chunker.process_chunks on a
+synthetic markdown document of paragraphs, lists, image tags and tables.
+The text splitting inside create_db_chunks is also timed on its own for
+each CHUNK_SPLITTER_MODE, and create_parent_child_chunks is compared with
+the previous split-twice builder (benchmarks.baseline_parent_child_chunks).
+
+    python -m benchmarks.chunking --size-mb 5 --repeat 3
+"""
+
+import argparse
+import random
+import statistics
+import time
+
+from utils.chunk_splitter import CHUNK_SPLITTER_MODES, get_splitter
+from utils.create_db_chunks import create_db_chunks
+from utils.parent_child_chunks import create_parent_child_chunks
+from utils.split_text_tables import extract_tables_and_text
+
+from benchmarks import baseline_parent_child_chunks
+
+_WORDS = [
+    "revenue",
+    "latency",
+    "pipeline",
+    "encryption",
+    "quarterly",
+    "customer",
+    "retention",
+    "throughput",
+    "compliance",
+    "architecture",
+    "the",
+    "of",
+    "and",
+    "with",
+    "for",
+    "model",
+    "results",
+    "growth",
+    "section",
+    "table",
+]
+
+
+def _sentence(rng: random.Random) -> str:
+    words = rng.choices(_WORDS, k=rng.randint(6, 18))
+    return " ".join(words).capitalize() + "."
+
+
+def _block(rng: random.Random, index: int, table_share: float) -> str:
+    if rng.random() < table_share:
+        rows = [f"| {rng.randint(0, 999)} | {_sentence(rng)} |" for _ in range(8)]
+        return "\n".join(["| id | value |", "| --- | --- |", *rows])
+    kind = rng.random()
+    if kind < 0.05:
+        return f"## Section {index}"
+    if kind < 0.1:
+        return f'<img src="image_{index}.png" alt="figure {index}" />'
+    if kind < 0.25:
+        return "\n".join(f"- {_sentence(rng)}" for _ in range(rng.randint(2, 6)))
+    return " ".join(_sentence(rng) for _ in range(rng.randint(2, 8)))
+
+
+def synthetic_markdown(size_bytes: int, seed: int, table_share: float = 0.05) -> str:
+    rng = random.Random(seed)
+    blocks: list[str] = []
+    total = 0
+    while total < size_bytes:
+        block = _block(rng, len(blocks), table_share)
+        blocks.append(block)
+        total += len(block) + 2
+    return "\n\n".join(blocks)
+
+
+def timed(samples: dict[str, list[float]], stage: str, fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    samples.setdefault(stage, []).append((time.perf_counter() - start) * 1000)
+    return result
+
+
+def split_text_blocks(split_content: list[dict], mode: str) -> list[str]:
+    splitter = get_splitter(300, 0, mode=mode)
+    return [
+        chunk
+        for block in split_content
+        if block["type"] == "text"
+        for chunk in splitter.split_text(block["content"])
+    ]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size-mb", type=float, default=5)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--table-share",
+        type=float,
+        default=0.05,
+        help="Share of blocks that are tables; 0 gives one long run of text",
+    )
+    parser.add_argument(
+        "--splitters",
+        nargs="+",
+        choices=CHUNK_SPLITTER_MODES,
+        default=list(CHUNK_SPLITTER_MODES),
+    )
+    parser.add_argument(
+        "--skip-baseline",
+        action="store_true",
+        help="Do not time the previous parent/child builder (slow on long text)",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    text = synthetic_markdown(
+        int(args.size_mb * 1024 * 1024), args.seed, args.table_share
+    )
+    samples: dict[str, list[float]] = {}
+    for _ in range(args.repeat):
+        split_content = timed(
+            samples, "extract_tables_and_text", extract_tables_and_text, text
+        )
+        for mode in args.splitters:
+            timed(
+                samples,
+                f"  split_mixed_content ({mode})",
+                split_text_blocks,
+                split_content,
+                mode,
+            )
+        db_chunks = timed(samples, "create_db_chunks", create_db_chunks, split_content)
+        parents, children = timed(
+            samples, "create_parent_child_chunks", create_parent_child_chunks, db_chunks
+        )
+        if not args.skip_baseline:
+            timed(
+                samples,
+                "  baseline (split twice)",
+                baseline_parent_child_chunks.create_parent_child_chunks,
+                db_chunks,
+            )
+
+    print(
+        f"\n{len(text) / 1e6:.1f} MB -> {len(db_chunks)} chunks, "
+        f"{len(parents)} parents, {len(children)} children"
+    )
+    print(f"{'stage':<34}{'median ms':>12}{'min ms':>12}")
+    for stage, stage_samples in samples.items():
+        print(
+            f"{stage:<34}{statistics.median(stage_samples):>12.1f}"
+            f"{min(stage_samples):>12.1f}"
+        )
+    if not args.skip_baseline:
+        baseline_ms = statistics.median(samples["  baseline (split twice)"])
+        current_ms = statistics.median(samples["create_parent_child_chunks"])
+        print(
+            f"\ncreate_parent_child_chunks: {current_ms:.1f} ms, "
+            f"baseline: {baseline_ms:.1f} ms ({baseline_ms / current_ms:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
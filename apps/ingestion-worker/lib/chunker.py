@@ -3,10 +3,11 @@ from utils.parent_child_chunks import create_parent_child_chunks
 from utils.split_text_tables import extract_tables_and_text
 
 
-def process_chunks(text: str):
+def process_chunks(text: str, start_id: int = 0):
     text_split_by_tables = extract_tables_and_text(text)
 
-    db_chunks = create_db_chunks(text_split_by_tables)
+    # start_id lets a document chunked piece by piece keep its chunk IDs unique
+    db_chunks = create_db_chunks(text_split_by_tables, start_id)
 
     parent_chunks, child_chunks = create_parent_child_chunks(db_chunks)
 
@@ -0,0 +1,92 @@
+import heapq
+import math
+import os
+import struct
+import sys
+from array import array
+
+from lib.modal_clients import remote_embedder
+from modal_services import BGE_M3_MAX_CONTAINERS, BGE_M3_MAX_INPUTS
+
+# Precision of the packed embeddings sent back by BGEM3Embedder. "float16"
+# halves the transfer; pgvector stores float32 either way, and BGE-M3 is
+# computed in fp16, so little is lost.
+EMBEDDING_TRANSFER_DTYPES = {"float32": "f", "float16": "e"}
+EMBEDDING_TRANSFER_DTYPE = os.environ.get("EMBEDDING_TRANSFER_DTYPE", "float32")
+
+if EMBEDDING_TRANSFER_DTYPE not in EMBEDDING_TRANSFER_DTYPES:
+    raise ValueError(
+        f"Invalid embedding transfer dtype '{EMBEDDING_TRANSFER_DTYPE}'. Allowed values: {', '.join(EMBEDDING_TRANSFER_DTYPES)}"
+    )
+
+# Large documents are split into shards embedded in parallel, one per
+# BGEM3Embedder input slot at most, so every GPU container gets work.
+# Sources with fewer texts than this per shard use fewer shards.
+EMBEDDING_MIN_SHARD_TEXTS = int(os.environ.get("EMBEDDING_MIN_SHARD_TEXTS", "64"))
+MAX_EMBEDDING_SHARDS = BGE_M3_MAX_CONTAINERS * BGE_M3_MAX_INPUTS
+
+
+def unpack_embeddings(buffer: bytes, count: int, dtype: str) -> list[memoryview]:
+    """
+    Rows of a packed row-major embedding buffer as memoryviews over it, so
+    no per-value Python floats are built before the DB writer formats them.
+    """
+    if not count:
+        return []
+    if dtype == "float16" and sys.version_info < (3, 12):
+        # memoryview.cast("e") needs Python 3.12; widen to float32 once instead
+        values = memoryview(array("f", struct.unpack(f"{len(buffer) // 2}e", buffer)))
+    else:
+        values = memoryview(buffer).cast(EMBEDDING_TRANSFER_DTYPES[dtype])
+    dimension, remainder = divmod(len(values), count)
+    if remainder:
+        raise ValueError(
+            f"Embedding buffer of {len(values)} values does not split into {count} rows"
+        )
+    return [values[i : i + dimension] for i in range(0, len(values), dimension)]
+
+
+def balance_shards(texts: list[str], shard_count: int) -> list[list[int]]:
+    """
+    Split text indexes into shard_count shards of similar total length.
+
+    Longest first, each text goes to the currently lightest shard, so every
+    shard also gets a similar mix of long and short texts. Characters stand
+    in for tokens, which is close enough to balance the work.
+    """
+    shards: list[list[int]] = [[] for _ in range(shard_count)]
+    loads = [(0, shard) for shard in range(shard_count)]
+    for index in sorted(range(len(texts)), key=lambda i: len(texts[i]), reverse=True):
+        load, shard = heapq.heappop(loads)
+        shards[shard].append(index)
+        heapq.heappush(loads, (load + len(texts[index]), shard))
+    return [shard for shard in shards if shard]
+
+
+async def embed_texts(texts: list[str]) -> list[memoryview]:
+    """
+    Dense BGE-M3 embedding of every text, in order.
+
+    Texts are embedded in size-balanced shards fanned out with `.map.aio`,
+    awaited without blocking the event loop, and put back in input order.
+    """
+    if not texts:
+        return []
+
+    shard_count = min(
+        MAX_EMBEDDING_SHARDS, math.ceil(len(texts) / EMBEDDING_MIN_SHARD_TEXTS)
+    )
+    shards = balance_shards(texts, shard_count)
+    embeddings: list[memoryview | None] = [None] * len(texts)
+    shard_index = 0
+    async for buffer in remote_embedder.generate_embeddings_packed.map.aio(
+        [[texts[index] for index in shard] for shard in shards],
+        [EMBEDDING_TRANSFER_DTYPE] * len(shards),
+    ):
+        # Outputs arrive in shard order
+        shard = shards[shard_index]
+        rows = unpack_embeddings(buffer, len(shard), EMBEDDING_TRANSFER_DTYPE)
+        for index, row in zip(shard, rows, strict=True):
+            embeddings[index] = row
+        shard_index += 1
+    return embeddings
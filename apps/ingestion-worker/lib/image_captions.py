@@ -0,0 +1,315 @@
+import asyncio
+import hashlib
+import math
+import os
+import time
+from io import BytesIO
+from typing import NamedTuple
+
+from lib.modal_clients import remote_summarizer
+from lib.redis_client import get_async_redis_client
+from modal_services import (
+    FLORENCE_MAX_BATCH_SIZE,
+    FLORENCE_MAX_CONTAINERS,
+    FLORENCE_MAX_INPUTS,
+)
+from PIL import Image
+
+# Florence captions are cached in Redis by exact (SHA-256) image hash across
+# sources, and by perceptual (dHash) hash within one user's sources, so logos,
+# headers and diagrams repeated across pages and documents are only captioned
+# once. Near-duplicate matches are not shared between users, since a
+# look-alike image can differ in what its caption describes.
+IMAGE_CAPTION_CACHE_ENABLED = (
+    os.environ.get("IMAGE_CAPTION_CACHE_ENABLED", "true") == "true"
+)
+IMAGE_CAPTION_CACHE_TTL_SECONDS = int(
+    os.environ.get("IMAGE_CAPTION_CACHE_TTL_SECONDS", str(30 * 24 * 3600))
+)
+# Images below either threshold are decorative (bullets, rules, icons) and
+# are not captioned at all
+MIN_CAPTION_IMAGE_SIDE = int(os.environ.get("MIN_CAPTION_IMAGE_SIDE", "32"))
+MIN_CAPTION_IMAGE_PIXELS = int(os.environ.get("MIN_CAPTION_IMAGE_PIXELS", "4096"))
+# dHashes at most this many bits apart are treated as the same image. Split
+# into one more band than this, two such hashes share at least one band
+# exactly, which is what the Redis lookup indexes on.
+NEAR_DUPLICATE_MAX_DISTANCE = 3
+DHASH_SIZE = 8
+_DHASH_BITS = DHASH_SIZE * DHASH_SIZE
+_DHASH_BANDS = NEAR_DUPLICATE_MAX_DISTANCE + 1
+_BAND_BITS = _DHASH_BITS // _DHASH_BANDS
+# Band sets keep the most recently cached dHashes, and entries older than
+# IMAGE_CAPTION_CACHE_TTL_SECONDS are dropped whenever a band is written
+IMAGE_CAPTION_BAND_MAX_HASHES = int(
+    os.environ.get("IMAGE_CAPTION_BAND_MAX_HASHES", "1000")
+)
+
+CAPTION_KEY_PREFIX = "image_caption"
+
+# Images per Florence call. Smaller documents are spread over every
+# Florence slot instead of filling one batch.
+IMAGE_CAPTION_BATCH_SIZE = int(
+    os.environ.get("IMAGE_CAPTION_BATCH_SIZE", str(FLORENCE_MAX_BATCH_SIZE))
+)
+_FLORENCE_SLOTS = FLORENCE_MAX_CONTAINERS * FLORENCE_MAX_INPUTS
+
+
+class ImageFingerprint(NamedTuple):
+    sha256: str
+    dhash: int
+
+
+class _ImageGroup(NamedTuple):
+    fingerprint: ImageFingerprint
+    image_bytes: bytes
+    image_ids: list[str]
+
+
+def caption_cache_enabled_for(encryption_type: str | None) -> bool:
+    """
+    Captions describe the image contents, so they are only shared across
+    sources for unencrypted notebooks.
+    """
+    return IMAGE_CAPTION_CACHE_ENABLED and encryption_type == "NotEncrypted"
+
+
+def dhash(image: Image.Image) -> int:
+    """
+    Difference hash: shrink to (DHASH_SIZE + 1) x DHASH_SIZE greyscale and
+    set one bit per pixel brighter than its right neighbour.
+    """
+    width = DHASH_SIZE + 1
+    pixels = (
+        image.convert("L")
+        .resize((width, DHASH_SIZE), Image.Resampling.LANCZOS)
+        .tobytes()
+    )
+    value = 0
+    for row in range(DHASH_SIZE):
+        for col in range(DHASH_SIZE):
+            left = pixels[row * width + col]
+            value = (value << 1) | (left > pixels[row * width + col + 1])
+    return value
+
+
+def fingerprint_image(image_bytes: bytes) -> ImageFingerprint | None:
+    """
+    Hash an image for caption lookups. Returns None for decorative images,
+    and for images Pillow cannot open, which are not worth captioning.
+    """
+    try:
+        with Image.open(BytesIO(image_bytes)) as image:
+            width, height = image.size
+            if (
+                min(width, height) < MIN_CAPTION_IMAGE_SIDE
+                or width * height < MIN_CAPTION_IMAGE_PIXELS
+            ):
+                return None
+            perceptual_hash = dhash(image)
+    except Exception:
+        return None
+    return ImageFingerprint(hashlib.sha256(image_bytes).hexdigest(), perceptual_hash)
+
+
+def _band_keys(user_id: str, perceptual_hash: int) -> list[str]:
+    mask = (1 << _BAND_BITS) - 1
+    return [
+        f"{CAPTION_KEY_PREFIX}:{user_id}:band:{band}:"
+        f"{(perceptual_hash >> (band * _BAND_BITS)) & mask:x}"
+        for band in range(_DHASH_BANDS)
+    ]
+
+
+def _exact_key(fingerprint: ImageFingerprint) -> str:
+    return f"{CAPTION_KEY_PREFIX}:exact:{fingerprint.sha256}"
+
+
+def _dhash_key(user_id: str, perceptual_hash: int) -> str:
+    return f"{CAPTION_KEY_PREFIX}:{user_id}:dhash:{perceptual_hash:016x}"
+
+
+def group_images(extracted_images: dict[str, bytes]) -> list[_ImageGroup]:
+    """
+    Drop decorative images and group the rest so exact and near duplicates
+    within a document share one caption. Groups keep first-seen order.
+    """
+    groups: list[_ImageGroup] = []
+    by_sha256: dict[str, _ImageGroup] = {}
+
+    for image_id, image_bytes in extracted_images.items():
+        fingerprint = fingerprint_image(image_bytes)
+        if fingerprint is None:
+            continue
+
+        group = by_sha256.get(fingerprint.sha256)
+        if group is None:
+            group = next(
+                (
+                    candidate
+                    for candidate in groups
+                    if (candidate.fingerprint.dhash ^ fingerprint.dhash).bit_count()
+                    <= NEAR_DUPLICATE_MAX_DISTANCE
+                ),
+                None,
+            )
+        if group is None:
+            group = _ImageGroup(fingerprint, image_bytes, [])
+            groups.append(group)
+        by_sha256.setdefault(fingerprint.sha256, group)
+        group.image_ids.append(image_id)
+
+    return groups
+
+
+async def _lookup_cached_captions(
+    client, user_id: str, fingerprints: list[ImageFingerprint]
+) -> list[str | None]:
+    """
+    Find cached captions by exact hash, then by any dHash the user has
+    cached within NEAR_DUPLICATE_MAX_DISTANCE bits.
+    """
+    captions = await client.mget([_exact_key(fp) for fp in fingerprints])
+
+    misses = [index for index, caption in enumerate(captions) if caption is None]
+    if not misses:
+        return captions
+
+    async with client.pipeline(transaction=False) as pipe:
+        for index in misses:
+            pipe.zunion(_band_keys(user_id, fingerprints[index].dhash))
+        candidate_sets = await pipe.execute()
+
+    nearest: dict[int, int] = {}
+    for index, candidates in zip(misses, candidate_sets, strict=True):
+        target = fingerprints[index].dhash
+        matches = [
+            (distance, candidate)
+            for candidate in (int(value, 16) for value in candidates)
+            if (distance := (candidate ^ target).bit_count())
+            <= NEAR_DUPLICATE_MAX_DISTANCE
+        ]
+        if matches:
+            nearest[index] = min(matches)[1]
+
+    if nearest:
+        near_captions = await client.mget(
+            [_dhash_key(user_id, h) for h in nearest.values()]
+        )
+        for index, caption in zip(nearest, near_captions, strict=True):
+            captions[index] = caption
+    return captions
+
+
+async def _store_captions(
+    client, user_id: str, fingerprints: list[ImageFingerprint], captions: list[str]
+):
+    now = time.time()
+    async with client.pipeline(transaction=False) as pipe:
+        for fingerprint, caption in zip(fingerprints, captions, strict=True):
+            pipe.set(
+                _exact_key(fingerprint), caption, ex=IMAGE_CAPTION_CACHE_TTL_SECONDS
+            )
+            pipe.set(
+                _dhash_key(user_id, fingerprint.dhash),
+                caption,
+                ex=IMAGE_CAPTION_CACHE_TTL_SECONDS,
+            )
+            for band_key in _band_keys(user_id, fingerprint.dhash):
+                pipe.zadd(band_key, {f"{fingerprint.dhash:016x}": now})
+                pipe.zremrangebyscore(
+                    band_key, "-inf", now - IMAGE_CAPTION_CACHE_TTL_SECONDS
+                )
+                pipe.zremrangebyrank(band_key, 0, -IMAGE_CAPTION_BAND_MAX_HASHES - 1)
+                pipe.expire(band_key, IMAGE_CAPTION_CACHE_TTL_SECONDS)
+        await pipe.execute()
+
+
+def batch_images(images: list[bytes]) -> list[list[bytes]]:
+    """
+    Split images into in-order batches of at most IMAGE_CAPTION_BATCH_SIZE,
+    using as many batches as there are Florence slots when that keeps them
+    smaller.
+    """
+    if not images:
+        return []
+    batch_size = max(
+        1,
+        min(IMAGE_CAPTION_BATCH_SIZE, math.ceil(len(images) / _FLORENCE_SLOTS)),
+    )
+    return [
+        images[start : start + batch_size]
+        for start in range(0, len(images), batch_size)
+    ]
+
+
+async def caption_images(images: list[bytes]) -> list[str]:
+    """
+    Caption images with Florence in batches, one `.map.aio` item per batch.
+    """
+    return [
+        caption
+        async for batch_captions in remote_summarizer.summarize_images.map.aio(
+            batch_images(images)
+        )
+        for caption in batch_captions
+    ]
+
+
+async def summarize_images(
+    extracted_images: dict[str, bytes], encryption_type: str, user_id: str
+) -> dict[str, str]:
+    """
+    Caption a document's images with Florence, mapping image ID to caption.
+
+    Decorative images are left out, so they keep their alt text. Duplicates
+    within the document are captioned once, and for unencrypted sources
+    captions cached from earlier documents are reused: exact copies from any
+    user's, near duplicates only from the same user's. Only the remaining
+    images reach Florence.
+    """
+    groups = await asyncio.to_thread(group_images, extracted_images)
+    fingerprints = [group.fingerprint for group in groups]
+    use_cache = caption_cache_enabled_for(encryption_type)
+
+    captions: list[str | None] = [None] * len(groups)
+    if use_cache and groups:
+        try:
+            captions = await _lookup_cached_captions(
+                get_async_redis_client(), user_id, fingerprints
+            )
+        except Exception as e:
+            print(f"⚠️ Image caption cache read failed: {e}", flush=True)
+
+    pending = [index for index, caption in enumerate(captions) if caption is None]
+    if pending:
+        new_captions = await caption_images(
+            [groups[index].image_bytes for index in pending]
+        )
+        for index, caption in zip(pending, new_captions, strict=True):
+            captions[index] = caption
+
+        if use_cache:
+            try:
+                await _store_captions(
+                    get_async_redis_client(),
+                    user_id,
+                    [fingerprints[index] for index in pending],
+                    new_captions,
+                )
+            except Exception as e:
+                print(f"⚠️ Image caption cache write failed: {e}", flush=True)
+
+    grouped_count = sum(len(group.image_ids) for group in groups)
+    print(
+        f"🖼️ Captioned {len(extracted_images)} images, {len(pending)} by "
+        f"Florence ({len(extracted_images) - grouped_count} decorative, "
+        f"{grouped_count - len(groups)} duplicates, "
+        f"{len(groups) - len(pending)} cached)",
+        flush=True,
+    )
+
+    return {
+        image_id: caption
+        for group, caption in zip(groups, captions, strict=True)
+        for image_id in group.image_ids
+    }
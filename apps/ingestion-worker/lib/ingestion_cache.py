@@ -0,0 +1,301 @@
+import asyncio
+import base64
+import gzip
+import hashlib
+import json
+import os
+import re
+import time
+from array import array
+from typing import BinaryIO, TypedDict
+from urllib.parse import urlsplit, urlunsplit
+from uuid import uuid4
+
+from lib.object_storage import delete_object, download_to_spooled_file, upload_object
+from lib.redis_client import get_async_redis_client, update_source_status
+from lib.save_to_db import get_notebook_id, save_to_db
+from schemas.index import (
+    Child_Chunks,
+    Chunk,
+    FileProcessingStatus,
+    Parent_Chunks,
+    images,
+)
+
+# Content-addressed cache of finished ingestions: chunks, parent chunks,
+# child embeddings and extracted images. Entries are blobs in object storage;
+# Redis tracks their sizes and last use so the total can be kept under
+# INGESTION_CACHE_MAX_BYTES by evicting the least recently used ones.
+INGESTION_CACHE_ENABLED = os.environ.get("INGESTION_CACHE_ENABLED", "true") == "true"
+INGESTION_CACHE_MAX_BYTES = int(
+    os.environ.get("INGESTION_CACHE_MAX_BYTES", str(10 * 1024**3))
+)
+# Bump when parsing, chunking or embedding changes so stale entries stop matching
+INGESTION_CACHE_VERSION = "v1"
+
+CACHE_STORAGE_PREFIX = "cache/ingestion"
+CACHE_LRU_KEY = "ingestion_cache:lru"
+CACHE_SIZES_KEY = "ingestion_cache:sizes"
+CACHE_TOTAL_BYTES_KEY = "ingestion_cache:total_bytes"
+HASH_CHUNK_BYTES = 1024 * 1024
+
+
+class CachedIngestion(TypedDict):
+    db_chunks: list[Chunk]
+    parent_chunks: list[Parent_Chunks]
+    child_chunks: list[Child_Chunks]
+    images: list[images]
+
+
+def cache_enabled_for(encryption_type: str | None) -> bool:
+    """
+    Only plaintext sources take part: cached entries are stored unencrypted,
+    so encrypted sources neither read nor populate the cache.
+    """
+    return INGESTION_CACHE_ENABLED and encryption_type == "NotEncrypted"
+
+
+def pdf_cache_key(pdf_stream: BinaryIO) -> str:
+    """
+    SHA-256 of the PDF bytes, read in chunks. Leaves the stream at the start.
+    """
+    digest = hashlib.sha256()
+    pdf_stream.seek(0)
+    while chunk := pdf_stream.read(HASH_CHUNK_BYTES):
+        digest.update(chunk)
+    pdf_stream.seek(0)
+    return f"{INGESTION_CACHE_VERSION}:pdf:{digest.hexdigest()}"
+
+
+def website_cache_key(website_url: str, text: str) -> str:
+    """
+    SHA-256 of the normalised URL plus the fetched text, so a changed page
+    is not served from the cache.
+    """
+    parts = urlsplit(website_url.strip())
+    normalised_url = urlunsplit(
+        (
+            parts.scheme.lower(),
+            parts.netloc.lower(),
+            parts.path.rstrip("/") or "/",
+            parts.query,
+            "",
+        )
+    )
+    digest = hashlib.sha256(f"{normalised_url}\n{text}".encode())
+    return f"{INGESTION_CACHE_VERSION}:url:{digest.hexdigest()}"
+
+
+def _storage_path(cache_key: str) -> str:
+    return f"{CACHE_STORAGE_PREFIX}/{cache_key.replace(':', '/')}.json.gz"
+
+
+def _serialise(entry: CachedIngestion) -> bytes:
+    payload = {
+        "db_chunks": entry["db_chunks"],
+        "parent_chunks": [
+            {
+                "id": chunk["id"],
+                "content": chunk["content"],
+                "children_ids": chunk["children_ids"],
+            }
+            for chunk in entry["parent_chunks"]
+        ],
+        # Embeddings as packed float32, a fraction of their JSON size
+        "child_chunks": [
+            {
+                "content": chunk["content"],
+                "parent_ids": chunk["parent_ids"],
+                "embeddings": base64.b64encode(
+                    array("f", chunk["embeddings"]).tobytes()
+                ).decode(),
+            }
+            for chunk in entry["child_chunks"]
+        ],
+        "images": {
+            img["image_id"]: base64.b64encode(img["image_bytes"]).decode()
+            for img in entry["images"]
+        },
+    }
+    return gzip.compress(json.dumps(payload).encode())
+
+
+def _deserialise(blob: BinaryIO) -> CachedIngestion:
+    with gzip.open(blob, "rt") as payload_file:
+        payload = json.load(payload_file)
+
+    child_chunks = []
+    for chunk in payload["child_chunks"]:
+        embeddings = array("f")
+        embeddings.frombytes(base64.b64decode(chunk["embeddings"]))
+        child_chunks.append(
+            {
+                "content": chunk["content"],
+                "parent_ids": chunk["parent_ids"],
+                "embeddings": memoryview(embeddings),
+            }
+        )
+
+    return {
+        "db_chunks": payload["db_chunks"],
+        "parent_chunks": payload["parent_chunks"],
+        "child_chunks": child_chunks,
+        "images": [
+            {"image_id": img_id, "image_bytes": base64.b64decode(img_bytes)}
+            for img_id, img_bytes in payload["images"].items()
+        ],
+    }
+
+
+def _remap_ids(entry: CachedIngestion) -> CachedIngestion:
+    """
+    Give a cached entry fresh parent chunk and image IDs. Parent chunk IDs are
+    primary keys, and image IDs name per-user storage objects that are deleted
+    with their source, so no two sources may share either.
+    """
+    parent_ids = {chunk["id"]: str(uuid4()) for chunk in entry["parent_chunks"]}
+    image_ids = {img["image_id"]: str(uuid4()) for img in entry["images"]}
+
+    if image_ids:
+        image_pattern = re.compile("|".join(map(re.escape, image_ids)))
+
+        def remap_images(text: str) -> str:
+            return image_pattern.sub(lambda m: image_ids[m.group(0)], text)
+
+    else:
+
+        def remap_images(text: str) -> str:
+            return text
+
+    return {
+        "db_chunks": [
+            {**chunk, "content": remap_images(chunk["content"])}
+            for chunk in entry["db_chunks"]
+        ],
+        "parent_chunks": [
+            {
+                **chunk,
+                "id": parent_ids[chunk["id"]],
+                "content": remap_images(chunk["content"]),
+            }
+            for chunk in entry["parent_chunks"]
+        ],
+        "child_chunks": [
+            {
+                **chunk,
+                "content": remap_images(chunk["content"]),
+                "parent_ids": [parent_ids.get(pid, pid) for pid in chunk["parent_ids"]],
+            }
+            for chunk in entry["child_chunks"]
+        ],
+        "images": [
+            {"image_id": image_ids[img["image_id"]], "image_bytes": img["image_bytes"]}
+            for img in entry["images"]
+        ],
+    }
+
+
+async def load_cached_ingestion(cache_key: str) -> CachedIngestion | None:
+    """
+    Return the cached ingestion for `cache_key` with fresh IDs, or None on a
+    miss. Cache failures are logged and treated as misses.
+    """
+    client = get_async_redis_client()
+    try:
+        if await client.zscore(CACHE_LRU_KEY, cache_key) is None:
+            return None
+
+        blob = await download_to_spooled_file(_storage_path(cache_key))
+        try:
+            entry = await asyncio.to_thread(_deserialise, blob)
+        finally:
+            blob.close()
+
+        await client.zadd(CACHE_LRU_KEY, {cache_key: time.time()}, xx=True)
+        print(f"🎯 Ingestion cache hit for {cache_key}", flush=True)
+        return await asyncio.to_thread(_remap_ids, entry)
+    except Exception as e:
+        print(f"⚠️ Ingestion cache read failed for {cache_key}: {e}", flush=True)
+        await _forget(cache_key)
+        return None
+
+
+async def save_cached_ingestion(
+    cached: CachedIngestion,
+    source_id: str,
+    user_id: str,
+    encryption_key: str | None,
+    encryption_type: str,
+):
+    """
+    Store a cached ingestion for a new source, skipping parsing, summarising,
+    chunking and embedding.
+    """
+    # The status the pipelines hold while writing chunks; "uploading" comes
+    # before "starting" and would move the UI backwards
+    await update_source_status(source_id, FileProcessingStatus.chunking.value)
+    # A hit is ready long before a parse would be, so the Source row may not
+    # exist yet
+    await get_notebook_id(source_id)
+    await save_to_db(
+        cached["child_chunks"],
+        cached["parent_chunks"],
+        source_id,
+        cached["db_chunks"],
+        cached["images"],
+        user_id,
+        encryption_type,
+        encryption_key,
+    )
+
+
+async def store_cached_ingestion(cache_key: str, entry: CachedIngestion):
+    """
+    Add an ingestion to the cache, then evict least recently used entries
+    until the cache fits INGESTION_CACHE_MAX_BYTES. Failures are only logged.
+    """
+    client = get_async_redis_client()
+    try:
+        blob = await asyncio.to_thread(_serialise, entry)
+        if len(blob) > INGESTION_CACHE_MAX_BYTES:
+            return
+
+        await upload_object(_storage_path(cache_key), blob, "application/gzip")
+        async with client.pipeline(transaction=True) as pipe:
+            pipe.hget(CACHE_SIZES_KEY, cache_key)
+            pipe.hset(CACHE_SIZES_KEY, cache_key, len(blob))
+            pipe.zadd(CACHE_LRU_KEY, {cache_key: time.time()})
+            previous_size, *_ = await pipe.execute()
+        await client.incrby(CACHE_TOTAL_BYTES_KEY, len(blob) - int(previous_size or 0))
+        print(f"🗄️ Cached ingestion {cache_key} ({len(blob)} bytes)", flush=True)
+
+        await _evict(client)
+    except Exception as e:
+        print(f"⚠️ Ingestion cache write failed for {cache_key}: {e}", flush=True)
+
+
+async def _evict(client):
+    while int(await client.get(CACHE_TOTAL_BYTES_KEY) or 0) > INGESTION_CACHE_MAX_BYTES:
+        # ZPOPMIN is atomic, so concurrent workers never evict the same entry
+        popped = await client.zpopmin(CACHE_LRU_KEY)
+        if not popped:
+            break
+        cache_key, _ = popped[0]
+        await _forget(cache_key, already_unlisted=True)
+        print(f"🧹 Evicted ingestion cache entry {cache_key}", flush=True)
+
+
+async def _forget(cache_key: str, already_unlisted: bool = False):
+    """
+    Drop an entry from the index and delete its blob.
+    """
+    client = get_async_redis_client()
+    try:
+        if not already_unlisted:
+            await client.zrem(CACHE_LRU_KEY, cache_key)
+        size = await client.hget(CACHE_SIZES_KEY, cache_key)
+        if size is not None and await client.hdel(CACHE_SIZES_KEY, cache_key):
+            await client.decrby(CACHE_TOTAL_BYTES_KEY, int(size))
+    except Exception as e:
+        print(f"⚠️ Failed to drop cache entry {cache_key}: {e}", flush=True)
+    await delete_object(_storage_path(cache_key))
@@ -0,0 +1,122 @@
+import asyncio
+import os
+import shutil
+from pathlib import Path
+from tempfile import SpooledTemporaryFile
+
+import httpx
+from supabase import Client, create_client
+
+SUPABASE_URL = os.environ.get("SUPABASE_URL")
+SUPABASE_KEY = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
+supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+BUCKET_NAME = "files"
+
+# "supabase" -> objects live in the Supabase `files` bucket (default)
+# "local"    -> objects live under LOCAL_OBJECT_STORAGE_DIR, for local development
+OBJECT_STORAGE_BACKENDS = ("supabase", "local")
+OBJECT_STORAGE_BACKEND = os.environ.get("OBJECT_STORAGE_BACKEND", "supabase")
+LOCAL_OBJECT_STORAGE_DIR = Path(
+    os.environ.get("LOCAL_OBJECT_STORAGE_DIR", "/tmp/krag-object-storage")
+)
+
+# Downloads stay in memory up to this size and spill to disk beyond it
+SPOOL_MAX_MEMORY_BYTES = int(
+    os.environ.get("SPOOL_MAX_MEMORY_BYTES", str(16 * 1024 * 1024))
+)
+DOWNLOAD_CHUNK_BYTES = 1024 * 1024
+SIGNED_URL_EXPIRY_SECONDS = 600
+
+if OBJECT_STORAGE_BACKEND not in OBJECT_STORAGE_BACKENDS:
+    raise ValueError(
+        f"Invalid object storage backend '{OBJECT_STORAGE_BACKEND}'. Allowed values: {', '.join(OBJECT_STORAGE_BACKENDS)}"
+    )
+
+
+def _local_path(storage_path: str) -> Path:
+    """
+    Resolve a storage path inside LOCAL_OBJECT_STORAGE_DIR, refusing paths
+    that would escape it.
+    """
+    root = LOCAL_OBJECT_STORAGE_DIR.resolve()
+    path = (root / storage_path).resolve()
+    if not path.is_relative_to(root):
+        raise ValueError(f"Invalid storage path: {storage_path}")
+    return path
+
+
+async def download_to_spooled_file(storage_path: str) -> SpooledTemporaryFile:
+    """
+    Stream an object into a spooled temporary file, positioned at the start.
+    The whole object is never held in memory as a single bytes value.
+    The caller is responsible for closing the returned file.
+    """
+    spooled_file = SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY_BYTES)
+    try:
+        if OBJECT_STORAGE_BACKEND == "local":
+
+            def _copy():
+                with open(_local_path(storage_path), "rb") as source_file:
+                    shutil.copyfileobj(source_file, spooled_file, DOWNLOAD_CHUNK_BYTES)
+
+            await asyncio.to_thread(_copy)
+        else:
+            signed = await asyncio.to_thread(
+                supabase.storage.from_(BUCKET_NAME).create_signed_url,
+                storage_path,
+                SIGNED_URL_EXPIRY_SECONDS,
+            )
+            signed_url = signed.get("signedURL") or signed.get("signedUrl")
+            if not signed_url:
+                raise ValueError(f"Could not sign storage path: {storage_path}")
+
+            async with httpx.AsyncClient(timeout=httpx.Timeout(60.0)) as client:
+                async with client.stream("GET", signed_url) as response:
+                    response.raise_for_status()
+                    async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_BYTES):
+                        spooled_file.write(chunk)
+
+        spooled_file.seek(0)
+        return spooled_file
+    except Exception:
+        spooled_file.close()
+        raise
+
+
+async def upload_object(storage_path: str, data: bytes, content_type: str):
+    """
+    Store `data` at `storage_path`, replacing any existing object.
+    """
+    if OBJECT_STORAGE_BACKEND == "local":
+
+        def _write():
+            path = _local_path(storage_path)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(data)
+
+        await asyncio.to_thread(_write)
+        return
+
+    await asyncio.to_thread(
+        supabase.storage.from_(BUCKET_NAME).upload,
+        path=storage_path,
+        file=data,
+        file_options={"content-type": content_type, "x-upsert": "true"},
+    )
+
+
+async def delete_object(storage_path: str) -> bool:
+    """
+    Delete an object once it is no longer needed. Returns True on success.
+    """
+    try:
+        if OBJECT_STORAGE_BACKEND == "local":
+            await asyncio.to_thread(_local_path(storage_path).unlink, missing_ok=True)
+        else:
+            await asyncio.to_thread(
+                supabase.storage.from_(BUCKET_NAME).remove, [storage_path]
+            )
+        return True
+    except Exception as e:
+        print(f"❌ Failed to delete {storage_path}: {e}", flush=True)
+        return False
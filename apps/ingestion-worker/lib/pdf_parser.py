@@ -1,71 +1,173 @@
+import asyncio
+import io
+import uuid
+from typing import BinaryIO
+
 from lib.chunker import process_chunks
-from lib.modal_clients import remote_embedder, remote_parser, remote_summarizer
+from lib.embeddings import embed_texts
+from lib.image_captions import summarize_images
+from lib.ingestion_cache import (
+    cache_enabled_for,
+    load_cached_ingestion,
+    pdf_cache_key,
+    save_cached_ingestion,
+    store_cached_ingestion,
+)
+from lib.modal_clients import remote_parser
+from lib.object_storage import download_to_spooled_file
+from lib.pdf_pipeline import PDF_PIPELINE_MODE, run_streaming_pdf_pipeline
 from lib.redis_client import update_source_status
 from lib.save_to_db import save_to_db
-from schemas.index import FileProcessingStatus
+from modal_services import pdf_upload_volume
+from schemas.index import FileProcessingStatus, PdfShard
 from utils.split_pdf_pages import (
-    base64_to_chunked_pdfs,
+    decode_base64_pdf,
+    pdf_to_shards,
     replace_markdown_images_with_html,
 )
 
 
+async def load_pdf(pdf_base_64: str | None, storage_path: str | None) -> BinaryIO:
+    """
+    Open the uploaded PDF, reading it from object storage when the task carries
+    a storage path and from the inline base64 otherwise. The caller closes it.
+    """
+    if storage_path:
+        return await download_to_spooled_file(storage_path)
+
+    # CPU-bound work runs in a thread so other sources keep progressing
+    pdf_file = await asyncio.to_thread(decode_base64_pdf, pdf_base_64 or "")
+    if pdf_file is None:
+        raise ValueError("Failed to decode PDF")
+    return pdf_file
+
+
+async def upload_shared_pdf(split_pdf_chunks: list[PdfShard]) -> str | None:
+    """
+    Upload the PDF that page-range shards share to the parser's volume once,
+    and point every shard at it instead of carrying the bytes. Returns the
+    upload's path, or None if the shards are standalone PDFs.
+    """
+    if not split_pdf_chunks or split_pdf_chunks[0]["page_range"] is None:
+        return None
+
+    pdf_path = f"/{uuid.uuid4()}.pdf"
+    pdf_bytes = split_pdf_chunks[0]["pdf_data"]
+
+    def upload():
+        with pdf_upload_volume.batch_upload() as batch:
+            batch.put_file(io.BytesIO(pdf_bytes), pdf_path)
+
+    await asyncio.to_thread(upload)
+    for shard in split_pdf_chunks:
+        shard["pdf_data"] = None
+        shard["pdf_path"] = pdf_path
+    return pdf_path
+
+
+async def remove_shared_pdf(pdf_path: str):
+    """
+    Remove an upload made by upload_shared_pdf once parsing is over.
+    """
+    try:
+        await pdf_upload_volume.remove_file.aio(pdf_path)
+    except Exception as e:
+        print(f"⚠️ Failed to remove uploaded PDF {pdf_path}: {e}", flush=True)
+
+
 async def parse_pdf(
-    pdf_base_64: str,
+    pdf_base_64: str | None,
     source_id: str,
     user_id: str,
     encryption_key: str | None,
     encryption_type: str,
+    storage_path: str | None = None,
 ):
     try:
-        update_source_status(source_id, FileProcessingStatus.starting.value)
-        split_pdf_chunks = base64_to_chunked_pdfs(pdf_base_64)
+        await update_source_status(source_id, FileProcessingStatus.starting.value)
+        pdf_file = await load_pdf(pdf_base_64, storage_path)
+        try:
+            cache_key = None
+            if cache_enabled_for(encryption_type):
+                cache_key = await asyncio.to_thread(pdf_cache_key, pdf_file)
+                cached = await load_cached_ingestion(cache_key)
+                if cached:
+                    await save_cached_ingestion(
+                        cached, source_id, user_id, encryption_key, encryption_type
+                    )
+                    await update_source_status(
+                        source_id, FileProcessingStatus.completed.value
+                    )
+                    return
+
+            split_pdf_chunks = await asyncio.to_thread(pdf_to_shards, pdf_file)
+        finally:
+            pdf_file.close()
 
         if not split_pdf_chunks:
             raise ValueError("Failed to split PDF into chunks")
 
-        # 2. Connect to GPU
-        update_source_status(source_id, FileProcessingStatus.extracting.value)
-        results = [
-            result
-            async for result in remote_parser.parse_secure_pdf.map.aio(split_pdf_chunks)
-        ]
+        pdf_path = await upload_shared_pdf(split_pdf_chunks)
+        try:
+            if PDF_PIPELINE_MODE == "streaming":
+                collected = await run_streaming_pdf_pipeline(
+                    split_pdf_chunks,
+                    source_id,
+                    user_id,
+                    encryption_key,
+                    encryption_type,
+                    collect=cache_key is not None,
+                )
+                await update_source_status(
+                    source_id, FileProcessingStatus.completed.value
+                )
+                if cache_key:
+                    await store_cached_ingestion(cache_key, collected)
+                return
+
+            # 2. Connect to GPU
+            await update_source_status(source_id, FileProcessingStatus.extracting.value)
+            results = [
+                result
+                async for result in remote_parser.parse_secure_pdf.map.aio(
+                    [shard["pdf_data"] for shard in split_pdf_chunks],
+                    [shard["page_range"] for shard in split_pdf_chunks],
+                    [shard["pdf_path"] for shard in split_pdf_chunks],
+                )
+            ]
+        finally:
+            if pdf_path:
+                await remove_shared_pdf(pdf_path)
     except Exception:
-        update_source_status(source_id, FileProcessingStatus.failed.value)
+        await update_source_status(source_id, FileProcessingStatus.failed.value)
         raise
 
     extracted_text = "".join([result[0] + "\n\n" for result in results])
     extracted_images = {k: v for result in results for k, v in result[1].items()}
 
-    image_uuids = list(extracted_images.keys())
-    image_bytes_list = list(extracted_images.values())
-
-    if image_bytes_list:
+    if extracted_images:
         try:
-            update_source_status(source_id, FileProcessingStatus.images.value)
-            summary_results = [
-                result
-                async for result in remote_summarizer.summarize_image.map.aio(
-                    image_bytes_list
-                )
-            ]
-
-            # Zip IDs back with their summaries so you know which is which
-            image_summaries = dict(zip(image_uuids, summary_results, strict=True))
+            await update_source_status(source_id, FileProcessingStatus.images.value)
+            image_summaries = await summarize_images(
+                extracted_images, encryption_type, user_id
+            )
         except Exception:
-            update_source_status(source_id, FileProcessingStatus.failed.value)
+            await update_source_status(source_id, FileProcessingStatus.failed.value)
             raise
     else:
         image_summaries = {}
 
     if image_summaries:
         # Replace markdown image syntax with HTML-like format
-        extracted_text = replace_markdown_images_with_html(
-            extracted_text, image_summaries
+        extracted_text = await asyncio.to_thread(
+            replace_markdown_images_with_html, extracted_text, image_summaries
         )
 
     try:
-        update_source_status(source_id, FileProcessingStatus.chunking.value)
-        db_chunks, parent_chunks, child_chunks = process_chunks(extracted_text)
+        await update_source_status(source_id, FileProcessingStatus.chunking.value)
+        db_chunks, parent_chunks, child_chunks = await asyncio.to_thread(
+            process_chunks, extracted_text
+        )
 
         # Extract text content from child chunks for embedding
         child_texts = [chunk["content"] for chunk in child_chunks]
@@ -74,9 +176,7 @@ async def parse_pdf(
             flush=True,
         )
 
-        # Use .spawn() for async execution, then .get() to get the result
-        result_handle = remote_embedder.generate_embeddings.spawn(child_texts)
-        embeddings = result_handle.get()
+        embeddings = await embed_texts(child_texts)
 
         # Format child chunks for database
         formatted_child_chunks = []
@@ -110,9 +210,20 @@ async def parse_pdf(
             encryption_key,
         )
 
-        update_source_status(source_id, FileProcessingStatus.completed.value)
-
-        return
+        await update_source_status(source_id, FileProcessingStatus.completed.value)
     except Exception:
-        update_source_status(source_id, FileProcessingStatus.failed.value)
+        await update_source_status(source_id, FileProcessingStatus.failed.value)
         raise
+
+    if cache_key:
+        # Parent chunks are only encrypted in place for encrypted sources,
+        # which never get a cache key, so these are still plaintext
+        await store_cached_ingestion(
+            cache_key,
+            {
+                "db_chunks": db_chunks,
+                "parent_chunks": parent_chunks,
+                "child_chunks": formatted_child_chunks,
+                "images": formatted_images,
+            },
+        )
@@ -0,0 +1,254 @@
+import asyncio
+import os
+import time
+
+from lib.chunker import process_chunks
+from lib.embeddings import embed_texts
+from lib.image_captions import summarize_images
+from lib.ingestion_cache import CachedIngestion
+from lib.modal_clients import remote_parser
+from lib.redis_client import update_source_status
+from lib.save_to_db import (
+    build_source_content,
+    delete_source_chunks,
+    encrypt_parent_chunks,
+    get_notebook_id,
+    insert_document_chunks,
+    insert_parent_chunks,
+    upload_images,
+)
+from schemas.index import Chunk, FileProcessingStatus, PdfShard
+from utils.db_client import get_db
+from utils.split_pdf_pages import replace_markdown_images_with_html
+
+# "streaming" -> every parsed shard flows through the later stages on its own (default)
+# "batch"     -> each stage waits for the whole document before the next one starts
+PDF_PIPELINE_MODES = ("streaming", "batch")
+PDF_PIPELINE_MODE = os.environ.get("PDF_PIPELINE_MODE", "streaming")
+# Shards buffered between two stages before the upstream stage waits
+PIPELINE_QUEUE_SIZE = int(os.environ.get("PIPELINE_QUEUE_SIZE", "2"))
+# Shards being parsed or waiting to be chunked; no further shard is sent to
+# the parser until the chunker has taken one
+PIPELINE_PARSE_CONCURRENCY = int(os.environ.get("PIPELINE_PARSE_CONCURRENCY", "8"))
+# Shards embedded at the same time
+PIPELINE_EMBEDDING_CONCURRENCY = int(
+    os.environ.get("PIPELINE_EMBEDDING_CONCURRENCY", "2")
+)
+
+if PDF_PIPELINE_MODE not in PDF_PIPELINE_MODES:
+    raise ValueError(
+        f"Invalid PDF pipeline mode '{PDF_PIPELINE_MODE}'. Allowed values: {', '.join(PDF_PIPELINE_MODES)}"
+    )
+
+# Statuses the pipeline reports, in order; stages overlap, so the reported
+# status only ever moves forward
+_STATUS_ORDER = [
+    FileProcessingStatus.extracting,
+    FileProcessingStatus.images,
+    FileProcessingStatus.chunking,
+]
+# Marks the end of a stage's output
+_DONE = None
+
+
+class _StatusTracker:
+    def __init__(self, source_id: str):
+        self.source_id = source_id
+        self.current = -1
+
+    async def advance(self, status: FileProcessingStatus):
+        position = _STATUS_ORDER.index(status)
+        if position > self.current:
+            self.current = position
+            await update_source_status(self.source_id, status.value)
+
+
+async def run_streaming_pdf_pipeline(
+    split_pdf_chunks: list[PdfShard],
+    source_id: str,
+    user_id: str,
+    encryption_key: str | None,
+    encryption_type: str,
+    collect: bool = False,
+) -> CachedIngestion | None:
+    """
+    Parse, summarise, chunk, embed and store a PDF shard by shard.
+
+    Up to PIPELINE_PARSE_CONCURRENCY shards are parsed ahead of chunking, and
+    their images summarised as soon as each one is parsed. Chunking then takes
+    the shards in document order, so chunk IDs stay sequential across the
+    whole document. Embedding and DB writes run behind bounded queues, so a
+    stage only gets ahead of the next one by PIPELINE_QUEUE_SIZE shards.
+
+    Each shard is chunked on its own, so parent chunks never span two shards:
+    the text at a shard boundary ends one parent and starts the next.
+
+    Chunks are written as they are produced, and Source.content is set once
+    every shard has been stored. If any stage fails, the chunks written so far
+    are removed. Rows left behind by a worker that died mid-ingest are removed
+    before the first shard is written, so a requeued task replaces them
+    instead of adding duplicates. Unlike save_to_db the writes are not one
+    transaction: a source's chunks become searchable shard by shard.
+
+    With `collect`, the chunks, embeddings and images are also returned,
+    unencrypted, so they can be cached.
+    """
+    db = get_db()
+    status = _StatusTracker(source_id)
+    shard_count = len(split_pdf_chunks)
+
+    # Parsed shards, keyed by index, waiting for their turn to be chunked
+    ready_shards: dict[int, tuple[str, dict[str, bytes]]] = {}
+    shard_ready = asyncio.Condition()
+    parse_slots = asyncio.Semaphore(PIPELINE_PARSE_CONCURRENCY)
+    embed_queue: asyncio.Queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    write_queue: asyncio.Queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+
+    source_content: list[Chunk] = []
+    image_paths: list[str] = []
+    collected: CachedIngestion = {
+        "db_chunks": source_content,
+        "parent_chunks": [],
+        "child_chunks": [],
+        "images": [],
+    }
+    parent_rows = 0
+    child_rows = 0
+    start_time = time.perf_counter()
+
+    async def parse_shard(index: int, shard: PdfShard):
+        await status.advance(FileProcessingStatus.extracting)
+        text, extracted_images = await remote_parser.parse_secure_pdf.remote.aio(
+            shard["pdf_data"], shard["page_range"], shard["pdf_path"]
+        )
+
+        if extracted_images:
+            await status.advance(FileProcessingStatus.images)
+            summaries = await summarize_images(
+                extracted_images, encryption_type, user_id
+            )
+            text = await asyncio.to_thread(
+                replace_markdown_images_with_html, text, summaries
+            )
+
+        async with shard_ready:
+            ready_shards[index] = (text, extracted_images)
+            shard_ready.notify_all()
+
+    async def parse_shards():
+        # Slots are taken in document order, so the shard the chunker is
+        # waiting for always holds one
+        async with asyncio.TaskGroup() as parsers:
+            for index, shard in enumerate(split_pdf_chunks):
+                await parse_slots.acquire()
+                parsers.create_task(parse_shard(index, shard))
+
+    async def chunk_shards():
+        next_id = 0
+        for index in range(shard_count):
+            async with shard_ready:
+                await shard_ready.wait_for(lambda index=index: index in ready_shards)
+                text, extracted_images = ready_shards.pop(index)
+            parse_slots.release()
+
+            await status.advance(FileProcessingStatus.chunking)
+            db_chunks, parent_chunks, child_chunks = await asyncio.to_thread(
+                process_chunks, text + "\n\n", next_id
+            )
+            next_id += len(db_chunks)
+            source_content.extend(db_chunks)
+            await embed_queue.put((parent_chunks, child_chunks, extracted_images))
+
+        for _ in range(PIPELINE_EMBEDDING_CONCURRENCY):
+            await embed_queue.put(_DONE)
+
+    async def embed_shards():
+        while (item := await embed_queue.get()) is not _DONE:
+            parent_chunks, child_chunks, extracted_images = item
+            if child_chunks:
+                embeddings = await embed_texts(
+                    [chunk["content"] for chunk in child_chunks]
+                )
+                for chunk, embedding in zip(child_chunks, embeddings, strict=True):
+                    chunk["embeddings"] = embedding
+            await write_queue.put((parent_chunks, child_chunks, extracted_images))
+
+    async def write_shards(notebook_id: str):
+        nonlocal parent_rows, child_rows
+        while (item := await write_queue.get()) is not _DONE:
+            parent_chunks, child_chunks, extracted_images = item
+            shard_images = [
+                {"image_id": img_id, "image_bytes": img_bytes}
+                for img_id, img_bytes in extracted_images.items()
+            ]
+            if collect:
+                # Copied before encrypt_parent_chunks rewrites them in place
+                collected["parent_chunks"].extend(map(dict, parent_chunks))
+                collected["child_chunks"].extend(child_chunks)
+                collected["images"].extend(shard_images)
+
+            image_paths.extend(await upload_images(shard_images, user_id))
+            encrypt_parent_chunks(parent_chunks, encryption_type, encryption_key)
+            await insert_parent_chunks(db, parent_chunks, source_id)
+            parent_rows += len(parent_chunks)
+            if child_chunks:
+                child_rows += await insert_document_chunks(
+                    db,
+                    child_chunks,
+                    source_id,
+                    notebook_id,
+                    encryption_type,
+                    encryption_key,
+                )
+
+    async def embed_then_close():
+        async with asyncio.TaskGroup() as embedders:
+            for _ in range(PIPELINE_EMBEDDING_CONCURRENCY):
+                embedders.create_task(embed_shards())
+        await write_queue.put(_DONE)
+
+    try:
+        notebook_id = await get_notebook_id(source_id)
+        # A requeued task starts over, so drop what an earlier attempt wrote
+        await delete_source_chunks(db, source_id)
+        async with asyncio.TaskGroup() as stages:
+            stages.create_task(parse_shards())
+            stages.create_task(chunk_shards())
+            stages.create_task(embed_then_close())
+            stages.create_task(write_shards(notebook_id))
+
+        await db.source.update(
+            where={"id": source_id},
+            data={
+                "processingStatus": FileProcessingStatus.completed,
+                "content": build_source_content(
+                    source_content, encryption_type, encryption_key
+                ),
+                "image_paths": image_paths,
+            },
+        )
+    except BaseException as e:
+        try:
+            await delete_source_chunks(db, source_id)
+        except Exception as cleanup_error:
+            print(
+                f"❌ Failed to remove partial chunks for {source_id}: {cleanup_error}",
+                flush=True,
+            )
+        # Surface the stage's own error rather than the TaskGroup wrappers
+        error = e
+        while isinstance(error, BaseExceptionGroup):
+            error = error.exceptions[0]
+        if error is not e:
+            raise error from e
+        raise
+
+    elapsed = time.perf_counter() - start_time
+    total_rows = parent_rows + child_rows
+    print(
+        f"💾 Streamed {shard_count} shards into {parent_rows} parent and "
+        f"{child_rows} child chunks in {elapsed:.2f}s "
+        f"({total_rows / elapsed if elapsed > 0 else 0:.0f} rows/s)",
+        flush=True,
+    )
+    return collected if collect else None
@@ -1,22 +1,27 @@
 import os
 
 import redis
+import redis.asyncio
+
+_CLIENT_OPTIONS = {
+    "decode_responses": True,
+    "socket_connect_timeout": 5,
+    "socket_keepalive": True,
+    "health_check_interval": 30,
+    "retry_on_timeout": True,
+}
 
 
-def _create_redis_client():
-    """Create a Redis client with connection pooling."""
+def _get_redis_url() -> str:
     redis_url = os.environ.get("REDIS_URL")
     if not redis_url:
         raise RuntimeError("REDIS_URL environment variable is not set")
+    return redis_url
 
-    return redis.from_url(
-        redis_url,
-        decode_responses=True,
-        socket_connect_timeout=5,
-        socket_keepalive=True,
-        health_check_interval=30,
-        retry_on_timeout=True,
-    )
+
+def _create_redis_client():
+    """Create a Redis client with connection pooling."""
+    return redis.from_url(_get_redis_url(), **_CLIENT_OPTIONS)
 
 
 # Singleton Redis client instance - can be imported directly
@@ -56,6 +61,38 @@ def get_redis_client():
     return _initialize_client()
 
 
+# Singleton asyncio Redis client, used by the task consumer and status updates
+# so that Redis calls do not stall the event loop while other sources are processed
+async_redis_client = None
+
+
+def get_async_redis_client():
+    """Get the asyncio Redis client instance (lazy initialization)."""
+    global async_redis_client
+    if async_redis_client is None:
+        async_redis_client = redis.asyncio.from_url(_get_redis_url(), **_CLIENT_OPTIONS)
+        print("🔌 Async Redis client initialized", flush=True)
+    return async_redis_client
+
+
+async def close_async_redis_client():
+    """Close the asyncio Redis connection and reset the singleton."""
+    global async_redis_client
+    if async_redis_client:
+        try:
+            await async_redis_client.aclose()
+            print("🔌 Async Redis connection closed", flush=True)
+        except Exception:
+            pass  # Ignore errors during cleanup
+        async_redis_client = None
+
+
+async def reset_async_redis_client():
+    """Reset the asyncio Redis client (useful for reconnection)."""
+    await close_async_redis_client()
+    return get_async_redis_client()
+
+
 # Allowed FileProcessingStatus values (from Prisma schema)
 ALLOWED_STATUSES = {
     "uploading",
@@ -71,7 +108,7 @@ ALLOWED_STATUSES = {
 }
 
 
-def update_source_status(source_id: str, status: str) -> bool:
+async def update_source_status(source_id: str, status: str) -> bool:
     """
     Update the processing status of a source in Redis.
 
@@ -90,11 +127,11 @@ def update_source_status(source_id: str, status: str) -> bool:
             f"Invalid status '{status}'. Allowed values: {', '.join(sorted(ALLOWED_STATUSES))}"
         )
 
-    client = get_redis_client()
+    client = get_async_redis_client()
     key = f"source:{source_id}"
 
     try:
-        client.set(key, status)
+        await client.set(key, status)
         print(f"📝 Updated source {source_id} status to '{status}'", flush=True)
         return True
     except Exception as e:
@@ -1,7 +1,11 @@
 import asyncio
 import os
+import time
+from datetime import timedelta
+from uuid import uuid4
 
-from generated.db import fields
+from generated.db import Prisma, fields
+from lib.object_storage import BUCKET_NAME, supabase
 from schemas.index import (
     Child_Chunks,
     Chunk,
@@ -9,14 +13,17 @@ from schemas.index import (
     Parent_Chunks,
     images,
 )
-from supabase import Client, create_client
 from utils.db_client import get_db
 from utils.encrypt import encrypt_data
 
-SUPABASE_URL = os.environ.get("SUPABASE_URL")
-SUPABASE_KEY = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-BUCKET_NAME = "files"
+# Number of DocumentChunk rows sent per multi-row INSERT statement
+DOCUMENT_CHUNK_BATCH_SIZE = int(os.environ.get("DOCUMENT_CHUNK_BATCH_SIZE", "500"))
+# Postgres caps a single statement at 65535 bind parameters: 2 shared + 4 per row
+MAX_ROWS_PER_STATEMENT = (65535 - 2) // 4
+# Large sources can take a while to write, well past Prisma's 5s default
+SAVE_TRANSACTION_TIMEOUT = timedelta(
+    seconds=int(os.environ.get("SAVE_TRANSACTION_TIMEOUT_SECONDS", "600"))
+)
 
 
 async def upload_single_image(user_id: str, img_id: str, img_bytes: bytes):
@@ -42,18 +49,78 @@ async def upload_single_image(user_id: str, img_id: str, img_bytes: bytes):
         return False
 
 
-async def save_to_db(
+def format_vector(embedding) -> str:
+    """
+    Render an embedding as a pgvector text literal, e.g. "[0.1,0.2]". Takes
+    a list or a memoryview row of a packed embedding buffer.
+    """
+    return "[" + ",".join(map(repr, embedding)) + "]"
+
+
+async def insert_document_chunks(
+    db: Prisma,
     child_chunks: list[Child_Chunks],
-    parent_chunks: list[Parent_Chunks],
     source_id: str,
-    split_content: list[Chunk],
-    images: list[images],
-    user_id: str,
+    notebook_id: str,
     encryption_type: str,
     encryption_key: str | None,
-):
-    db = get_db()
+    batch_size: int = DOCUMENT_CHUNK_BATCH_SIZE,
+) -> int:
+    """
+    Insert child chunks as multi-row INSERT batches instead of one statement per row.
+    Returns the number of rows written.
+    """
+    batch_size = max(1, min(batch_size, MAX_ROWS_PER_STATEMENT))
+    rows_written = 0
+
+    for start in range(0, len(child_chunks), batch_size):
+        batch = child_chunks[start : start + batch_size]
+
+        # $1/$2 are the shared sourceId/notebookId, every row then takes 4 parameters
+        query_params: list = [source_id, notebook_id]
+        values_sql = []
+        for child_chunk in batch:
+            content = child_chunk["content"]
+            if encryption_type == "AdvancedEncryption" and encryption_key:
+                content = encrypt_data(content, encryption_key)
+
+            parent_ids = child_chunk["parent_ids"]
+            if not isinstance(parent_ids, list):
+                parent_ids = [str(parent_ids)] if parent_ids else []
+            else:
+                parent_ids = [str(pid) for pid in parent_ids if pid]
+
+            param_index = len(query_params)
+            values_sql.append(
+                f"(${param_index + 1}, ${param_index + 2}, ${param_index + 3}::text[], "
+                f"${param_index + 4}::vector(1024), $1, $2)"
+            )
+            query_params.extend(
+                [
+                    str(uuid4()),
+                    content,
+                    parent_ids,
+                    format_vector(child_chunk["embeddings"]),
+                ]
+            )
+
+        # Use raw SQL since Prisma client doesn't have DocumentChunk mutations
+        await db.execute_raw(
+            f"""
+            INSERT INTO "DocumentChunk" (id, content, "parentIds", embedding, "sourceId", "notebookId")
+            VALUES {", ".join(values_sql)}
+            """,
+            *query_params,
+        )
+        rows_written += len(batch)
+
+    return rows_written
 
+
+async def upload_images(images: list[images], user_id: str) -> list[str]:
+    """
+    Upload extracted images to Supabase storage. Returns their storage paths.
+    """
     upload_tasks = []
     image_paths = []
     for img in images:
@@ -78,33 +145,51 @@ async def save_to_db(
         )
         await asyncio.gather(*upload_tasks)
 
-    if split_content:
-        content_list = [dict(item) for item in split_content]
-        # Encrypt content before converting to Json if needed
-        if encryption_type != "NotEncrypted" and encryption_key:
-            for content in content_list:
-                content["content"] = encrypt_data(content["content"], encryption_key)
-        content_data = fields.Json(content_list)
-    else:
+    return image_paths
+
+
+def build_source_content(
+    split_content: list[Chunk], encryption_type: str, encryption_key: str | None
+):
+    """
+    Build the Source.content Json value, encrypted when the notebook is.
+    """
+    if not split_content:
         # For nullable Json fields, pass None explicitly
-        content_data = None
+        return None
 
+    content_list = [dict(item) for item in split_content]
+    # Encrypt content before converting to Json if needed
+    if encryption_type != "NotEncrypted" and encryption_key:
+        for content in content_list:
+            content["content"] = encrypt_data(content["content"], encryption_key)
+    return fields.Json(content_list)
+
+
+def encrypt_parent_chunks(
+    parent_chunks: list[Parent_Chunks],
+    encryption_type: str,
+    encryption_key: str | None,
+):
+    """
+    Encrypt parent chunk contents in place when the notebook is encrypted.
+    """
     if encryption_type != "NotEncrypted" and encryption_key:
-        # Encrypt parent chunks
         for parent_chunk in parent_chunks:
             parent_chunk["content"] = encrypt_data(
                 parent_chunk["content"], encryption_key
             )
 
-    await db.source.update(
-        where={"id": source_id},
-        data={
-            "processingStatus": FileProcessingStatus.completed,
-            "content": content_data,
-            "image_paths": image_paths,
-        },
-    )
-    await db.parentchunk.create_many(
+
+async def insert_parent_chunks(
+    db: Prisma, parent_chunks: list[Parent_Chunks], source_id: str
+) -> int:
+    """
+    Insert already encrypted parent chunks. Returns the number of rows written.
+    """
+    if not parent_chunks:
+        return 0
+    return await db.parentchunk.create_many(
         data=[
             {
                 "id": parent_chunk["id"],
@@ -114,39 +199,77 @@ async def save_to_db(
             for parent_chunk in parent_chunks
         ]
     )
-    if child_chunks:
-        from uuid import uuid4
 
-        # Use raw SQL since Prisma client doesn't have DocumentChunk mutations
-        insert_query = """
-            INSERT INTO "DocumentChunk" (id, content, "parentIds", embedding, "sourceId")
-            VALUES ($1, $2, $3::text[], $4::vector(1024), $5)
-        """
 
-        for child_chunk in child_chunks:
-            chunk_id = str(uuid4())
-            content = child_chunk["content"]
+async def delete_source_chunks(db: Prisma, source_id: str):
+    """
+    Remove every parent and child chunk written for a source so far.
+    """
+    await db.execute_raw('DELETE FROM "DocumentChunk" WHERE "sourceId" = $1', source_id)
+    await db.parentchunk.delete_many(where={"sourceId": source_id})
 
-            if encryption_type == "AdvancedEncryption" and encryption_key:
-                content = encrypt_data(content, encryption_key)
 
-            parent_ids = child_chunk["parent_ids"]
+async def get_notebook_id(source_id: str, attempts: int = 10) -> str:
+    """
+    Look up the notebook of a source. The web app creates the Source row just
+    after queueing the task, so a shard or a cache hit can be ready to store
+    before it exists.
+    """
+    db = get_db()
+    for _ in range(attempts):
+        source = await db.source.find_unique(where={"id": source_id})
+        if source:
+            return source.notebookId
+        await asyncio.sleep(1)
+    raise ValueError(f"Source {source_id} not found")
 
-            if not isinstance(parent_ids, list):
-                parent_ids = [str(parent_ids)] if parent_ids else []
-            else:
-                parent_ids = [str(pid) for pid in parent_ids if pid]
 
-            embeddings = child_chunk["embeddings"]
-            embedding_str = str(embeddings)
-
-            # Pass parent_ids as list - Prisma Python should handle conversion
-            # If that doesn't work, we'll need to format as PostgreSQL array literal
-            await db.execute_raw(
-                insert_query,
-                chunk_id,
-                content,
-                parent_ids if parent_ids else [],
-                embedding_str,
+async def save_to_db(
+    child_chunks: list[Child_Chunks],
+    parent_chunks: list[Parent_Chunks],
+    source_id: str,
+    split_content: list[Chunk],
+    images: list[images],
+    user_id: str,
+    encryption_type: str,
+    encryption_key: str | None,
+    batch_size: int = DOCUMENT_CHUNK_BATCH_SIZE,
+):
+    db = get_db()
+
+    image_paths = await upload_images(images, user_id)
+    content_data = build_source_content(split_content, encryption_type, encryption_key)
+    encrypt_parent_chunks(parent_chunks, encryption_type, encryption_key)
+
+    # Write the source, its parent chunks and its child chunks atomically so a
+    # failure part-way never leaves a half-written source behind
+    start_time = time.perf_counter()
+    async with db.tx(timeout=SAVE_TRANSACTION_TIMEOUT) as transaction:
+        source = await transaction.source.update(
+            where={"id": source_id},
+            data={
+                "processingStatus": FileProcessingStatus.completed,
+                "content": content_data,
+                "image_paths": image_paths,
+            },
+        )
+        await insert_parent_chunks(transaction, parent_chunks, source_id)
+        child_rows = 0
+        if child_chunks:
+            child_rows = await insert_document_chunks(
+                transaction,
+                child_chunks,
                 source_id,
+                source.notebookId,
+                encryption_type,
+                encryption_key,
+                batch_size,
             )
+
+    elapsed = time.perf_counter() - start_time
+    total_rows = len(parent_chunks) + child_rows
+    print(
+        f"💾 Saved {len(parent_chunks)} parent and {child_rows} child chunks in "
+        f"{elapsed:.2f}s ({total_rows / elapsed if elapsed > 0 else 0:.0f} rows/s)",
+        flush=True,
+    )
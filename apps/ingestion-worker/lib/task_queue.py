@@ -0,0 +1,232 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+
+QUEUE_NAME = "file_processing_queue"
+# Tasks being worked on. A claimed task is moved here atomically and then
+# replaced by its claim token, so two claims of the same message stay apart.
+PROCESSING_QUEUE_NAME = f"{QUEUE_NAME}:processing"
+# Sorted set of claim tokens scored by the time their lease runs out
+LEASES_KEY = f"{QUEUE_NAME}:leases"
+# Hash of claim token -> raw message
+CLAIMS_KEY = f"{QUEUE_NAME}:claims"
+# Sorted set of messages left in the processing list by a worker that died
+# before recording its claim, scored by when they are requeued
+UNCLAIMED_KEY = f"{QUEUE_NAME}:unclaimed"
+# Hash of how many times each task has been claimed
+ATTEMPTS_KEY = f"{QUEUE_NAME}:attempts"
+# Tasks that were claimed TASK_MAX_ATTEMPTS times without being acknowledged
+DEAD_LETTER_QUEUE_NAME = f"{QUEUE_NAME}:dead"
+
+# "reliable" -> tasks stay in the processing list until acknowledged (default)
+# "simple"   -> BLPOP, a task is lost if the worker dies while processing it
+TASK_QUEUE_MODES = ("reliable", "simple")
+TASK_QUEUE_MODE = os.environ.get("TASK_QUEUE_MODE", "reliable")
+
+# A claimed task is handed to another worker if its lease is not renewed
+# within this window. Live workers renew every third of it.
+TASK_VISIBILITY_TIMEOUT_SECONDS = int(
+    os.environ.get("TASK_VISIBILITY_TIMEOUT_SECONDS", "300")
+)
+TASK_MAX_ATTEMPTS = int(os.environ.get("TASK_MAX_ATTEMPTS", "3"))
+# How often each worker looks for expired leases
+TASK_REAP_INTERVAL_SECONDS = int(os.environ.get("TASK_REAP_INTERVAL_SECONDS", "30"))
+
+if TASK_QUEUE_MODE not in TASK_QUEUE_MODES:
+    raise ValueError(
+        f"Invalid task queue mode '{TASK_QUEUE_MODE}'. Allowed values: {', '.join(TASK_QUEUE_MODES)}"
+    )
+
+# Swaps a message BLMOVEd into the processing list for its claim token and
+# records the lease. Fails if the reaper has requeued the message meanwhile.
+_CLAIM_SCRIPT = """
+local processing, leases, claims, unclaimed, attempts = KEYS[1], KEYS[2], KEYS[3], KEYS[4], KEYS[5]
+local task, token, deadline = ARGV[1], ARGV[2], ARGV[3]
+
+if redis.call('LREM', processing, -1, task) == 0 then
+    return 0
+end
+redis.call('RPUSH', processing, token)
+redis.call('ZREM', unclaimed, task)
+redis.call('HSET', claims, token, task)
+redis.call('ZADD', leases, deadline, token)
+redis.call('HINCRBY', attempts, task, 1)
+return 1
+"""
+
+# Acknowledges a claim only while its lease is held. Once the reaper has
+# requeued the task it may be claimed again, and that claim is left alone.
+_ACK_SCRIPT = """
+local processing, leases, claims, attempts = KEYS[1], KEYS[2], KEYS[3], KEYS[4]
+local token = ARGV[1]
+
+if not redis.call('ZSCORE', leases, token) then
+    return 0
+end
+local task = redis.call('HGET', claims, token)
+redis.call('LREM', processing, 1, token)
+redis.call('ZREM', leases, token)
+redis.call('HDEL', claims, token)
+if task then
+    redis.call('HDEL', attempts, task)
+end
+return 1
+"""
+
+# Runs atomically, so any number of workers can reap concurrently.
+# A raw message in the processing list belongs to a worker that died between
+# BLMOVE and recording its claim; it is requeued a full timeout after it is
+# first seen, like an expired lease.
+_REAP_SCRIPT = """
+local queue, processing, leases, claims, unclaimed, attempts, dead = KEYS[1], KEYS[2], KEYS[3], KEYS[4], KEYS[5], KEYS[6], KEYS[7]
+local now = tonumber(ARGV[1])
+local timeout = tonumber(ARGV[2])
+local max_attempts = tonumber(ARGV[3])
+local requeued, dead_lettered = {}, {}
+
+for _, entry in ipairs(redis.call('LRANGE', processing, 0, -1)) do
+    local task = redis.call('HGET', claims, entry)
+    local expired = false
+    if task then
+        local deadline = redis.call('ZSCORE', leases, entry)
+        if not deadline or tonumber(deadline) <= now then
+            redis.call('ZREM', leases, entry)
+            redis.call('HDEL', claims, entry)
+            expired = true
+        end
+    else
+        task = entry
+        redis.call('ZADD', unclaimed, 'NX', now + timeout, task)
+        if tonumber(redis.call('ZSCORE', unclaimed, task)) <= now then
+            redis.call('ZREM', unclaimed, task)
+            expired = true
+        end
+    end
+
+    if expired then
+        redis.call('LREM', processing, 1, entry)
+        if tonumber(redis.call('HGET', attempts, task) or '0') >= max_attempts then
+            redis.call('HDEL', attempts, task)
+            redis.call('RPUSH', dead, task)
+            table.insert(dead_lettered, task)
+        else
+            redis.call('LPUSH', queue, task)
+            table.insert(requeued, task)
+        end
+    end
+end
+
+return {requeued, dead_lettered}
+"""
+
+_CLAIM_KEYS = [
+    PROCESSING_QUEUE_NAME,
+    LEASES_KEY,
+    CLAIMS_KEY,
+    UNCLAIMED_KEY,
+    ATTEMPTS_KEY,
+]
+
+_ACK_KEYS = [
+    PROCESSING_QUEUE_NAME,
+    LEASES_KEY,
+    CLAIMS_KEY,
+    ATTEMPTS_KEY,
+]
+
+_REAP_KEYS = [
+    QUEUE_NAME,
+    PROCESSING_QUEUE_NAME,
+    LEASES_KEY,
+    CLAIMS_KEY,
+    UNCLAIMED_KEY,
+    ATTEMPTS_KEY,
+    DEAD_LETTER_QUEUE_NAME,
+]
+
+
+def task_source_id(raw_message: str) -> str | None:
+    """
+    Return the source ID of a queued message, or None if it cannot be parsed.
+    """
+    try:
+        return json.loads(raw_message).get("id")
+    except (json.JSONDecodeError, AttributeError):
+        return None
+
+
+async def claim_task(client, timeout: int) -> tuple[str, str] | None:
+    """
+    Block up to `timeout` seconds for a task and move it to the processing
+    list. Returns the raw message and its claim token, or None if the queue
+    stayed empty.
+    """
+    # LEFT matches the BLPOP this replaces, so task order is unchanged
+    raw_message = await client.blmove(
+        QUEUE_NAME, PROCESSING_QUEUE_NAME, timeout, "LEFT", "RIGHT"
+    )
+    if raw_message is None:
+        return None
+
+    claim_token = uuid.uuid4().hex
+    claimed = await client.eval(
+        _CLAIM_SCRIPT,
+        len(_CLAIM_KEYS),
+        *_CLAIM_KEYS,
+        raw_message,
+        claim_token,
+        time.time() + TASK_VISIBILITY_TIMEOUT_SECONDS,
+    )
+    if not claimed:
+        return None
+
+    return raw_message, claim_token
+
+
+async def renew_lease(get_client, claim_token: str):
+    """
+    Keep extending the lease of a claim until cancelled. `get_client` is
+    called on every renewal so a reconnected client is picked up.
+    """
+    interval = TASK_VISIBILITY_TIMEOUT_SECONDS / 3
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            # XX: never resurrect a lease the reaper has already expired
+            await get_client().zadd(
+                LEASES_KEY,
+                {claim_token: time.time() + TASK_VISIBILITY_TIMEOUT_SECONDS},
+                xx=True,
+            )
+        except Exception as e:
+            print(f"⚠️ Failed to renew task lease: {e}", flush=True)
+
+
+async def ack_task(client, claim_token: str) -> bool:
+    """
+    Remove a finished task from the processing list, successful or not.
+    Returns False if the lease was lost and the task has been requeued, in
+    which case nothing is removed.
+    """
+    acknowledged = await client.eval(
+        _ACK_SCRIPT, len(_ACK_KEYS), *_ACK_KEYS, claim_token
+    )
+    return bool(acknowledged)
+
+
+async def reap_expired_tasks(client) -> tuple[list[str], list[str]]:
+    """
+    Requeue tasks whose lease ran out, dead-lettering those that have used
+    up their attempts. Returns the (requeued, dead-lettered) raw messages.
+    """
+    requeued, dead_lettered = await client.eval(
+        _REAP_SCRIPT,
+        len(_REAP_KEYS),
+        *_REAP_KEYS,
+        time.time(),
+        TASK_VISIBILITY_TIMEOUT_SECONDS,
+        TASK_MAX_ATTEMPTS,
+    )
+    return requeued, dead_lettered
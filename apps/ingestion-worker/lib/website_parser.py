@@ -1,8 +1,16 @@
+import asyncio
 import os
 
 from exa_py import Exa
 from lib.chunker import process_chunks
-from lib.modal_clients import remote_embedder
+from lib.embeddings import embed_texts
+from lib.ingestion_cache import (
+    cache_enabled_for,
+    load_cached_ingestion,
+    save_cached_ingestion,
+    store_cached_ingestion,
+    website_cache_key,
+)
 from lib.redis_client import update_source_status
 from lib.save_to_db import save_to_db
 from schemas.index import FileProcessingStatus
@@ -18,17 +26,34 @@ async def parse_website(
     encryption_type: str,
 ) -> str:
     try:
-        update_source_status(source_id, FileProcessingStatus.extracting.value)
+        await update_source_status(source_id, FileProcessingStatus.extracting.value)
 
         # Use get_contents with URLs to extract text directly
         # Exa API: get_contents accepts urls parameter for direct URL fetching
-        result = exa.get_contents(urls=[website_url], text={"max_characters": 100000})
+        result = await asyncio.to_thread(
+            exa.get_contents, urls=[website_url], text={"max_characters": 100000}
+        )
         if not result.results or len(result.results) == 0:
             raise ValueError(f"No content extracted from URL: {website_url}")
         extracted_text = result.results[0].text or ""
 
-        update_source_status(source_id, FileProcessingStatus.chunking.value)
-        db_chunks, parent_chunks, child_chunks = process_chunks(extracted_text)
+        cache_key = None
+        if cache_enabled_for(encryption_type):
+            cache_key = website_cache_key(website_url, extracted_text)
+            cached = await load_cached_ingestion(cache_key)
+            if cached:
+                await save_cached_ingestion(
+                    cached, source_id, user_id, encryption_key, encryption_type
+                )
+                await update_source_status(
+                    source_id, FileProcessingStatus.completed.value
+                )
+                return
+
+        await update_source_status(source_id, FileProcessingStatus.chunking.value)
+        db_chunks, parent_chunks, child_chunks = await asyncio.to_thread(
+            process_chunks, extracted_text
+        )
 
         # Extract text content from child chunks for embedding
         child_texts = [chunk["content"] for chunk in child_chunks]
@@ -37,9 +62,7 @@ async def parse_website(
             flush=True,
         )
 
-        # Use .spawn() for async execution, then .get() to get the result
-        result_handle = remote_embedder.generate_embeddings.spawn(child_texts)
-        embeddings = result_handle.get()
+        embeddings = await embed_texts(child_texts)
 
         # Format child chunks for database
         formatted_child_chunks = []
@@ -52,7 +75,7 @@ async def parse_website(
                 }
             )
 
-        update_source_status(source_id, FileProcessingStatus.uploading.value)
+        await update_source_status(source_id, FileProcessingStatus.uploading.value)
         await save_to_db(
             formatted_child_chunks,
             parent_chunks,
@@ -64,9 +87,18 @@ async def parse_website(
             encryption_key,
         )
 
-        update_source_status(source_id, FileProcessingStatus.completed.value)
-
-        return
+        await update_source_status(source_id, FileProcessingStatus.completed.value)
     except Exception:
-        update_source_status(source_id, FileProcessingStatus.failed.value)
+        await update_source_status(source_id, FileProcessingStatus.failed.value)
         raise
+
+    if cache_key:
+        await store_cached_ingestion(
+            cache_key,
+            {
+                "db_chunks": db_chunks,
+                "parent_chunks": parent_chunks,
+                "child_chunks": formatted_child_chunks,
+                "images": [],
+            },
+        )
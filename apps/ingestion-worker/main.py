@@ -1,5 +1,7 @@
 import asyncio
 import json
+import os
+import signal
 import sys
 import traceback
 from pathlib import Path
@@ -12,103 +14,259 @@ env_path = root_dir / ".env"
 load_dotenv(dotenv_path=env_path)
 
 import redis  # noqa: E402
+from lib.object_storage import delete_object  # noqa: E402
 from lib.pdf_parser import parse_pdf  # noqa: E402
 from lib.redis_client import (  # noqa: E402
+    close_async_redis_client,
     close_redis_client,
-    get_redis_client,
-    reset_redis_client,
+    get_async_redis_client,
+    reset_async_redis_client,
     update_source_status,
 )
+from lib.task_queue import (  # noqa: E402
+    QUEUE_NAME,
+    TASK_QUEUE_MODE,
+    TASK_REAP_INTERVAL_SECONDS,
+    ack_task,
+    claim_task,
+    reap_expired_tasks,
+    renew_lease,
+    task_source_id,
+)
 from lib.website_parser import parse_website  # noqa: E402
 from modal_services import app  # noqa: E402
 from schemas.index import FileProcessingStatus  # noqa: E402
 from utils.db_client import close_db, get_db, init_db  # noqa: E402
 
+# Number of sources a single worker processes at the same time
+INGESTION_CONCURRENCY = int(os.environ.get("INGESTION_CONCURRENCY", "4"))
+# How long a queue read blocks before the worker re-checks for shutdown
+QUEUE_POLL_TIMEOUT_SECONDS = 5
+
+
+async def process_task(raw_message: str):
+    """
+    Parse a queued message and run the matching ingestion pipeline.
+    Errors are logged and the source is marked as failed.
+    """
+    file_id = "unknown"
+    try:
+        message = json.loads(raw_message)
+        file_id = message.get("id", "unknown")
+        user_id = message.get("user_id", "unknown")
+        encryption_key = message.get("encryption_key", None)
+        encryption_type = message.get("encryption_type", None)
+        print(
+            f"📥 Task received: file_id={file_id}, user_id={user_id}",
+            flush=True,
+        )
+        print(
+            f"🔑 Encryption: type={encryption_type}, key_present={encryption_key is not None}",
+            flush=True,
+        )
+        # Debug: show all message keys to verify structure
+        print(
+            f"🔍 Message keys: {list(message.keys())}",
+            flush=True,
+        )
+        if encryption_key:
+            print(
+                f"🔑 Encryption key value: {encryption_key[:10]}...",
+                flush=True,
+            )
+        print(f"🚀 Starting PDF processing for file {file_id}...", flush=True)
+        if message["type"] == "pdf":
+            # Newer producers upload the PDF to object storage and only send
+            # its path; inline base64 is still accepted
+            await parse_pdf(
+                message.get("base64"),
+                message["id"],
+                message["user_id"],
+                encryption_key,
+                encryption_type,
+                message.get("storage_path"),
+            )
+        elif message["type"] == "url":
+            await parse_website(
+                message["url"],
+                message["user_id"],
+                message["id"],
+                encryption_key,
+                encryption_type,
+            )
+
+        print(f"✅ Successfully processed file {file_id}", flush=True)
+    except json.JSONDecodeError as e:
+        await update_source_status(file_id, FileProcessingStatus.failed.value)
+        print(f"❌ Failed to parse message JSON: {e}", flush=True)
+        print(f"   Raw message: {raw_message[:200]}...", flush=True)
+    except Exception as e:
+        await update_source_status(file_id, FileProcessingStatus.failed.value)
+        print(f"❌ Error processing task {file_id}: {e}", flush=True)
+        print("   Traceback:", flush=True)
+        traceback.print_exc(file=sys.stdout)
+        sys.stdout.flush()
+
+
+async def delete_task_upload(raw_message: str):
+    """
+    Delete the PDF a task's producer uploaded to object storage, if any.
+    """
+    try:
+        storage_path = json.loads(raw_message).get("storage_path")
+    except (json.JSONDecodeError, AttributeError):
+        return
+    if storage_path:
+        await delete_object(storage_path)
+
+
+async def handle_task(raw_message: str, claim_token: str | None = None):
+    """
+    Process a claimed task. In reliable mode the claim's lease is renewed
+    while it runs and the task is acknowledged once processing has finished,
+    whether it succeeded or was marked as failed. A task interrupted by a
+    crash is never acknowledged and gets picked up again once its lease runs
+    out.
+
+    The upload is only a hand-off from the web app and is deleted after the
+    task is acknowledged. A worker whose lease was lost leaves it for the
+    worker that reclaimed the task.
+    """
+    if TASK_QUEUE_MODE != "reliable":
+        try:
+            await process_task(raw_message)
+        finally:
+            await delete_task_upload(raw_message)
+        return
+
+    heartbeat = asyncio.create_task(renew_lease(get_async_redis_client, claim_token))
+    try:
+        await process_task(raw_message)
+    finally:
+        heartbeat.cancel()
+
+    try:
+        acknowledged = await ack_task(get_async_redis_client(), claim_token)
+    except Exception as e:
+        print(f"⚠️ Failed to acknowledge task: {e}", flush=True)
+        return
+
+    if not acknowledged:
+        print(
+            f"⚠️ Lease on task for file {task_source_id(raw_message)} was lost; "
+            "leaving it to the worker that reclaimed it",
+            flush=True,
+        )
+        return
+
+    await delete_task_upload(raw_message)
+
+
+async def reap_tasks_periodically(stop_event: asyncio.Event):
+    """
+    Requeue tasks abandoned by dead workers and dead-letter the ones that
+    keep failing, until the worker stops.
+    """
+    while not stop_event.is_set():
+        try:
+            requeued, dead_lettered = await reap_expired_tasks(get_async_redis_client())
+            for raw_message in requeued:
+                source_id = task_source_id(raw_message)
+                print(f"♻️ Requeued stalled task for file {source_id}", flush=True)
+                if source_id:
+                    await update_source_status(
+                        source_id, FileProcessingStatus.queued.value
+                    )
+            for raw_message in dead_lettered:
+                source_id = task_source_id(raw_message)
+                print(
+                    f"☠️ Task for file {source_id} moved to the dead-letter queue",
+                    flush=True,
+                )
+                if source_id:
+                    await update_source_status(
+                        source_id, FileProcessingStatus.failed.value
+                    )
+        except Exception as e:
+            print(f"⚠️ Failed to reap stalled tasks: {e}", flush=True)
+
+        try:
+            await asyncio.wait_for(
+                stop_event.wait(), timeout=TASK_REAP_INTERVAL_SECONDS
+            )
+        except TimeoutError:
+            pass
+
 
 async def main():
 
     # Get Redis client (initializes if needed)
-    redis_client = get_redis_client()
+    redis_client = get_async_redis_client()
     await init_db()
 
     # Get the client instance
     get_db()
 
-    queue_name = "file_processing_queue"
-    print(f"🐍 Python Worker connected. Listening on '{queue_name}'...", flush=True)
+    # SIGTERM (docker stop) and SIGINT stop the intake of new tasks; sources
+    # already being processed are allowed to finish
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    # A slot is taken before a task is popped, so a busy worker leaves queued
+    # tasks for its idle replicas instead of hoarding them
+    slots = asyncio.Semaphore(INGESTION_CONCURRENCY)
+    in_flight: set[asyncio.Task] = set()
+
+    def release_slot(task: asyncio.Task):
+        in_flight.discard(task)
+        slots.release()
+
+    reaper = None
+    if TASK_QUEUE_MODE == "reliable":
+        reaper = asyncio.create_task(reap_tasks_periodically(stop_event))
+
+    print(
+        f"🐍 Python Worker connected. Listening on '{QUEUE_NAME}' "
+        f"({TASK_QUEUE_MODE} mode) with {INGESTION_CONCURRENCY} concurrent tasks...",
+        flush=True,
+    )
 
     try:
-        while True:
-            print(f"⏳ Waiting for tasks on '{queue_name}'...", flush=True)
+        while not stop_event.is_set():
+            await slots.acquire()
+            if stop_event.is_set():
+                slots.release()
+                break
+
             try:
-                task = redis_client.blpop(queue_name, timeout=0)
+                if TASK_QUEUE_MODE == "reliable":
+                    claim = await claim_task(redis_client, QUEUE_POLL_TIMEOUT_SECONDS)
+                    raw_message, claim_token = claim if claim else (None, None)
+                else:
+                    task = await redis_client.blpop(
+                        [QUEUE_NAME], timeout=QUEUE_POLL_TIMEOUT_SECONDS
+                    )
+                    raw_message, claim_token = (task[1], None) if task else (None, None)
             except redis.ConnectionError as e:
+                slots.release()
                 print(f"❌ Redis connection error: {e}. Reconnecting...", flush=True)
-                reset_redis_client()
-                redis_client = get_redis_client()  # Get the reconnected client
+                await asyncio.sleep(1)
+                redis_client = await reset_async_redis_client()
                 continue
             except redis.TimeoutError:
+                slots.release()
                 continue
 
-            if task:
-                _, raw_message = task
-                try:
-                    message = json.loads(raw_message)
-                    file_id = message.get("id", "unknown")
-                    user_id = message.get("user_id", "unknown")
-                    encryption_key = message.get("encryption_key", None)
-                    encryption_type = message.get("encryption_type", None)
-                    print(
-                        f"📥 Task received: file_id={file_id}, user_id={user_id}",
-                        flush=True,
-                    )
-                    print(
-                        f"🔑 Encryption: type={encryption_type}, key_present={encryption_key is not None}",
-                        flush=True,
-                    )
-                    # Debug: show all message keys to verify structure
-                    print(
-                        f"🔍 Message keys: {list(message.keys())}",
-                        flush=True,
-                    )
-                    if encryption_key:
-                        print(
-                            f"🔑 Encryption key value: {encryption_key[:10]}...",
-                            flush=True,
-                        )
-                    print(
-                        f"🚀 Starting PDF processing for file {file_id}...", flush=True
-                    )
-                    if message["type"] == "pdf":
-                        await parse_pdf(
-                            message["base64"],
-                            message["id"],
-                            message["user_id"],
-                            encryption_key,
-                            encryption_type,
-                        )
-                    elif message["type"] == "url":
-                        await parse_website(
-                            message["url"],
-                            message["user_id"],
-                            message["id"],
-                            encryption_key,
-                            encryption_type,
-                        )
-
-                    print(f"✅ Successfully processed file {file_id}", flush=True)
-                except json.JSONDecodeError as e:
-                    update_source_status(file_id, FileProcessingStatus.failed.value)
-                    print(f"❌ Failed to parse message JSON: {e}", flush=True)
-                    print(f"   Raw message: {raw_message[:200]}...", flush=True)
-                except Exception as e:
-                    update_source_status(file_id, FileProcessingStatus.failed.value)
-                    print(f"❌ Error processing task: {e}", flush=True)
-                    print("   Traceback:", flush=True)
-                    traceback.print_exc(file=sys.stdout)
-                    sys.stdout.flush()
-
-    except KeyboardInterrupt:
+            if not raw_message:
+                slots.release()
+                continue
+
+            worker_task = asyncio.create_task(handle_task(raw_message, claim_token))
+            in_flight.add(worker_task)
+            worker_task.add_done_callback(release_slot)
+
         print("🛑 Worker stopping...", flush=True)
     except Exception as e:
         print(f"💥 Fatal error in worker: {e}", flush=True)
@@ -116,8 +274,18 @@ async def main():
         sys.stdout.flush()
         raise
     finally:
+        if reaper:
+            stop_event.set()
+            await reaper
+        if in_flight:
+            print(
+                f"⏳ Waiting for {len(in_flight)} in-flight tasks to finish...",
+                flush=True,
+            )
+            await asyncio.gather(*in_flight, return_exceptions=True)
         await close_db()
-        await close_redis_client()
+        await close_async_redis_client()
+        close_redis_client()
 
 
 if __name__ == "__main__":
@@ -1,3 +1,4 @@
+from collections.abc import Sequence
 from enum import Enum
 from typing import Literal, TypedDict
 
@@ -11,7 +12,7 @@ class Parent_Chunks(TypedDict):
 class Child_Chunks(TypedDict):
     content: str
     parent_ids: list[str]  # Parent chunk UUIDs
-    embeddings: list[float] | None = None
+    embeddings: Sequence[float] | None = None  # list or packed memoryview row
     id: str
 
 
@@ -26,6 +27,15 @@ class SplitContent(TypedDict):
     content: str
 
 
+class PdfShard(TypedDict):
+    # None once the PDF has been uploaded to pdf_path
+    pdf_data: bytes | None
+    # [start, end) pages of pdf_data to parse, None for the whole document
+    page_range: tuple[int, int] | None
+    # Path of the whole PDF in the parser's upload volume, shared by shards
+    pdf_path: str | None
+
+
 class images(TypedDict):
     image_id: str
     image_bytes: bytes
@@ -0,0 +1,31 @@
+import pytest
+
+pytest.importorskip("langchain_text_splitters")
+
+from benchmarks.chunking import synthetic_markdown  # noqa: E402
+from utils.chunk_splitter import get_splitter  # noqa: E402
+
+_EDGE_CASES = "\n\n".join(
+    [
+        "<<<1>>>First base chunk.\nSecond line of it.<<</1>>>",
+        '<img id={abc} alt={A chart of growth}/> trailing text <img src="x.png" />',
+        "- item one\n- item two\n\n1. first\n2. second",
+        "x" * 700,
+        "word " * 400,
+        "   \n\n\n   ",
+        "Sentence one. Sentence two! Sentence three? " * 30,
+    ]
+)
+
+
+@pytest.mark.parametrize(
+    ("chunk_size", "chunk_overlap"), [(300, 0), (500, 100), (2000, 200), (50, 10)]
+)
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_native_splitter_matches_langchain(chunk_size, chunk_overlap, seed):
+    text = synthetic_markdown(64 * 1024, seed, table_share=0.1) + _EDGE_CASES
+
+    native = get_splitter(chunk_size, chunk_overlap, mode="native")
+    langchain = get_splitter(chunk_size, chunk_overlap, mode="langchain")
+
+    assert native.split_text(text) == langchain.split_text(text)
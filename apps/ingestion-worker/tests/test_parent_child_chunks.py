@@ -0,0 +1,106 @@
+import re
+
+from utils.parent_child_chunks import (
+    _overlapping_windows,
+    _text_windows,
+    chunk_windows,
+    create_parent_child_chunks,
+)
+
+_MARKED = re.compile(r"<<<(\d+)>>>(.*?)<<</\1>>>", re.DOTALL)
+
+
+def test_windows_cover_the_span_with_overlap():
+    boundaries = list(range(0, 101, 10))
+
+    windows = chunk_windows(boundaries, 40, 15)
+
+    assert windows == [(0, 40), (30, 70), (60, 100)]
+
+
+def test_windows_cut_inside_uneven_boundaries():
+    # Word starts every 7 units, as inside one long base chunk
+    boundaries = [*range(0, 64, 7), 64]
+
+    windows = chunk_windows(boundaries, 30, 10)
+
+    assert windows[0][0] == 0 and windows[-1][1] == 64
+    for (start, end), (next_start, _) in zip(windows, windows[1:], strict=False):
+        assert end - start <= 30
+        assert 0 < end - next_start <= 10
+        assert next_start > start
+
+
+def test_word_longer_than_the_window_gets_its_own():
+    windows = chunk_windows([0, 5, 50, 55], 20, 5)
+
+    assert windows == [(0, 5), (5, 50), (50, 55)]
+
+
+def test_no_boundaries_give_no_windows():
+    assert chunk_windows([0], 20, 5) == []
+    assert chunk_windows([], 20, 5) == []
+
+
+def test_text_windows_start_at_words_and_overlap():
+    text = "alpha beta gamma delta epsilon zeta eta theta iota kappa"
+
+    windows = _text_windows(text, 20, 8)
+
+    assert [text[start:end] for start, end in windows] == [
+        "alpha beta gamma ",
+        "gamma delta epsilon ",
+        "epsilon zeta eta ",
+        "eta theta iota kappa",
+    ]
+
+
+def test_overlapping_windows_match_by_offset():
+    windows = [(0, 40), (30, 70), (60, 100)]
+    targets = [(0, 25), (25, 65), (65, 100)]
+
+    assert _overlapping_windows(windows, targets) == [[0, 1], [1, 2], [1, 2]]
+
+
+def test_touching_windows_do_not_overlap():
+    assert _overlapping_windows([(0, 10), (10, 20)], [(0, 10), (10, 20)]) == [
+        [0],
+        [1],
+    ]
+
+
+def test_children_and_parents_overlap_inside_base_chunks():
+    words = [f"word{index:04d}" for index in range(600)]
+    chunks = [
+        {"type": "text", "content": " ".join(words[start : start + 30]) + " ", "id": i}
+        for i, start in enumerate(range(0, 600, 30))
+    ]
+
+    parents, children = create_parent_child_chunks(chunks)
+
+    # Base chunks are about 300 characters, so whole-chunk windows of 500
+    # with 100 overlap could not repeat any text
+    first_words = [child["content"].split()[0] for child in children]
+    last_words = [child["content"].split()[-1] for child in children]
+    assert all(
+        last >= first for last, first in zip(last_words, first_words[1:], strict=False)
+    )
+    assert all(len(child["content"]) <= 500 for child in children)
+
+    parents_by_id = {parent["id"]: parent for parent in parents}
+    for parent in parents:
+        pieces = _MARKED.findall(parent["content"])
+        assert [int(chunk_id) for chunk_id, _ in pieces] == parent["children_ids"]
+    for child in children:
+        # A child spanning two parents is split between them
+        child_words = set(child["content"].split())
+        parent_words = [
+            {
+                word
+                for _, text in _MARKED.findall(parents_by_id[parent_id]["content"])
+                for word in text.split()
+            }
+            for parent_id in child["parent_ids"]
+        ]
+        assert all(child_words & words for words in parent_words)
+        assert child_words <= set().union(*parent_words)
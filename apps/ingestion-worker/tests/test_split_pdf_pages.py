@@ -0,0 +1,49 @@
+import pytest
+
+pytest.importorskip("modal")
+pytest.importorskip("pypdf")
+
+from utils.split_pdf_pages import partition_pages  # noqa: E402
+
+
+def shard_costs(costs, page_ranges):
+    return [sum(costs[start:end]) for start, end in page_ranges]
+
+
+def test_uniform_pages_split_evenly():
+    assert partition_pages([1.0] * 12, 4) == [(0, 3), (3, 6), (6, 9), (9, 12)]
+
+
+def test_expensive_pages_get_shards_of_their_own():
+    # Two scanned pages with images among plain text pages
+    costs = [1.0, 1.0, 8.0, 1.0, 1.0, 1.0, 8.0, 1.0]
+
+    page_ranges = partition_pages(costs, 2)
+
+    assert page_ranges == [(0, 4), (4, 8)]
+    assert shard_costs(costs, page_ranges) == [11.0, 11.0]
+
+
+def test_ranges_are_contiguous_and_cover_every_page():
+    costs = [0.5, 4.0, 1.0, 1.0, 7.0, 0.5, 2.0, 1.0, 1.0, 3.0]
+
+    page_ranges = partition_pages(costs, 4)
+
+    assert page_ranges[0][0] == 0
+    assert page_ranges[-1][1] == len(costs)
+    for (_, end), (start, _) in zip(page_ranges, page_ranges[1:], strict=False):
+        assert end == start
+    # Each cut lands within one page of its target
+    assert max(shard_costs(costs, page_ranges)) <= sum(costs) / 4 + max(costs)
+
+
+def test_every_shard_keeps_at_least_one_page():
+    # One page holds nearly all the cost
+    page_ranges = partition_pages([100.0, 1.0, 1.0, 1.0], 4)
+
+    assert page_ranges == [(0, 1), (1, 2), (2, 3), (3, 4)]
+
+
+def test_shard_count_is_capped_by_page_count():
+    assert partition_pages([1.0, 1.0], 5) == [(0, 1), (1, 2)]
+    assert partition_pages([2.0], 0) == [(0, 1)]
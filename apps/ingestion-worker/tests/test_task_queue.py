@@ -0,0 +1,103 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")
+
+from lib.task_queue import (  # noqa: E402
+    ATTEMPTS_KEY,
+    DEAD_LETTER_QUEUE_NAME,
+    LEASES_KEY,
+    PROCESSING_QUEUE_NAME,
+    QUEUE_NAME,
+    TASK_MAX_ATTEMPTS,
+    TASK_VISIBILITY_TIMEOUT_SECONDS,
+    ack_task,
+    claim_task,
+    reap_expired_tasks,
+)
+
+MESSAGE = json.dumps({"id": "source-1", "type": "pdf", "storage_path": "a.pdf"})
+
+
+async def expire_leases(client):
+    for claim_token in await client.zrange(LEASES_KEY, 0, -1):
+        await client.zadd(LEASES_KEY, {claim_token: 0})
+
+
+def test_ack_removes_the_claimed_task():
+    async def run():
+        client = fakeredis.FakeAsyncRedis(decode_responses=True)
+        await client.rpush(QUEUE_NAME, MESSAGE)
+
+        raw_message, claim_token = await claim_task(client, 1)
+
+        assert raw_message == MESSAGE
+        assert await client.lrange(PROCESSING_QUEUE_NAME, 0, -1) == [claim_token]
+        assert await ack_task(client, claim_token)
+        assert await client.llen(PROCESSING_QUEUE_NAME) == 0
+        assert await client.zcard(LEASES_KEY) == 0
+        assert await client.hlen(ATTEMPTS_KEY) == 0
+
+    asyncio.run(run())
+
+
+def test_slow_worker_does_not_ack_a_reclaimed_task():
+    async def run():
+        client = fakeredis.FakeAsyncRedis(decode_responses=True)
+        await client.rpush(QUEUE_NAME, MESSAGE)
+        _, slow_token = await claim_task(client, 1)
+
+        await expire_leases(client)
+        requeued, dead_lettered = await reap_expired_tasks(client)
+        assert (requeued, dead_lettered) == ([MESSAGE], [])
+
+        raw_message, new_token = await claim_task(client, 1)
+        assert raw_message == MESSAGE
+
+        # The slow worker finishes after its lease was lost
+        assert not await ack_task(client, slow_token)
+        assert await client.lrange(PROCESSING_QUEUE_NAME, 0, -1) == [new_token]
+        assert await client.hget(ATTEMPTS_KEY, MESSAGE) == "2"
+
+        assert await ack_task(client, new_token)
+        assert await client.llen(PROCESSING_QUEUE_NAME) == 0
+
+    asyncio.run(run())
+
+
+def test_task_is_dead_lettered_after_max_attempts():
+    async def run():
+        client = fakeredis.FakeAsyncRedis(decode_responses=True)
+        await client.rpush(QUEUE_NAME, MESSAGE)
+
+        for _ in range(TASK_MAX_ATTEMPTS):
+            assert await claim_task(client, 1)
+            await expire_leases(client)
+            requeued, dead_lettered = await reap_expired_tasks(client)
+
+        assert (requeued, dead_lettered) == ([], [MESSAGE])
+        assert await client.lrange(DEAD_LETTER_QUEUE_NAME, 0, -1) == [MESSAGE]
+        assert await client.llen(QUEUE_NAME) == 0
+        assert await client.llen(PROCESSING_QUEUE_NAME) == 0
+
+    asyncio.run(run())
+
+
+def test_unclaimed_task_is_requeued_after_the_timeout(monkeypatch):
+    async def run():
+        client = fakeredis.FakeAsyncRedis(decode_responses=True)
+        # A worker died between BLMOVE and recording its claim
+        await client.rpush(PROCESSING_QUEUE_NAME, MESSAGE)
+
+        assert await reap_expired_tasks(client) == ([], [])
+
+        later = time.time() + TASK_VISIBILITY_TIMEOUT_SECONDS + 1
+        monkeypatch.setattr(time, "time", lambda: later)
+        assert await reap_expired_tasks(client) == ([MESSAGE], [])
+        assert await client.lrange(QUEUE_NAME, 0, -1) == [MESSAGE]
+
+    asyncio.run(run())
@@ -1,27 +1,157 @@
+import functools
+import os
+import re
+
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
+# "native"    -> built-in splitter for MIXED_CONTENT_SEPARATORS (default)
+# "langchain" -> RecursiveCharacterTextSplitter for every call
+CHUNK_SPLITTER_MODES = ("native", "langchain")
+CHUNK_SPLITTER_MODE = os.environ.get("CHUNK_SPLITTER_MODE", "native")
 
-def split_mixed_content(text: str, chunk_size: int = 300, chunk_overlap: int = 0):
-    # We define a list of separators. The splitter checks them in order.
-    # If a chunk is too big, it moves to the next separator.
-    # We prioritize Markdown breaks (\n\n) and HTML tag boundaries (>).
-    separators = [
-        "\n\n",  # 1. Try to split by paragraph
-        "\n",  # 2. Try to split by line
-        r"<img[^>]*/>",  # 3. Match complete img tags to avoid splitting them mid-tag (regex)
-        "<<<",  # 4. SAFETY NET: Split BEFORE a tag starts (pushes tag to next chunk)
-        ">>>",  # 5. Split AFTER a tag ends
-        " ",  # 6. Split by words
-        "",  # 7. Last resort: split characters
-    ]
-
-    splitter = RecursiveCharacterTextSplitter(
+if CHUNK_SPLITTER_MODE not in CHUNK_SPLITTER_MODES:
+    raise ValueError(
+        f"Invalid chunk splitter mode '{CHUNK_SPLITTER_MODE}'. Allowed values: {', '.join(CHUNK_SPLITTER_MODES)}"
+    )
+
+# The splitter checks the separators in order. If a chunk is too big, it moves
+# to the next separator. We prioritize Markdown breaks (\n\n) and HTML tag
+# boundaries (>). Separators are regexes.
+MIXED_CONTENT_SEPARATORS = (
+    "\n\n",  # 1. Try to split by paragraph
+    "\n",  # 2. Try to split by line
+    r"<img[^>]*/>",  # 3. Match complete img tags, never split mid-tag (regex)
+    "<<<",  # 4. SAFETY NET: Split BEFORE a tag starts (pushes tag to next chunk)
+    ">>>",  # 5. Split AFTER a tag ends
+    " ",  # 6. Split by words
+    "",  # 7. Last resort: split characters
+)
+_REGEX_METACHARACTERS = frozenset(".^$*+?{}[]|()\\")
+
+
+class NativeTextSplitter:
+    """
+    RecursiveCharacterTextSplitter(keep_separator=True, length_function=len)
+    without its per-call overhead, producing the same chunks.
+
+    Separators are compiled once, plain ones are split with str.split, a text
+    shorter than chunk_size is returned without splitting, and merging walks
+    an index instead of copying the pending list for every dropped split.
+    """
+
+    def __init__(
+        self, chunk_size: int, chunk_overlap: int, separators: tuple[str, ...]
+    ):
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        # (separator, capturing pattern, or None when it is a plain string)
+        self.separators = [
+            (
+                separator,
+                (
+                    re.compile(f"({separator})")
+                    if _REGEX_METACHARACTERS.intersection(separator)
+                    else None
+                ),
+            )
+            for separator in separators
+        ]
+
+    def _split_on(self, text: str, level: int) -> tuple[list[str], int]:
+        """
+        Split on the first separator from `level` on that occurs in the text,
+        keeping each separator at the start of the piece after it. Returns
+        the pieces and the level to continue with for pieces still too long.
+        """
+        for index in range(level, len(self.separators)):
+            separator, pattern = self.separators[index]
+            if not separator:
+                return list(text), len(self.separators)
+            if pattern is None:
+                if separator not in text:
+                    continue
+                first, *rest = text.split(separator)
+                pieces = [first, *(separator + piece for piece in rest)]
+            else:
+                parts = pattern.split(text)
+                if len(parts) == 1:
+                    continue
+                # Capturing split: [text, sep, text, sep, ..., text]
+                pieces = [parts[0]]
+                pieces.extend(
+                    parts[i] + parts[i + 1] for i in range(1, len(parts) - 1, 2)
+                )
+            return [piece for piece in pieces if piece], index + 1
+        return [text], len(self.separators)
+
+    def _merge(self, splits: list[str], chunks: list[str]):
+        first = 0
+        total = 0
+        for end, split in enumerate(splits):
+            length = len(split)
+            if total + length > self.chunk_size and first < end:
+                chunk = "".join(splits[first:end]).strip()
+                if chunk:
+                    chunks.append(chunk)
+                while total > self.chunk_overlap or (
+                    total + length > self.chunk_size and total > 0
+                ):
+                    total -= len(splits[first])
+                    first += 1
+            total += length
+        chunk = "".join(splits[first:]).strip()
+        if chunk:
+            chunks.append(chunk)
+
+    def _split(self, text: str, level: int, chunks: list[str]):
+        splits, next_level = self._split_on(text, level)
+        good_splits: list[str] = []
+        for split in splits:
+            if len(split) < self.chunk_size:
+                good_splits.append(split)
+                continue
+            if good_splits:
+                self._merge(good_splits, chunks)
+                good_splits = []
+            if next_level >= len(self.separators):
+                chunks.append(split)
+            else:
+                self._split(split, next_level, chunks)
+        if good_splits:
+            self._merge(good_splits, chunks)
+
+    def split_text(self, text: str) -> list[str]:
+        if len(text) < self.chunk_size:
+            # Every split would be merged back into one chunk
+            stripped = text.strip()
+            return [stripped] if stripped else []
+        chunks: list[str] = []
+        self._split(text, 0, chunks)
+        return chunks
+
+
+@functools.cache
+def get_splitter(
+    chunk_size: int,
+    chunk_overlap: int,
+    separators: tuple[str, ...] = MIXED_CONTENT_SEPARATORS,
+    mode: str = CHUNK_SPLITTER_MODE,
+) -> NativeTextSplitter | RecursiveCharacterTextSplitter:
+    """
+    Shared splitter for a configuration, built on first use.
+    """
+    if mode == "native" and separators == MIXED_CONTENT_SEPARATORS:
+        return NativeTextSplitter(chunk_size, chunk_overlap, separators)
+
+    return RecursiveCharacterTextSplitter(
         chunk_size=chunk_size,
         chunk_overlap=chunk_overlap,
         length_function=len,
-        separators=separators,
+        separators=list(separators),
         is_separator_regex=True,  # Enable regex to match complete img tags
         keep_separator=True,  # IMPORTANT: Keeps the "<<<" in the text
     )
 
-    return splitter.split_text(text)
+
+def split_mixed_content(text: str, chunk_size: int = 300, chunk_overlap: int = 0):
+    return get_splitter(chunk_size, chunk_overlap).split_text(text)
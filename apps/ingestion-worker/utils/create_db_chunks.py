@@ -2,9 +2,11 @@ from schemas.index import Chunk, SplitContent
 from utils.chunk_splitter import split_mixed_content
 
 
-def create_db_chunks(split_content: list[SplitContent]) -> list[Chunk]:
+def create_db_chunks(
+    split_content: list[SplitContent], start_id: int = 0
+) -> list[Chunk]:
     chunks: list[Chunk] = []
-    chunk_id = 0
+    chunk_id = start_id
 
     # Split the text into chunks
     print(f"[LOG] Processing {len(split_content)} split_content items into chunks...")
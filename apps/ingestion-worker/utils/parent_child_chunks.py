@@ -1,137 +1,315 @@
+import os
 import re
+from bisect import bisect_left, bisect_right
+from collections.abc import Callable
+from itertools import accumulate
 from uuid import uuid4
 
-from schemas.index import Child_Chunks, Chunk, Parent_Chunks, SplitContent
-from utils.chunk_splitter import split_mixed_content
-from utils.tools import extract_child_ids, extract_parent_ids
+from schemas.index import Child_Chunks, Chunk, Parent_Chunks
+from utils.token_lengths import count_tokens_many, fit_token_budget, token_offsets_many
 
+# "characters" -> parents and children are sized in characters (default)
+# "tokens"     -> sized in CHUNK_TOKENIZER tokens, and every child is cut to fit
+#                 CHILD_CHUNK_TOKENS; needs the `token-chunking` extra
+CHUNK_LENGTH_MODES = ("characters", "tokens")
+CHUNK_LENGTH_MODE = os.environ.get("CHUNK_LENGTH_MODE", "characters")
 
-def create_parent_child_chunks(
-    chunks: list[Chunk],
-) -> list[Parent_Chunks, Child_Chunks]:
-    combined_text_with_ids: list[SplitContent] = []
+if CHUNK_LENGTH_MODE not in CHUNK_LENGTH_MODES:
+    raise ValueError(
+        f"Invalid chunk length mode '{CHUNK_LENGTH_MODE}'. Allowed values: {', '.join(CHUNK_LENGTH_MODES)}"
+    )
 
-    temp_text = ""
+# Windows are cut at word starts, inside base chunks where needed, so each
+# window repeats about the last *_OVERLAP of the previous one. Sizes count
+# the base chunks' content, not the <<<id>>> markers parents wrap it in.
+PARENT_CHUNK_SIZE = 2000
+PARENT_CHUNK_OVERLAP = 200
+CHILD_CHUNK_SIZE = 500
+CHILD_CHUNK_OVERLAP = 100
+# Token mode: parents stay well inside the reranker's window and children are
+# short enough for embedding batches to pack without long padding
+PARENT_CHUNK_TOKENS = int(os.environ.get("PARENT_CHUNK_TOKENS", "512"))
+PARENT_CHUNK_OVERLAP_TOKENS = int(os.environ.get("PARENT_CHUNK_OVERLAP_TOKENS", "50"))
+CHILD_CHUNK_TOKENS = int(os.environ.get("CHILD_CHUNK_TOKENS", "128"))
+CHILD_CHUNK_OVERLAP_TOKENS = int(os.environ.get("CHILD_CHUNK_OVERLAP_TOKENS", "25"))
+# Markdown tables start with a header row and a delimiter row
+TABLE_HEADER_LINES = 2
 
-    # Combine the text into a single string with ids
-    print(f"[LOG] Combining {len(chunks)} chunks with IDs...")
-    for chunk in chunks:
-        if chunk["type"] == "text":
-            temp_text = (
-                temp_text
-                + f"<<<{chunk['id']}>>>"
-                + chunk["content"]
-                + f"<<</{chunk['id']}>>>"
-            )
-        if chunk["type"] == "table":
-            if temp_text != "":
-                combined_text_with_ids.append({"type": "text", "content": temp_text})
-                temp_text = ""
-            combined_text_with_ids.append(
-                {
-                    "type": "table",
-                    "content": f"<<<{chunk['id']}>>>"
-                    + chunk["content"]
-                    + f"<<</{chunk['id']}>>>",
-                }
-            )
+_SPACE = re.compile(r"\s")
+_UP_TO_LAST_SPACE = re.compile(r".*\s", re.DOTALL)
 
-    # Handle remaining temp_text
-    if temp_text != "":
-        combined_text_with_ids.append({"type": "text", "content": temp_text})
 
-    print(
-        f"[LOG] Combined text with IDs: {len(combined_text_with_ids)} items (text: {sum(1 for c in combined_text_with_ids if c['type'] == 'text')}, table: {sum(1 for c in combined_text_with_ids if c['type'] == 'table')})"
-    )
+def _mark(chunk_id: int, content: str) -> str:
+    return f"<<<{chunk_id}>>>{content}<<</{chunk_id}>>>"
 
-    parent_chunks: list[Parent_Chunks] = []
-    child_chunks: list[Child_Chunks] = []
 
-    # Split the text into parent chunks
-    print(
-        f"[LOG] Creating parent chunks from {len(combined_text_with_ids)} combined items..."
-    )
-    for chunk in combined_text_with_ids:
-        if chunk["type"] == "text":
-            content_array = split_mixed_content(
-                chunk["content"], chunk_size=2000, chunk_overlap=200
-            )
-            print(f"[LOG] Text chunk split into {len(content_array)} parent chunks")
-            for content in content_array:
-                child_ids = extract_child_ids(content)
-                parent_chunks.append(
-                    {
-                        "content": content,
-                        "children_ids": child_ids,
-                        "id": str(uuid4()),
-                    }
-                )
+def _cut_windows(
+    length: int,
+    chunk_size: int,
+    chunk_overlap: int,
+    last_cut: Callable[[int, int], int | None],
+    first_cut: Callable[[int], int],
+) -> list[tuple[int, int]]:
+    """
+    Cut [0, length) into [start, end) windows of at most chunk_size, each
+    repeating about chunk_overlap of the previous one.
+
+    Windows start and end at cut points (word starts, and in token mode
+    base chunk edges):
+    last_cut(low, high) is the last one in (low, high], or None, and
+    first_cut(offset) the first one at or after offset; length is always
+    one. A window ends at the last cut within chunk_size of its start, and
+    the next one starts at the first cut at most chunk_overlap before that
+    end, always past the previous start. Where no cut fits, as for a word
+    longer than chunk_size, the window runs to the next cut.
+    """
+    windows: list[tuple[int, int]] = []
+    start = 0
+    while start < length:
+        if length - start <= chunk_size:
+            end = length
         else:
-            child_ids = extract_child_ids(chunk["content"])
-            print(
-                f"[LOG] Table chunk has {len(child_ids)} child IDs: {child_ids[:5] if child_ids else 'none'}"
-            )
-            parent_chunks.append(
-                {
-                    "content": chunk["content"],
-                    "children_ids": child_ids,
-                    "id": str(uuid4()),
-                }
+            end = last_cut(start, start + chunk_size)
+            if end is None:
+                end = first_cut(start + 1)
+        windows.append((start, end))
+        if end == length:
+            break
+        start = max(first_cut(end - chunk_overlap), first_cut(start + 1))
+    return windows
+
+
+def chunk_windows(
+    boundaries: list[int], chunk_size: int, chunk_overlap: int
+) -> list[tuple[int, int]]:
+    """
+    Windows over [0, boundaries[-1]) cut only at `boundaries`, the strictly
+    increasing offsets (from 0, in characters or tokens) where a window may
+    start or end. See _cut_windows.
+    """
+    if not boundaries:
+        return []
+
+    def last_cut(low: int, high: int) -> int | None:
+        cut = boundaries[bisect_right(boundaries, high) - 1]
+        return cut if cut > low else None
+
+    def first_cut(offset: int) -> int:
+        return boundaries[bisect_left(boundaries, offset)]
+
+    return _cut_windows(boundaries[-1], chunk_size, chunk_overlap, last_cut, first_cut)
+
+
+def _text_windows(
+    text: str, chunk_size: int, chunk_overlap: int
+) -> list[tuple[int, int]]:
+    """
+    Character windows over text, cut at word starts. Only the text around
+    each cut is scanned, so this stays fast on long runs.
+    """
+    length = len(text)
+
+    def last_cut(low: int, high: int) -> int | None:
+        match = _UP_TO_LAST_SPACE.match(text, low, high)
+        return match.end() if match and match.end() > low else None
+
+    def first_cut(offset: int) -> int:
+        if offset <= 0 or text[offset - 1].isspace():
+            return max(offset, 0)
+        match = _SPACE.search(text, offset)
+        return match.end() if match else length
+
+    return _cut_windows(length, chunk_size, chunk_overlap, last_cut, first_cut)
+
+
+def _overlapping_windows(
+    windows: list[tuple[int, int]], targets: list[tuple[int, int]]
+) -> list[list[int]]:
+    """
+    For every window, the indexes of the targets whose interval it overlaps.
+
+    Both lists are sorted with non-decreasing ends, so the first candidate
+    target only moves forward.
+    """
+    overlaps: list[list[int]] = []
+    first = 0
+    for start, end in windows:
+        while first < len(targets) and targets[first][1] <= start:
+            first += 1
+        matches = []
+        index = first
+        while index < len(targets) and targets[index][0] < end:
+            if targets[index][1] > start:
+                matches.append(index)
+            index += 1
+        overlaps.append(matches)
+    return overlaps
+
+
+def _fit_child(content: str, header_lines: int = 0) -> list[str]:
+    """
+    In token mode, cut a child that is over CHILD_CHUNK_TOKENS (a long base
+    chunk or table) into pieces that fit. Otherwise it is kept whole.
+    """
+    if CHUNK_LENGTH_MODE != "tokens":
+        return [content]
+    return fit_token_budget(content, CHILD_CHUNK_TOKENS, header_lines)
+
+
+def _token_layout(contents: list[str]) -> tuple[list[int], list[int], list[int]]:
+    """
+    Lay a run of base chunks out end to end in tokens.
+
+    Returns the token offset of every chunk edge, the token offsets windows
+    may be cut at (chunk edges and tokens that start a word), and the
+    character offset in the joined contents of each of those cuts.
+    """
+    token_spans = token_offsets_many(contents)
+    edges = [0, *accumulate(len(spans) for spans in token_spans)]
+    char_edges = [0, *accumulate(len(content) for content in contents)]
+    cuts: dict[int, int] = {edges[-1]: char_edges[-1]}
+    for content, spans, edge, char_edge in zip(
+        contents, token_spans, edges, char_edges, strict=False
+    ):
+        cuts.setdefault(edge, char_edge)
+        for index, (char, _) in enumerate(spans):
+            if index and content[char - 1 : char].isspace():
+                cuts[edge + index] = char_edge + char
+    boundaries = sorted(cuts)
+    return edges, boundaries, [cuts[offset] for offset in boundaries]
+
+
+def _text_run_chunks(
+    run: list[Chunk],
+) -> tuple[list[Parent_Chunks], list[Child_Chunks]]:
+    """
+    Parents and children of consecutive text chunks.
+
+    Parents wrap every base chunk, or the part of it they hold, in that
+    chunk's <<<id>>> markers; children are plain text. A child belongs to
+    every parent whose window overlaps its own.
+    """
+    contents = [chunk["content"] for chunk in run]
+    text = "".join(contents)
+    char_edges = [0, *accumulate(len(content) for content in contents)]
+
+    if CHUNK_LENGTH_MODE == "tokens":
+        edges, boundaries, boundary_chars = _token_layout(contents)
+
+        def char_at(offset: int) -> int:
+            return boundary_chars[bisect_left(boundaries, offset)]
+
+        parent_windows = chunk_windows(
+            boundaries, PARENT_CHUNK_TOKENS, PARENT_CHUNK_OVERLAP_TOKENS
+        )
+        child_windows = chunk_windows(
+            boundaries, CHILD_CHUNK_TOKENS, CHILD_CHUNK_OVERLAP_TOKENS
+        )
+    else:
+        edges = char_edges
+
+        def char_at(offset: int) -> int:
+            return offset
+
+        parent_windows = _text_windows(text, PARENT_CHUNK_SIZE, PARENT_CHUNK_OVERLAP)
+        child_windows = _text_windows(text, CHILD_CHUNK_SIZE, CHILD_CHUNK_OVERLAP)
+
+    chunk_spans = list(zip(edges, edges[1:], strict=False))
+    parents: list[Parent_Chunks] = []
+    for (start, end), chunk_indexes in zip(
+        parent_windows,
+        _overlapping_windows(parent_windows, chunk_spans),
+        strict=True,
+    ):
+        start_char, end_char = char_at(start), char_at(end)
+        pieces = [
+            _mark(
+                run[index]["id"],
+                text[
+                    max(start_char, char_edges[index]) : min(
+                        end_char, char_edges[index + 1]
+                    )
+                ],
             )
+            for index in chunk_indexes
+        ]
+        parents.append(
+            {
+                "content": "".join(pieces),
+                "children_ids": [run[index]["id"] for index in chunk_indexes],
+                "id": str(uuid4()),
+            }
+        )
 
-    print(f"[LOG] Total parent chunks created: {len(parent_chunks)}")
+    child_contents = [
+        text[char_at(start) : char_at(end)].strip() for start, end in child_windows
+    ]
+    if CHUNK_LENGTH_MODE == "tokens":
+        # Encode all children in one batch; _fit_child then hits the cache
+        count_tokens_many(child_contents)
+    children: list[Child_Chunks] = [
+        {
+            "content": content,
+            "parent_ids": [parents[index]["id"] for index in parent_indexes],
+            "id": str(uuid4()),
+        }
+        for window_content, parent_indexes in zip(
+            child_contents,
+            _overlapping_windows(child_windows, parent_windows),
+            strict=True,
+        )
+        if window_content
+        for content in _fit_child(window_content)
+    ]
+    return parents, children
 
-    child_parent_mapping: dict[str, list[str]] = {}
 
-    # Create a mapping of child ids to parent ids
-    print(
-        f"[LOG] Building child_parent_mapping from {len(parent_chunks)} parent chunks..."
-    )
-    total_child_ids = 0
-    for parent_chunk in parent_chunks:
-        for child_id in parent_chunk["children_ids"]:
-            total_child_ids += 1
-            child_id_str = str(child_id)
-            if child_id_str not in child_parent_mapping:
-                child_parent_mapping[child_id_str] = []
-            child_parent_mapping[child_id_str].append(parent_chunk["id"])
+def create_parent_child_chunks(
+    chunks: list[Chunk],
+) -> tuple[list[Parent_Chunks], list[Child_Chunks]]:
+    """
+    Build parent chunks (for the answer context) and child chunks (embedded
+    for search) from the base chunks.
 
-    print(
-        f"[LOG] child_parent_mapping has {len(child_parent_mapping)} unique child IDs, {total_child_ids} total mappings"
-    )
+    Windows are cut at word starts, inside base chunks where needed, and the
+    parent/child relation follows from the window offsets alone. Each
+    table is a parent of its own, with one child (split between rows in
+    token mode when it is too long). Sizes are in characters or tokens, see
+    CHUNK_LENGTH_MODE.
+    """
+    parent_chunks: list[Parent_Chunks] = []
+    child_chunks: list[Child_Chunks] = []
+    text_run: list[Chunk] = []
 
-    # Split the text into child chunks
-    print(
-        f"[LOG] Creating child chunks from {len(combined_text_with_ids)} combined items..."
-    )
-    for chunk in combined_text_with_ids:
+    def flush_text_run():
+        if text_run:
+            parents, children = _text_run_chunks(text_run)
+            parent_chunks.extend(parents)
+            child_chunks.extend(children)
+            text_run.clear()
+
+    for chunk in chunks:
         if chunk["type"] == "text":
-            content_array = split_mixed_content(
-                chunk["content"], chunk_size=500, chunk_overlap=100
-            )
-            print(f"[LOG] Text chunk split into {len(content_array)} child chunks")
-            for content in content_array:
-                clean_content = re.sub(r"<<</?\d+>>>", "", content)
-                parent_ids = extract_parent_ids(content, child_parent_mapping)
-                child_chunks.append(
-                    {
-                        "content": clean_content,
-                        "parent_ids": parent_ids,
-                        "id": str(uuid4()),
-                    }
-                )
-        else:
-            clean_content = re.sub(r"<<</?\d+>>>", "", chunk["content"])
-            parent_ids = extract_parent_ids(chunk["content"], child_parent_mapping)
-            print(f"[LOG] Table chunk has {len(parent_ids)} parent IDs")
-            child_chunks.append(
-                {
-                    "content": clean_content,
-                    "parent_ids": parent_ids,
-                    "id": str(uuid4()),
-                }
-            )
+            text_run.append(chunk)
+            continue
 
-    print(f"[LOG] Total child chunks created: {len(child_chunks)}")
+        flush_text_run()
+        parent_id = str(uuid4())
+        parent_chunks.append(
+            {
+                "content": _mark(chunk["id"], chunk["content"]),
+                "children_ids": [chunk["id"]],
+                "id": parent_id,
+            }
+        )
+        child_chunks.extend(
+            {"content": content, "parent_ids": [parent_id], "id": str(uuid4())}
+            for content in _fit_child(chunk["content"], TABLE_HEADER_LINES)
+        )
+    flush_text_run()
 
+    print(
+        f"[LOG] Created {len(parent_chunks)} parent and {len(child_chunks)} child "
+        f"chunks from {len(chunks)} chunks"
+    )
     return parent_chunks, child_chunks
@@ -1,29 +1,150 @@
 import base64
 import io
-import math
+import os
 import re
+from bisect import bisect_left
 from io import BytesIO
+from itertools import accumulate
+from typing import BinaryIO
 
-from pypdf import PdfReader, PdfWriter
+from modal_services import MARKER_MAX_CONTAINERS, MARKER_MAX_INPUTS
+from pypdf import PageObject, PdfReader, PdfWriter
+from schemas.index import PdfShard
 
+# Marker's parallel capacity, so one PDF can keep every parser slot busy
+MAX_PDF_SHARDS = MARKER_MAX_CONTAINERS * MARKER_MAX_INPUTS
+# Minimum work per shard, in text-page equivalents, so per-call overhead
+# does not dominate
+MIN_SHARD_COST = 25.0
 
-def base64_to_chunked_pdfs(
-    base64_string, max_parallel_calls=8, min_pages=25
-) -> list[bytes]:
+# "page_range" -> shards share the original PDF bytes plus a page span (default)
+# "rewrite"    -> every shard is rewritten as a standalone PDF with PdfWriter
+PDF_SHARD_MODES = ("page_range", "rewrite")
+PDF_SHARD_MODE = os.environ.get("PDF_SHARD_MODE", "page_range")
+# Above this size the original is rewritten per shard rather than read in
+# full by every parser call
+PDF_PAGE_RANGE_MAX_BYTES = int(
+    os.environ.get("PDF_PAGE_RANGE_MAX_BYTES", str(32 * 1024 * 1024))
+)
+
+# Page cost model, in units of one letter-sized page with a text layer
+IMAGE_PAGE_COST = 0.5  # per embedded image (layout + Florence-bound crops)
+MAX_IMAGE_PAGE_COST = 4.0
+NO_TEXT_LAYER_PAGE_COST = 3.0  # scanned pages go through OCR
+LETTER_PAGE_AREA = 612 * 792
+MIN_AREA_FACTOR = 0.5
+MAX_AREA_FACTOR = 4.0
+
+
+def _count_images(resources, depth: int = 0) -> int:
+    """
+    Count image XObjects in a resource dictionary, following form XObjects
+    one level deep.
     """
-    Decodes a Base64 string to a PDF and chunks it directly into optimized groups.
-    Returns a list of PDF bytes, where each item is a chunked PDF containing multiple pages.
+    if resources is None:
+        return 0
+    xobjects = resources.get_object().get("/XObject")
+    if xobjects is None:
+        return 0
 
-    Args:
-        base64_string: Base64 encoded PDF string (optionally with Data URI prefix)
-        max_parallel_calls: Maximum number of chunks to create (default: 8)
-        min_pages: Minimum pages per chunk (default: 25)
+    count = 0
+    for xobject in xobjects.get_object().values():
+        xobject = xobject.get_object()
+        subtype = xobject.get("/Subtype")
+        if subtype == "/Image":
+            count += 1
+        elif subtype == "/Form" and depth < 1:
+            count += _count_images(xobject.get("/Resources"), depth + 1)
+    return count
 
-    Returns:
-        List of PDF bytes, where each item is a chunked PDF
+
+def estimate_page_cost(page: PageObject) -> float:
+    """
+    Estimate how long Marker takes on a page relative to a plain text page,
+    from its embedded images, whether it has a text layer and its size. Only
+    the resource dictionaries are inspected, content streams are not decoded.
+    """
+    try:
+        resources = page.get("/Resources")
+        image_count = _count_images(resources)
+        fonts = resources.get_object().get("/Font") if resources is not None else None
+        area = float(page.mediabox.width) * float(page.mediabox.height)
+    except Exception:
+        return 1.0
+
+    cost = 1.0 + min(image_count * IMAGE_PAGE_COST, MAX_IMAGE_PAGE_COST)
+    if not fonts:
+        cost += NO_TEXT_LAYER_PAGE_COST
+
+    area_factor = min(max(area / LETTER_PAGE_AREA, MIN_AREA_FACTOR), MAX_AREA_FACTOR)
+    return cost * area_factor
+
+
+def partition_pages(costs: list[float], shard_count: int) -> list[tuple[int, int]]:
+    """
+    Split pages into `shard_count` contiguous [start, end) ranges of roughly
+    equal total cost, cutting where the running cost is closest to each
+    multiple of total / shard_count. Ranges stay contiguous so the parsed
+    shards concatenate back in document order.
+    """
+    page_count = len(costs)
+    shard_count = max(1, min(shard_count, page_count))
+    prefix = list(accumulate(costs))
+    total = prefix[-1] if prefix else 0.0
+
+    bounds = [0]
+    for shard in range(1, shard_count):
+        target = total * shard / shard_count
+        # First page at which the running cost reaches the target
+        cut = bisect_left(prefix, target)
+        before = prefix[cut - 1] if cut > 0 else 0.0
+        end = cut
+        if cut < page_count and prefix[cut] - target <= target - before:
+            end = cut + 1
+        # Every shard keeps at least one page
+        end = max(end, bounds[-1] + 1)
+        end = min(end, page_count - (shard_count - shard))
+        bounds.append(end)
+    bounds.append(page_count)
+
+    return list(zip(bounds, bounds[1:], strict=False))
+
+
+def plan_pdf_shards(
+    reader: PdfReader,
+    max_parallel_calls=MAX_PDF_SHARDS,
+    min_shard_cost=MIN_SHARD_COST,
+) -> list[tuple[int, int]]:
     """
+    Decide the [start, end) page ranges a PDF is parsed in, balancing the
+    estimated parsing cost of each range.
+    """
+    total_pages = len(reader.pages)
+    if total_pages == 0:
+        return []
 
-    # --- Step 1: Clean and Decode Base64 ---
+    page_costs = [estimate_page_cost(page) for page in reader.pages]
+    total_cost = sum(page_costs)
+
+    # As many shards as the cost justifies, up to what Marker can run at once
+    shard_count = min(
+        max_parallel_calls, total_pages, max(1, int(total_cost // min_shard_cost))
+    )
+    page_ranges = partition_pages(page_costs, shard_count)
+
+    print(
+        f"DEBUG: Total Pages: {total_pages} | Est. Cost: {total_cost:.1f} | "
+        f"Shards: {len(page_ranges)} | Pages per shard: "
+        f"{[end - start for start, end in page_ranges]}"
+    )
+    return page_ranges
+
+
+def decode_base64_pdf(base64_string: str) -> BytesIO | None:
+    """
+    Decodes a Base64 string (optionally with Data URI prefix) into a PDF file
+    object, or returns None if it is not valid Base64.
+    """
     # Check if string has a Data URI prefix (common in web responses)
     if "," in base64_string and "base64" in base64_string:
         base64_string = base64_string.split(",")[1]
@@ -33,11 +154,34 @@ def base64_to_chunked_pdfs(
         pdf_bytes = base64.b64decode(base64_string)
     except Exception as e:
         print(f"Error decoding Base64: {e}")
-        return []
+        return None
 
-    # --- Step 2: Load into PDF Reader ---
     # Wrap bytes in BytesIO so pypdf treats it like a file object
-    pdf_stream = io.BytesIO(pdf_bytes)
+    return io.BytesIO(pdf_bytes)
+
+
+def pdf_to_shards(
+    pdf_stream: BinaryIO,
+    max_parallel_calls=MAX_PDF_SHARDS,
+    min_shard_cost=MIN_SHARD_COST,
+    mode: str = PDF_SHARD_MODE,
+) -> list[PdfShard]:
+    """
+    Splits a PDF read from a seekable binary file object into parser shards.
+
+    In "page_range" mode every shard carries the original PDF bytes plus the
+    pages to parse, so the document is only read once here; the caller
+    uploads it once with upload_shared_pdf. PDFs larger than
+    PDF_PAGE_RANGE_MAX_BYTES, and "rewrite" mode, get one rewritten PDF per
+    shard instead, so a huge original is not read by every parser call.
+
+    Returns:
+        List of {"pdf_data", "page_range", "pdf_path"} shards in document order
+    """
+    if mode not in PDF_SHARD_MODES:
+        raise ValueError(
+            f"Invalid PDF shard mode '{mode}'. Allowed values: {', '.join(PDF_SHARD_MODES)}"
+        )
 
     try:
         reader = PdfReader(pdf_stream)
@@ -45,26 +189,33 @@ def base64_to_chunked_pdfs(
         print(f"Error reading PDF structure: {e}")
         return []
 
-    # --- Step 3: Calculate Chunk Size ---
-    total_pages = len(reader.pages)
+    page_ranges = plan_pdf_shards(reader, max_parallel_calls, min_shard_cost)
 
-    # Calculate Dynamic Chunk Size
-    # We need to fit 'total_pages' into 'max_parallel_calls' bins.
-    required_size_for_limit = math.ceil(total_pages / max_parallel_calls)
+    pdf_size = pdf_stream.seek(0, io.SEEK_END)
+    if mode == "page_range" and pdf_size <= PDF_PAGE_RANGE_MAX_BYTES:
+        pdf_stream.seek(0)
+        pdf_bytes = pdf_stream.read()
+        return [
+            {"pdf_data": pdf_bytes, "page_range": page_range, "pdf_path": None}
+            for page_range in page_ranges
+        ]
 
-    # Use the larger of the two: strict limit size OR user preference
-    chunk_size = max(min_pages, required_size_for_limit)
+    return [
+        {"pdf_data": pdf_data, "page_range": None, "pdf_path": None}
+        for pdf_data in write_page_ranges(reader, page_ranges)
+    ]
 
-    print(
-        f"DEBUG: Total Pages: {total_pages} | Chunk Size: {chunk_size} | Est. Calls: {math.ceil(total_pages/chunk_size)}"
-    )
 
-    # --- Step 4: Chunk Pages Directly ---
+def write_page_ranges(
+    reader: PdfReader, page_ranges: list[tuple[int, int]]
+) -> list[bytes]:
+    """
+    Write each [start, end) page range of a PDF out as a standalone PDF.
+    """
     split_pdfs = []
 
-    for start_page in range(0, total_pages, chunk_size):
+    for start_page, end_page in page_ranges:
         writer = PdfWriter()
-        end_page = min(start_page + chunk_size, total_pages)
 
         # Add pages directly from the reader to the chunk
         for page_num in range(start_page, end_page):
@@ -1,11 +1,13 @@
 from markdown_it import MarkdownIt
 from schemas.index import SplitContent
 
+# CommonMark with tables, built once. Only block structure is needed to find
+# the tables, so inline parsing (emphasis, links, ...) is skipped.
+_markdown = MarkdownIt("commonmark").enable("table").disable("inline")
+
 
 def extract_tables_and_text(text: str) -> list[SplitContent]:
-    # Use CommonMark preset and explicitly enable table support
-    md = MarkdownIt("commonmark").enable("table")
-    tokens = md.parse(text)
+    tokens = _markdown.parse(text)
 
     # 1. Extract and Sort Ranges
     # We filter for table_open and ensure the map exists.
@@ -0,0 +1,140 @@
+import os
+from collections import OrderedDict
+from functools import lru_cache
+
+# Tokenizer used to size chunks in CHUNK_LENGTH_MODE=tokens. It should match
+# the embedding model (BGE-M3) so child budgets line up with its window.
+CHUNK_TOKENIZER = os.environ.get("CHUNK_TOKENIZER", "BAAI/bge-m3")
+TOKEN_OFFSETS_CACHE_SIZE = int(os.environ.get("TOKEN_OFFSETS_CACHE_SIZE", "100000"))
+
+# text -> character offsets of its tokens, least recently used first
+_offsets_cache: OrderedDict[str, tuple[tuple[int, int], ...]] = OrderedDict()
+
+
+@lru_cache(maxsize=1)
+def get_tokenizer():
+    """
+    Fast (Rust) tokenizer, loaded on first use. Needs the `token-chunking`
+    extra (tokenizers).
+    """
+    from tokenizers import Tokenizer  # type: ignore
+
+    if os.path.isfile(CHUNK_TOKENIZER):
+        return Tokenizer.from_file(CHUNK_TOKENIZER)
+    return Tokenizer.from_pretrained(CHUNK_TOKENIZER)
+
+
+def token_offsets_many(texts: list[str]) -> list[tuple[tuple[int, int], ...]]:
+    """
+    Token offsets of every text, without special tokens. Texts not seen
+    recently are encoded in one batch.
+    """
+    found: dict[str, tuple[tuple[int, int], ...]] = {}
+    missing: dict[str, None] = {}
+    for text in texts:
+        offsets = _offsets_cache.get(text)
+        if offsets is None:
+            missing.setdefault(text, None)
+        else:
+            _offsets_cache.move_to_end(text)
+            found[text] = offsets
+
+    if missing:
+        encodings = get_tokenizer().encode_batch(
+            list(missing), add_special_tokens=False
+        )
+        for text, encoding in zip(missing, encodings, strict=True):
+            found[text] = _offsets_cache[text] = tuple(encoding.offsets)
+        while len(_offsets_cache) > TOKEN_OFFSETS_CACHE_SIZE:
+            _offsets_cache.popitem(last=False)
+
+    return [found[text] for text in texts]
+
+
+def count_tokens_many(texts: list[str]) -> list[int]:
+    return [len(offsets) for offsets in token_offsets_many(texts)]
+
+
+def _split_by_offsets(text: str, max_tokens: int) -> list[str]:
+    """
+    Cut text at token boundaries into pieces of at most max_tokens tokens,
+    preferring a cut before a token that follows whitespace.
+    """
+    (offsets,) = token_offsets_many([text])
+    pieces: list[str] = []
+    start_token = 0
+    start_char = 0
+    while len(offsets) - start_token > max_tokens:
+        cut = start_token + max_tokens
+        for candidate in range(cut, start_token + max_tokens // 2, -1):
+            char = offsets[candidate][0]
+            if char > 0 and text[char - 1].isspace():
+                cut = candidate
+                break
+        end_char = offsets[cut][0]
+        piece = text[start_char:end_char].strip()
+        if piece:
+            pieces.append(piece)
+        start_token = cut
+        start_char = end_char
+    piece = text[start_char:].strip()
+    if piece:
+        pieces.append(piece)
+    return pieces
+
+
+def fit_token_budget(text: str, max_tokens: int, header_lines: int = 0) -> list[str]:
+    """
+    Split text into pieces of at most max_tokens tokens each.
+
+    Whole lines are grouped first, so a table is split between rows; its
+    first `header_lines` lines are repeated at the top of every piece when
+    they fit. Lines that are too long on their own are cut at token
+    boundaries.
+    """
+    (count,) = count_tokens_many([text])
+    if count <= max_tokens:
+        return [text]
+
+    lines = text.split("\n")
+    header = lines[:header_lines]
+    rows = lines[header_lines:]
+    (header_tokens,) = count_tokens_many(["\n".join(header)]) if header else (0,)
+    if header_tokens * 2 > max_tokens:
+        header, rows, header_tokens = [], lines, 0
+
+    pieces: list[str] = []
+    group: list[str] = []
+    group_tokens = header_tokens
+
+    def flush_group():
+        if group:
+            pieces.append("\n".join([*header, *group]))
+            group.clear()
+
+    for row, row_tokens in zip(rows, count_tokens_many(rows), strict=True):
+        if header_tokens + row_tokens > max_tokens:
+            flush_group()
+            group_tokens = header_tokens
+            pieces.extend(_split_by_offsets(row, max_tokens))
+            continue
+        if group_tokens + row_tokens > max_tokens:
+            flush_group()
+            group_tokens = header_tokens
+        group.append(row)
+        group_tokens += row_tokens
+    flush_group()
+
+    # Token counts of joined lines can differ slightly from their sum, so
+    # check every piece and cut the few that still overflow
+    fitted: list[str] = []
+    for piece, piece_tokens in zip(pieces, count_tokens_many(pieces), strict=True):
+        if piece_tokens <= max_tokens:
+            fitted.append(piece)
+            continue
+        for budget in range(max_tokens, 0, -max(1, max_tokens // 10)):
+            parts = _split_by_offsets(piece, budget)
+            if all(tokens <= max_tokens for tokens in count_tokens_many(parts)):
+                break
+        fitted.extend(parts)
+    return fitted
@@ -0,0 +1 @@
+"""Benchmarks for the retrieval worker. Run from apps/retrieval-worker with `python -m benchmarks.<name>`."""
@@ -0,0 +1,95 @@
+"""
+Latency benchmark for retrieve_keyword_chunks: full-text vs. legacy regex.
+
+Seeds a synthetic notebook whose chunks are written in a fixed pseudo-word
+vocabulary, then runs the same random keyword sets through every keyword
+search mode. Agreement is the overlap of each mode's results with the regex
+results, which is the behaviour being replaced.
+
+    python -m benchmarks.keyword_search --chunks 200000 --queries 50
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+root_dir = Path(__file__).parent.parent.parent.parent
+load_dotenv(dotenv_path=root_dir / ".env")
+
+from utils.chunk_retriever import retrieve_keyword_chunks  # noqa: E402
+from utils.db_client import close_db, get_db, init_db  # noqa: E402
+from utils.retrieval_config import KEYWORD_SEARCH_MODES  # noqa: E402
+
+from benchmarks.synthetic_notebook import (  # noqa: E402
+    create_synthetic_notebook,
+    drop_synthetic_notebook,
+    synthetic_keywords,
+)
+
+
+def percentile(samples: list[float], pct: int) -> float:
+    return statistics.quantiles(samples, n=100, method="inclusive")[pct - 1]
+
+
+async def run(args: argparse.Namespace) -> None:
+    await init_db()
+    db = get_db()
+
+    notebook_id = args.notebook_id
+    if not notebook_id:
+        print(f"Seeding synthetic notebook with {args.chunks} chunks...", flush=True)
+        notebook_id = await create_synthetic_notebook(db, args.chunks)
+        await db.execute_raw('ANALYZE "DocumentChunk"')
+        print(f"Notebook: {notebook_id}", flush=True)
+
+    try:
+        keyword_sets = [synthetic_keywords(args.keywords) for _ in range(args.queries)]
+
+        results: dict[str, list[set[str]]] = {}
+        print(f"\n{'mode':<12}{'p50 ms':>10}{'p99 ms':>10}{'agreement':>12}")
+        # Regex first so the other modes can be compared against it
+        for mode in sorted(KEYWORD_SEARCH_MODES, key=lambda m: m != "regex"):
+            latencies: list[float] = []
+            results[mode] = []
+            for keywords in keyword_sets:
+                start = time.perf_counter()
+                parent_ids = await retrieve_keyword_chunks(
+                    notebook_id, keywords, args.limit, mode=mode
+                )
+                latencies.append((time.perf_counter() - start) * 1000)
+                results[mode].append(set(parent_ids))
+
+            agreement = statistics.mean(
+                len(found & expected) / max(len(expected), 1)
+                for found, expected in zip(results[mode], results["regex"], strict=True)
+            )
+            print(
+                f"{mode:<12}{percentile(latencies, 50):>10.1f}"
+                f"{percentile(latencies, 99):>10.1f}{agreement:>12.3f}"
+            )
+    finally:
+        if not args.notebook_id and not args.keep:
+            print("\nDropping synthetic notebook...", flush=True)
+            await drop_synthetic_notebook(db, notebook_id)
+        await close_db()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chunks", type=int, default=200_000)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--keywords", type=int, default=4)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--notebook-id", help="Reuse an already seeded notebook")
+    parser.add_argument(
+        "--keep", action="store_true", help="Keep the seeded notebook afterwards"
+    )
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+Latency benchmark for query embedding: in-process ONNX vs. BGEM3EmbedderCPU.
+
+Each request embeds --per-request short queries in one embed_queries call,
+as retrieve_chunks does, with --concurrency requests in flight at once. The
+first call of each backend is reported separately since it includes model
+loading (local) or a container cold start (remote).
+
+    python -m benchmarks.query_embedding --requests 200 --concurrency 4
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+root_dir = Path(__file__).parent.parent.parent.parent
+load_dotenv(dotenv_path=root_dir / ".env")
+
+from lib.llm_client import (  # noqa: E402
+    LocalQueryEmbedder,
+    RemoteQueryEmbedder,
+    remote_embedder,
+)
+from modal_services import app as modal_app  # noqa: E402
+
+_TEMPLATES = [
+    "What does the document say about {}?",
+    "Summarise the section on {} and {}",
+    "How is {} related to {}?",
+    "{} requirements for {}",
+    "List every mention of {} in the report",
+]
+_TOPICS = [
+    "revenue growth",
+    "data retention",
+    "quarterly results",
+    "risk factors",
+    "model architecture",
+    "encryption keys",
+    "onboarding",
+    "supply chain",
+    "latency budget",
+    "customer churn",
+    "compliance",
+    "the appendix tables",
+]
+
+
+def percentile(samples: list[float], pct: int) -> float:
+    return statistics.quantiles(samples, n=100, method="inclusive")[pct - 1]
+
+
+def synthetic_queries(count: int, rng: random.Random) -> list[str]:
+    queries = []
+    for _ in range(count):
+        template = rng.choice(_TEMPLATES)
+        topics = rng.sample(_TOPICS, template.count("{}"))
+        queries.append(template.format(*topics))
+    return queries
+
+
+async def measure(embedder, requests: list[list[str]], concurrency: int):
+    start = time.perf_counter()
+    await embedder.embed_queries(requests[0])
+    first_ms = (time.perf_counter() - start) * 1000
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: list[float] = []
+
+    async def timed_request(queries: list[str]):
+        async with semaphore:
+            request_start = time.perf_counter()
+            await embedder.embed_queries(queries)
+            latencies.append((time.perf_counter() - request_start) * 1000)
+
+    wall_start = time.perf_counter()
+    await asyncio.gather(*(timed_request(queries) for queries in requests[1:]))
+    wall_s = time.perf_counter() - wall_start
+    return first_ms, latencies, wall_s
+
+
+async def run(args: argparse.Namespace) -> None:
+    rng = random.Random(args.seed)
+    requests = [
+        synthetic_queries(args.per_request, rng) for _ in range(args.requests + 1)
+    ]
+    backends = {
+        "local": lambda: LocalQueryEmbedder(threads=args.threads),
+        "remote": lambda: RemoteQueryEmbedder(remote_embedder),
+    }
+
+    print(f"\n{'backend':<10}{'first ms':>10}{'p50 ms':>10}{'p99 ms':>10}{'req/s':>10}")
+    for name in args.backends:
+        first_ms, latencies, wall_s = await measure(
+            backends[name](), requests, args.concurrency
+        )
+        print(
+            f"{name:<10}{first_ms:>10.1f}{percentile(latencies, 50):>10.1f}"
+            f"{percentile(latencies, 99):>10.1f}{len(latencies) / wall_s:>10.1f}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--backends",
+        nargs="+",
+        choices=["local", "remote"],
+        default=["local", "remote"],
+    )
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument(
+        "--per-request", type=int, default=3, help="Optimized queries per request"
+    )
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument(
+        "--threads", type=int, default=2, help="Thread pool size of the local backend"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if "remote" in args.backends:
+        with modal_app.run():
+            asyncio.run(run(args))
+    else:
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import itertools
+import math
+import random
+import uuid
+
+from generated.db import Prisma
+
+EMBEDDING_DIM = 1024
+# Large odd multiplier so neighbouring cluster centres are unrelated
+CENTRE_SEED = 7919
+WORDS_PER_CHUNK = 60
+
+# ~5.6k pronounceable pseudo-words so keyword searches have realistic selectivity
+_SYLLABLES = [c + v for c in "bdfgklmnprstvz" for v in "aeiou"]
+VOCABULARY = [
+    "".join(parts)
+    for parts in itertools.islice(itertools.product(_SYLLABLES, repeat=3), 0, None, 61)
+]
+
+# Embeddings are generated inside Postgres so a million-row notebook never has to
+# be serialised through the query engine. Each chunk sits near one of `clusters`
+# deterministic centres, which gives the ANN index a realistic neighbourhood
+# structure (uniform random vectors in 1024 dims are all roughly equidistant).
+INSERT_CHUNKS_SQL = """
+    INSERT INTO "DocumentChunk" (id, content, "parentIds", embedding, "sourceId", "notebookId")
+    SELECT
+        $1 || '-' || g,
+        (
+            SELECT string_agg(($10::text[])[1 + floor(random() * array_length($10::text[], 1))::int], ' ')
+            FROM generate_series(1, $11::int) w
+            WHERE g > 0
+        ),
+        ARRAY[$1 || '-parent-' || g],
+        (
+            SELECT array_agg(sin((g % $4) * $5 + d) + (random() - 0.5) * $6)
+            FROM generate_series(1, $7::int) d
+        )::vector,
+        $2,
+        $3
+    FROM generate_series($8::int, $9::int) g;
+"""
+
+
+async def create_synthetic_notebook(
+    db: Prisma,
+    chunks: int,
+    clusters: int = 1000,
+    noise: float = 0.5,
+    batch_size: int = 20000,
+) -> str:
+    """
+    Creates a throwaway user, notebook and source holding `chunks` synthetic
+    DocumentChunk rows. Returns the notebook ID.
+    """
+    run_id = f"bench-{uuid.uuid4()}"
+    user = await db.user.create(
+        data={"id": run_id, "name": "benchmark", "email": f"{run_id}@benchmark.invalid"}
+    )
+    notebook = await db.notebook.create(
+        data={"name": f"Benchmark {run_id}", "userId": user.id}
+    )
+    source = await db.source.create(
+        data={
+            "name": "synthetic.pdf",
+            "userId": user.id,
+            "notebookId": notebook.id,
+            "processingStatus": "completed",
+        }
+    )
+
+    for start in range(1, chunks + 1, batch_size):
+        end = min(start + batch_size - 1, chunks)
+        await db.execute_raw(
+            INSERT_CHUNKS_SQL,
+            run_id,
+            source.id,
+            notebook.id,
+            clusters,
+            CENTRE_SEED,
+            noise,
+            EMBEDDING_DIM,
+            start,
+            end,
+            VOCABULARY,
+            WORDS_PER_CHUNK,
+        )
+        print(f"  seeded {end}/{chunks} chunks", flush=True)
+
+    return notebook.id
+
+
+def synthetic_keywords(count: int = 3) -> list[str]:
+    """
+    Draws keywords from the vocabulary the seeded chunks are written in.
+    """
+    return random.sample(VOCABULARY, count)
+
+
+def synthetic_query_embedding(clusters: int = 1000, noise: float = 0.5) -> list[float]:
+    """
+    Draws a query vector from the same distribution as the seeded chunks.
+    """
+    centre = random.randrange(clusters)
+    return [
+        math.sin(centre * CENTRE_SEED + d) + (random.random() - 0.5) * noise
+        for d in range(1, EMBEDDING_DIM + 1)
+    ]
+
+
+async def drop_synthetic_notebook(db: Prisma, notebook_id: str) -> None:
+    """
+    Deletes the benchmark user; notebook, source and chunks cascade with it.
+    """
+    notebook = await db.notebook.find_unique(where={"id": notebook_id})
+    if notebook:
+        await db.user.delete(where={"id": notebook.userId})
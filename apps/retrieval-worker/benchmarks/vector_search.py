@@ -0,0 +1,118 @@
+"""
+Recall-vs-latency benchmark for retrieve_vector_chunks.
+
+Compares HNSW search at several ef_search values against exact search on a
+synthetic notebook. Seeding 1M chunks takes a while because the HNSW index is
+maintained on insert; pass --notebook-id to reuse a notebook seeded earlier
+with --keep.
+
+    python -m benchmarks.vector_search --chunks 1000000 --queries 50
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+root_dir = Path(__file__).parent.parent.parent.parent
+load_dotenv(dotenv_path=root_dir / ".env")
+
+from utils.chunk_retriever import retrieve_vector_chunks  # noqa: E402
+from utils.db_client import close_db, get_db, init_db  # noqa: E402
+
+from benchmarks.synthetic_notebook import (  # noqa: E402
+    create_synthetic_notebook,
+    drop_synthetic_notebook,
+    synthetic_query_embedding,
+)
+
+
+def percentile(samples: list[float], pct: int) -> float:
+    return statistics.quantiles(samples, n=100, method="inclusive")[pct - 1]
+
+
+async def timed_search(
+    notebook_id: str, embedding: list[float], limit: int, mode: str, ef_search=None
+) -> tuple[list[str], float]:
+    start = time.perf_counter()
+    parent_ids = await retrieve_vector_chunks(
+        notebook_id, embedding, limit, search_mode=mode, ef_search=ef_search
+    )
+    return parent_ids, (time.perf_counter() - start) * 1000
+
+
+async def run(args: argparse.Namespace) -> None:
+    await init_db()
+    db = get_db()
+
+    notebook_id = args.notebook_id
+    if not notebook_id:
+        print(f"Seeding synthetic notebook with {args.chunks} chunks...", flush=True)
+        notebook_id = await create_synthetic_notebook(
+            db, args.chunks, clusters=args.clusters
+        )
+        await db.execute_raw('ANALYZE "DocumentChunk"')
+        print(f"Notebook: {notebook_id}", flush=True)
+
+    try:
+        embeddings = [
+            synthetic_query_embedding(args.clusters) for _ in range(args.queries)
+        ]
+
+        exact_results: list[set[str]] = []
+        exact_latencies: list[float] = []
+        for embedding in embeddings:
+            parent_ids, latency = await timed_search(
+                notebook_id, embedding, args.limit, "exact"
+            )
+            exact_results.append(set(parent_ids))
+            exact_latencies.append(latency)
+
+        print(
+            f"\n{'mode':<16}{'recall@' + str(args.limit):>12}{'p50 ms':>10}{'p99 ms':>10}"
+        )
+        print(
+            f"{'exact':<16}{1.0:>12.3f}"
+            f"{percentile(exact_latencies, 50):>10.1f}{percentile(exact_latencies, 99):>10.1f}"
+        )
+
+        for ef_search in args.ef_search:
+            recalls: list[float] = []
+            latencies: list[float] = []
+            for embedding, expected in zip(embeddings, exact_results, strict=True):
+                parent_ids, latency = await timed_search(
+                    notebook_id, embedding, args.limit, "hnsw", ef_search
+                )
+                latencies.append(latency)
+                recalls.append(len(expected & set(parent_ids)) / max(len(expected), 1))
+
+            print(
+                f"{'hnsw ef=' + str(ef_search):<16}{statistics.mean(recalls):>12.3f}"
+                f"{percentile(latencies, 50):>10.1f}{percentile(latencies, 99):>10.1f}"
+            )
+    finally:
+        if not args.notebook_id and not args.keep:
+            print("\nDropping synthetic notebook...", flush=True)
+            await drop_synthetic_notebook(db, notebook_id)
+        await close_db()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chunks", type=int, default=1_000_000)
+    parser.add_argument("--clusters", type=int, default=1000)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[40, 100, 200, 400])
+    parser.add_argument("--notebook-id", help="Reuse an already seeded notebook")
+    parser.add_argument(
+        "--keep", action="store_true", help="Keep the seeded notebook afterwards"
+    )
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+import hashlib
+import json
+import math
+import operator
+import os
+import time
+from dataclasses import dataclass
+
+from generated.db.enums import Encryption
+from lib.query_cache import decode_embedding, encode_embedding
+from lib.redis_client import get_async_redis_client
+from utils.chunk_retriever import embed_queries
+from utils.db_client import get_db
+
+# Semantic cache of final answers per notebook. A question asked without
+# earlier messages is matched as typed, before the QueryOptimizer runs, so a
+# hit skips rewriting as well. A follow-up is matched by its QueryOptimizer
+# rewrites instead, which resolve references to earlier messages. An answer is
+# reused for a question at least ANSWER_CACHE_SIMILARITY_THRESHOLD cosine
+# similar, as long as the notebook's sources have not changed since. Notebooks
+# opt out with Notebook.answerCacheEnabled; encrypted notebooks never use it.
+ANSWER_CACHE_ENABLED = os.environ.get("ANSWER_CACHE_ENABLED", "true") == "true"
+ANSWER_CACHE_SIMILARITY_THRESHOLD = float(
+    os.environ.get("ANSWER_CACHE_SIMILARITY_THRESHOLD", "0.95")
+)
+ANSWER_CACHE_MAX_ENTRIES_PER_NOTEBOOK = int(
+    os.environ.get("ANSWER_CACHE_MAX_ENTRIES_PER_NOTEBOOK", "200")
+)
+ANSWER_CACHE_TTL_SECONDS = int(
+    os.environ.get("ANSWER_CACHE_TTL_SECONDS", str(7 * 24 * 3600))
+)
+# A turn with earlier messages whose rewrites are less similar than this to
+# the question as typed ("why?", "tell me more") took its meaning from the
+# conversation, and is neither served from nor stored in the cache
+ANSWER_CACHE_STANDALONE_SIMILARITY = float(
+    os.environ.get("ANSWER_CACHE_STANDALONE_SIMILARITY", "0.8")
+)
+# Bump when the answer prompt, citation markup or what is embedded changes
+ANSWER_CACHE_VERSION = "v3"
+
+
+@dataclass
+class AnswerCacheLookup:
+    """
+    Result of looking a question up. `answer` is the cached final response on
+    a hit; on a miss, the same lookup is passed to store_cached_answer.
+    `standalone` is False for a notebook with earlier messages, whose
+    questions are only matched once match_cached_rewrites has run.
+    """
+
+    key: str
+    question_embedding: list[float]
+    standalone: bool
+    rewrites_embedding: list[float] | None = None
+    answer: str | None = None
+    similarity: float = 0.0
+
+
+async def notebook_content_version(notebook_id: str) -> str:
+    """
+    Hash of the notebook's sources and their processing status, so adding,
+    removing or reprocessing a source gives every cached answer a new key.
+    """
+    db = get_db()
+    rows = await db.query_raw(
+        """
+        SELECT s.id, s."processingStatus"::text AS status
+        FROM "Source" s
+        WHERE s."notebookId" = $1
+        ORDER BY s.id;
+        """,
+        notebook_id,
+    )
+    sources = "\n".join(f"{row['id']}:{row['status']}" for row in rows)
+    return hashlib.sha256(sources.encode()).hexdigest()
+
+
+def _normalise(embedding: list[float]) -> list[float]:
+    norm = math.sqrt(sum(map(operator.mul, embedding, embedding)))
+    return [value / norm for value in embedding] if norm else embedding
+
+
+def _dot(a: list[float], b: list[float]) -> float:
+    return sum(map(operator.mul, a, b))
+
+
+def _mean(embeddings: list[list[float]]) -> list[float]:
+    return [sum(values) / len(embeddings) for values in zip(*embeddings, strict=True)]
+
+
+def _has_conversation(context) -> bool:
+    return bool(
+        isinstance(context, dict)
+        and (context.get("messages") or context.get("summaries"))
+    )
+
+
+async def _match_cached_answer(
+    lookup: AnswerCacheLookup, field: str, embedding: list[float]
+):
+    """
+    Compare `embedding` with the `field` embedding of every answer cached for
+    the notebook version, keeping the most similar on the lookup.
+    """
+    client = get_async_redis_client()
+    for raw in await client.lrange(lookup.key, 0, -1):
+        entry = json.loads(raw)
+        if not entry.get(field):
+            continue
+        similarity = _dot(embedding, decode_embedding(entry[field]))
+        if similarity > lookup.similarity:
+            lookup.similarity = similarity
+            if similarity >= ANSWER_CACHE_SIMILARITY_THRESHOLD:
+                lookup.answer = entry["answer"]
+
+
+async def lookup_cached_answer(
+    notebook_id: str, user_query: str
+) -> AnswerCacheLookup | None:
+    """
+    Look the question up as typed, before the QueryOptimizer runs. For a
+    notebook without earlier messages, the cached question of this notebook
+    version most similar to `user_query` is found; otherwise matching waits
+    for match_cached_rewrites.
+
+    Returns None when the cache does not apply to the notebook (disabled,
+    encrypted or missing) or when Redis fails; the request then runs the full
+    pipeline and nothing is stored.
+    """
+    if not ANSWER_CACHE_ENABLED:
+        return None
+
+    db = get_db()
+    notebook = await db.notebook.find_unique(where={"id": notebook_id})
+    if (
+        not notebook
+        or not notebook.answerCacheEnabled
+        or notebook.encryption != Encryption.NotEncrypted
+    ):
+        return None
+
+    try:
+        (question,) = await embed_queries([user_query], notebook.encryption)
+        version = await notebook_content_version(notebook_id)
+        lookup = AnswerCacheLookup(
+            key=f"answer_cache:{ANSWER_CACHE_VERSION}:{notebook_id}:{version}",
+            # Stored embeddings are unit length too, so a dot product is the cosine
+            question_embedding=_normalise(question),
+            standalone=not _has_conversation(notebook.context),
+        )
+        if lookup.standalone:
+            await _match_cached_answer(
+                lookup, "question_embedding", lookup.question_embedding
+            )
+        return lookup
+    except Exception as e:
+        print(f"⚠️ Answer cache lookup failed: {e}", flush=True)
+        return None
+
+
+async def match_cached_rewrites(
+    lookup: AnswerCacheLookup, enhanced_queries: list[str]
+) -> AnswerCacheLookup | None:
+    """
+    Embed the QueryOptimizer rewrites of a question that missed, so the
+    answer is stored under them. A follow-up is matched against the cached
+    rewrites too; a standalone question already was as typed.
+
+    Returns None when the follow-up depends on the conversation, or when
+    Redis fails; nothing is then stored.
+    """
+    if not enhanced_queries:
+        return None
+
+    try:
+        # The rewrites are embedded again by retrieval, which then hits the
+        # query embedding cache
+        rewrites = await embed_queries(enhanced_queries, Encryption.NotEncrypted)
+        lookup.rewrites_embedding = _normalise(_mean(rewrites))
+        if lookup.standalone:
+            return lookup
+
+        if (
+            _dot(lookup.question_embedding, lookup.rewrites_embedding)
+            < ANSWER_CACHE_STANDALONE_SIMILARITY
+        ):
+            print("Answer cache skipped: question depends on the conversation")
+            return None
+
+        await _match_cached_answer(
+            lookup, "rewrites_embedding", lookup.rewrites_embedding
+        )
+        return lookup
+    except Exception as e:
+        print(f"⚠️ Answer cache lookup failed: {e}", flush=True)
+        return None
+
+
+async def store_cached_answer(lookup: AnswerCacheLookup, final_response: str):
+    """
+    Cache the final response under the looked up notebook version, keeping
+    the ANSWER_CACHE_MAX_ENTRIES_PER_NOTEBOOK newest answers.
+    """
+    if not final_response or lookup.rewrites_embedding is None:
+        return
+
+    entry = json.dumps(
+        {
+            # Only standalone questions are matched as typed later on
+            "question_embedding": (
+                encode_embedding(lookup.question_embedding)
+                if lookup.standalone
+                else None
+            ),
+            "rewrites_embedding": encode_embedding(lookup.rewrites_embedding),
+            "answer": final_response,
+            "created_at": time.time(),
+        }
+    )
+    try:
+        client = get_async_redis_client()
+        async with client.pipeline(transaction=False) as pipe:
+            pipe.lpush(lookup.key, entry)
+            pipe.ltrim(lookup.key, 0, ANSWER_CACHE_MAX_ENTRIES_PER_NOTEBOOK - 1)
+            pipe.expire(lookup.key, ANSWER_CACHE_TTL_SECONDS)
+            await pipe.execute()
+    except Exception as e:
+        print(f"⚠️ Answer cache write failed: {e}", flush=True)
@@ -0,0 +1,180 @@
+import asyncio
+import os
+import time
+
+from lib.redis_client import get_async_redis_client
+from utils.prepare_context import prepare_context
+from utils.summarise_messages import summarise_messages
+
+# Message summaries and the notebook context are updated after the answer has
+# been sent, one job at a time per notebook. A new turn for the notebook waits
+# for its pending jobs, because prepare_question reads the context they write.
+CONTEXT_JOB_MAX_ATTEMPTS = int(os.environ.get("CONTEXT_JOB_MAX_ATTEMPTS", "3"))
+CONTEXT_JOB_RETRY_DELAY_SECONDS = float(
+    os.environ.get("CONTEXT_JOB_RETRY_DELAY_SECONDS", "2")
+)
+# Longest a turn waits for earlier jobs before going ahead with the old context
+CONTEXT_JOB_WAIT_TIMEOUT_SECONDS = float(
+    os.environ.get("CONTEXT_JOB_WAIT_TIMEOUT_SECONDS", "120")
+)
+CONTEXT_JOB_POLL_INTERVAL_SECONDS = 0.1
+
+# Newest job per notebook in this process; each job awaits the one before it
+_pending_jobs: dict[str, asyncio.Task] = {}
+
+
+def _pending_key(notebook_id: str) -> str:
+    """
+    Redis counter of unfinished jobs, so turns served by another worker wait
+    for them too. It expires in case a worker dies with jobs in flight.
+    """
+    return f"context_jobs:pending:{notebook_id}"
+
+
+async def _run_context_update(
+    previous: asyncio.Task | None,
+    user_query: str,
+    final_response: str,
+    notebook_id: str,
+    assistant_message_id: str,
+    user_message_id: str,
+    encryption_type: str,
+    encryption_key: str | None,
+):
+    if previous:
+        # Its failure is already logged; the context must still move forward
+        await asyncio.gather(previous, return_exceptions=True)
+
+    summarised = False
+    try:
+        for attempt in range(1, CONTEXT_JOB_MAX_ATTEMPTS + 1):
+            try:
+                if not summarised:
+                    await summarise_messages(
+                        user_query,
+                        final_response,
+                        assistant_message_id,
+                        user_message_id,
+                        encryption_type,
+                        encryption_key,
+                    )
+                    summarised = True
+                await prepare_context(
+                    user_query,
+                    final_response,
+                    notebook_id,
+                    assistant_message_id,
+                    user_message_id,
+                    encryption_key,
+                )
+                print(f"🧠 Context updated for notebook: {notebook_id}", flush=True)
+                return
+            except Exception as e:
+                print(
+                    f"⚠️ Context update for notebook {notebook_id} failed "
+                    f"(attempt {attempt}/{CONTEXT_JOB_MAX_ATTEMPTS}): {e}",
+                    flush=True,
+                )
+                if attempt == CONTEXT_JOB_MAX_ATTEMPTS:
+                    raise
+                await asyncio.sleep(
+                    CONTEXT_JOB_RETRY_DELAY_SECONDS * 2 ** (attempt - 1)
+                )
+    finally:
+        try:
+            client = get_async_redis_client()
+            key = _pending_key(notebook_id)
+            # Below zero when the counter expired while the job was running
+            if await client.decr(key) <= 0:
+                await client.delete(key)
+        except Exception as e:
+            print(f"⚠️ Could not release context job marker: {e}", flush=True)
+
+
+async def enqueue_context_update(
+    user_query: str,
+    final_response: str,
+    notebook_id: str,
+    assistant_message_id: str,
+    user_message_id: str,
+    encryption_type: str,
+    encryption_key: str | None,
+):
+    """
+    Summarise the turn's messages and fold them into the notebook context in
+    the background, retrying failures with exponential backoff.
+    """
+    try:
+        client = get_async_redis_client()
+        key = _pending_key(notebook_id)
+        async with client.pipeline(transaction=True) as pipe:
+            pipe.incr(key)
+            pipe.expire(key, int(CONTEXT_JOB_WAIT_TIMEOUT_SECONDS))
+            await pipe.execute()
+    except Exception as e:
+        # Turns on this worker still wait for the job through _pending_jobs
+        print(f"⚠️ Could not record context job marker: {e}", flush=True)
+
+    task = asyncio.create_task(
+        _run_context_update(
+            _pending_jobs.get(notebook_id),
+            user_query,
+            final_response,
+            notebook_id,
+            assistant_message_id,
+            user_message_id,
+            encryption_type,
+            encryption_key,
+        )
+    )
+    _pending_jobs[notebook_id] = task
+
+    def _forget(finished: asyncio.Task):
+        if _pending_jobs.get(notebook_id) is finished:
+            del _pending_jobs[notebook_id]
+        if not finished.cancelled() and finished.exception():
+            print(
+                f"❌ Context update for notebook {notebook_id} gave up: "
+                f"{finished.exception()}",
+                flush=True,
+            )
+
+    task.add_done_callback(_forget)
+
+
+async def wait_for_context_updates(notebook_id: str):
+    """
+    Wait until the notebook's earlier context updates, on any worker, have
+    finished, for at most CONTEXT_JOB_WAIT_TIMEOUT_SECONDS.
+    """
+    deadline = time.monotonic() + CONTEXT_JOB_WAIT_TIMEOUT_SECONDS
+
+    task = _pending_jobs.get(notebook_id)
+    if task:
+        try:
+            await asyncio.wait_for(
+                asyncio.shield(task), timeout=CONTEXT_JOB_WAIT_TIMEOUT_SECONDS
+            )
+        except TimeoutError:
+            print(f"⚠️ Context update for {notebook_id} timed out", flush=True)
+            return
+        except Exception:
+            pass  # Logged by the job itself
+
+    try:
+        client = get_async_redis_client()
+        while int(await client.get(_pending_key(notebook_id)) or 0) > 0:
+            if time.monotonic() >= deadline:
+                print(f"⚠️ Context update for {notebook_id} timed out", flush=True)
+                return
+            await asyncio.sleep(CONTEXT_JOB_POLL_INTERVAL_SECONDS)
+    except Exception as e:
+        print(f"⚠️ Could not check context job marker: {e}", flush=True)
+
+
+async def drain_context_updates():
+    """
+    Let every queued context update finish, e.g. before shutting down.
+    """
+    if _pending_jobs:
+        await asyncio.gather(*_pending_jobs.values(), return_exceptions=True)
@@ -1,3 +1,8 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 from modal_services import (
     BGEM3EmbedderCPU,
     MXBAIRerankerV2,
@@ -7,3 +12,167 @@ from modal_services import (
 remote_llm = Qwen2_5_14BAWQ()
 remote_embedder = BGEM3EmbedderCPU()
 remote_filter = MXBAIRerankerV2()
+
+# "remote" -> queries are embedded by BGEM3EmbedderCPU on Modal (default)
+# "local"  -> queries are embedded in this process with an ONNX export of BGE-M3,
+#             needs the `local-embeddings` extra (onnxruntime)
+EMBEDDING_BACKENDS = ("remote", "local")
+EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND", "remote")
+# Hugging Face repo or local directory holding the export and its tokenizer.
+# Point these at an int8-quantised export for faster CPU inference.
+LOCAL_EMBEDDING_MODEL = os.environ.get("LOCAL_EMBEDDING_MODEL", "BAAI/bge-m3")
+LOCAL_EMBEDDING_ONNX_FILE = os.environ.get(
+    "LOCAL_EMBEDDING_ONNX_FILE", "onnx/model.onnx"
+)
+# Encodes running at once; ONNX Runtime splits the CPU cores between them
+LOCAL_EMBEDDING_THREADS = int(os.environ.get("LOCAL_EMBEDDING_THREADS", "2"))
+LOCAL_EMBEDDING_MAX_LENGTH = 8192
+
+if EMBEDDING_BACKEND not in EMBEDDING_BACKENDS:
+    raise ValueError(
+        f"Invalid embedding backend '{EMBEDDING_BACKEND}'. Allowed values: {', '.join(EMBEDDING_BACKENDS)}"
+    )
+
+
+class RemoteQueryEmbedder:
+    """
+    Query embeddings from BGEM3EmbedderCPU on Modal.
+    """
+
+    def __init__(self, embedder: BGEM3EmbedderCPU):
+        self.embedder = embedder
+
+    async def warmup(self):
+        pass
+
+    async def generate_embeddings(
+        self, texts: str | list[str], batch_size: int = 12
+    ) -> list[float] | list[list[float]]:
+        return await self.embedder.generate_embeddings.remote.aio(texts, batch_size)
+
+    async def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        return await self.embedder.embed_queries.remote.aio(texts)
+
+
+class LocalQueryEmbedder:
+    """
+    BGE-M3 dense embeddings computed in this process with ONNX Runtime.
+
+    The model is loaded once, on warmup or first use, and every encode runs
+    in a thread pool so the event loop keeps serving other chats. Vectors are
+    the normalised CLS embedding, as BGEM3FlagModel returns for `dense_vecs`.
+    """
+
+    def __init__(
+        self,
+        model: str = LOCAL_EMBEDDING_MODEL,
+        onnx_file: str = LOCAL_EMBEDDING_ONNX_FILE,
+        threads: int = LOCAL_EMBEDDING_THREADS,
+    ):
+        self.model = model
+        self.onnx_file = onnx_file
+        self.threads = max(1, threads)
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.threads, thread_name_prefix="query-embedder"
+        )
+        self.session = None
+        self.tokenizer = None
+        self.load_lock = threading.Lock()
+        # Fast tokenizers are not safe to call from several threads at once
+        self.tokenizer_lock = threading.Lock()
+
+    def load(self):
+        with self.load_lock:
+            if self.session is not None:
+                return
+
+            import onnxruntime  # type: ignore
+            from huggingface_hub import snapshot_download
+            from transformers import AutoTokenizer
+
+            model_dir = self.model
+            if not os.path.isdir(model_dir):
+                # The export may keep its weights in a side file (model.onnx_data)
+                model_dir = snapshot_download(
+                    self.model,
+                    allow_patterns=[
+                        f"{self.onnx_file}*",
+                        "*.json",
+                        "sentencepiece.bpe.model",
+                    ],
+                )
+
+            options = onnxruntime.SessionOptions()
+            options.intra_op_num_threads = max(1, (os.cpu_count() or 1) // self.threads)
+            self.session = onnxruntime.InferenceSession(
+                os.path.join(model_dir, self.onnx_file),
+                options,
+                providers=["CPUExecutionProvider"],
+            )
+            self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+            print(f"🔢 Loaded local query embedder from {self.model}", flush=True)
+
+    def encode(self, texts: list[str]) -> list[list[float]]:
+        import numpy as np
+
+        self.load()
+        with self.tokenizer_lock:
+            tokens = self.tokenizer(
+                texts,
+                padding=True,
+                truncation=True,
+                max_length=LOCAL_EMBEDDING_MAX_LENGTH,
+                return_tensors="np",
+            )
+        feed = {
+            model_input.name: tokens[model_input.name].astype(np.int64)
+            for model_input in self.session.get_inputs()
+            if model_input.name in tokens
+        }
+        output_names = [output.name for output in self.session.get_outputs()]
+        outputs = dict(zip(output_names, self.session.run(None, feed), strict=True))
+
+        # BAAI's export returns dense_vecs directly; plain exports return the
+        # hidden states, pooled here the way BGE-M3 does
+        dense = outputs.get("dense_vecs")
+        if dense is None:
+            dense = outputs[output_names[0]][:, 0]
+        dense = dense / np.linalg.norm(dense, axis=-1, keepdims=True)
+        return dense.astype(np.float32).tolist()
+
+    async def warmup(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self.encode, ["warmup"])
+
+    async def generate_embeddings(
+        self, texts: str | list[str], batch_size: int = 12
+    ) -> list[float] | list[list[float]]:
+        """
+        Same interface as BGEM3EmbedderCPU.generate_embeddings: a single string
+        gives one vector, a list gives one vector per text.
+        """
+        if isinstance(texts, str):
+            return (await self.generate_embeddings([texts], batch_size))[0]
+
+        loop = asyncio.get_running_loop()
+        batches = await asyncio.gather(
+            *(
+                loop.run_in_executor(
+                    self.executor, self.encode, texts[start : start + batch_size]
+                )
+                for start in range(0, len(texts), batch_size)
+            )
+        )
+        return [vector for batch in batches for vector in batch]
+
+    async def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        if not texts:
+            return []
+        return await self.generate_embeddings(texts)
+
+
+query_embedder = (
+    LocalQueryEmbedder()
+    if EMBEDDING_BACKEND == "local"
+    else RemoteQueryEmbedder(remote_embedder)
+)
@@ -1,12 +1,16 @@
+from lib.answer_cache import (
+    lookup_cached_answer,
+    match_cached_rewrites,
+    store_cached_answer,
+)
+from lib.context_jobs import enqueue_context_update, wait_for_context_updates
 from utils.chunk_retriever import retrieve_chunks
 from utils.extract_citations import extract_citations
 from utils.filter_parent_chunks import filter_parent_chunks
 from utils.get_parent_chunks import get_parent_chunks
-from utils.prepare_answer import prepare_answer
-from utils.prepare_context import prepare_context
+from utils.prepare_answer import prepare_answer, prepare_answer_stream
 from utils.prepare_question import prepare_question
 from utils.save_to_db import save_to_db
-from utils.summarise_messages import summarise_messages
 
 
 class ClientConnectionInterrupted(Exception):
@@ -15,6 +19,12 @@ class ClientConnectionInterrupted(Exception):
     pass
 
 
+class AnswerToken(str):
+    """A piece of the final answer, yielded between status updates when streaming."""
+
+    pass
+
+
 async def process_request(
     notebook_id: str,
     assistant_message_id: str,
@@ -22,87 +32,113 @@ async def process_request(
     user_message_id: str,
     encryption_type: str,
     encryption_key: str | None,
+    stream: bool = False,
 ):
     """
     Async generator that processes the request and yields status updates.
     Yields status strings that match the frontend expectations.
+    With stream=True, the answer is also yielded as AnswerToken pieces while
+    it is being generated.
     Raises ClientConnectionInterrupted if the client connection is cut.
     """
     try:
-        # 1. Prepare the question
+        # 1. Prepare the question, with the context left by earlier turns
         yield "preparing_question"
-        print(f"Preparing question: {user_query}")
-        prepared_question, enhanced_queries = await prepare_question(
-            user_query, notebook_id, encryption_key
-        )
-        print(
-            f"Prepared {len(prepared_question)} optimized queries: {enhanced_queries}"
-        )
+        await wait_for_context_updates(notebook_id)
 
-        # 2. Retrieve the chunks
-        yield "retrieving_chunks"
-        print(f"Retrieving chunks for notebook: {notebook_id}")
-        chunks = await retrieve_chunks(notebook_id, prepared_question, encryption_type)
-        print(f"Retrieved chunks for {chunks} queries")
-
-        # 4. Get the parent chunks
-        yield "getting_parent_chunks"
-        print("Getting parent chunks")
-        parent_chunks = await get_parent_chunks(chunks, encryption_type, encryption_key)
-        print(f"Got parent chunks for {parent_chunks} queries")
-
-        # 5. Filter the parent chunks
-        yield "filtering_parent_chunks"
-        print("Filtering parent chunks")
-        filtered_parent_chunks = await filter_parent_chunks(parent_chunks)
-        print(f"Filtered to {filtered_parent_chunks} query results")
-
-        # 5. Extract the content
-        yield "extracting_content"
-        print("Extracting content")
-        extracted_citations = await extract_citations(
-            filtered_parent_chunks, user_query
-        )
-        print(f"Extracted {len(extracted_citations)} citations")
+        # Serve a cached answer to a near-identical question, if any. A
+        # question without earlier messages is matched before rewriting.
+        answer_lookup = await lookup_cached_answer(notebook_id, user_query)
+        if answer_lookup is None or answer_lookup.answer is None:
+            print(f"Preparing question: {user_query}")
+            prepared_question, enhanced_queries = await prepare_question(
+                user_query, notebook_id, encryption_key
+            )
+            print(
+                f"Prepared {len(prepared_question)} optimized queries: {enhanced_queries}"
+            )
+            if answer_lookup:
+                # Follow-ups are matched by their rewrites
+                answer_lookup = await match_cached_rewrites(
+                    answer_lookup, enhanced_queries
+                )
 
-        # 7. Generate the response
-        yield "generating_response"
-        final_response = await prepare_answer(
-            extracted_citations, user_query, enhanced_queries
-        )
-        print(f"Final response generated ({final_response} chars)")
+        if answer_lookup and answer_lookup.answer is not None:
+            print(
+                f"Serving cached answer (similarity {answer_lookup.similarity:.3f})",
+                flush=True,
+            )
+            yield "generating_response"
+            final_response = answer_lookup.answer
+            if stream:
+                yield AnswerToken(final_response)
+        else:
+            # 2. Retrieve the chunks
+            yield "retrieving_chunks"
+            print(f"Retrieving chunks for notebook: {notebook_id}")
+            chunks = await retrieve_chunks(
+                notebook_id, prepared_question, encryption_type
+            )
+            print(f"Retrieved chunks for {chunks} queries")
 
-        print("Summarising messages")
-        yield "summarizing_content"
-        await summarise_messages(
-            user_query,
-            final_response,
-            assistant_message_id,
-            user_message_id,
-            encryption_type,
-            encryption_key,
+            # 4. Get the parent chunks
+            yield "getting_parent_chunks"
+            print("Getting parent chunks")
+            parent_chunks = await get_parent_chunks(
+                chunks, encryption_type, encryption_key
+            )
+            print(f"Got parent chunks for {parent_chunks} queries")
+
+            # 5. Filter the parent chunks
+            yield "filtering_parent_chunks"
+            print("Filtering parent chunks")
+            filtered_parent_chunks = await filter_parent_chunks(parent_chunks)
+            print(f"Filtered to {filtered_parent_chunks} query results")
+
+            # 5. Extract the content
+            yield "extracting_content"
+            print("Extracting content")
+            extracted_citations = await extract_citations(
+                filtered_parent_chunks, user_query
+            )
+            print(f"Extracted {len(extracted_citations)} citations")
+
+            # 7. Generate the response
+            yield "generating_response"
+            if stream:
+                answer_parts: list[str] = []
+                async for text in prepare_answer_stream(
+                    extracted_citations, user_query, enhanced_queries
+                ):
+                    answer_parts.append(text)
+                    yield AnswerToken(text)
+                final_response = "".join(answer_parts)
+            else:
+                final_response = await prepare_answer(
+                    extracted_citations, user_query, enhanced_queries
+                )
+            print(f"Final response generated ({final_response} chars)")
+
+            if answer_lookup:
+                await store_cached_answer(answer_lookup, final_response)
+
+        # 8. Save the response to the database
+        yield "saving_to_db"
+        print(f"Saving response to database: {assistant_message_id}")
+        await save_to_db(
+            assistant_message_id, final_response, encryption_type, encryption_key
         )
-        print("Messages summarised")
 
-        # 8. Prepare the context
-        yield "preparing_context"
-        print("Preparing context")
-        await prepare_context(
+        # 9. Summarise the messages and update the context after the stream ends
+        await enqueue_context_update(
             user_query,
             final_response,
             notebook_id,
             assistant_message_id,
             user_message_id,
+            encryption_type,
             encryption_key,
         )
-        print("Context prepared")
-
-        # 9. Save the response to the database
-        yield "saving_to_db"
-        print(f"Saving response to database: {assistant_message_id}")
-        await save_to_db(
-            assistant_message_id, final_response, encryption_type, encryption_key
-        )
 
         # 10. Cleanup
         yield "cleaning_up"
@@ -0,0 +1,220 @@
+import base64
+import hashlib
+import json
+import os
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+from collections.abc import Callable
+from typing import Any
+
+from generated.db.enums import Encryption
+from lib.redis_client import get_async_redis_client
+
+# Two-level caches for query embeddings and QueryOptimizer rewrites: a small
+# in-process LRU in front of Redis, which is shared by every worker. Both
+# levels expire entries and hold a bounded number of them.
+QUERY_CACHE_ENABLED = os.environ.get("QUERY_CACHE_ENABLED", "true") == "true"
+QUERY_CACHE_L1_MAX_ENTRIES = int(os.environ.get("QUERY_CACHE_L1_MAX_ENTRIES", "2048"))
+QUERY_CACHE_L1_TTL_SECONDS = int(os.environ.get("QUERY_CACHE_L1_TTL_SECONDS", "300"))
+QUERY_CACHE_REDIS_MAX_ENTRIES = int(
+    os.environ.get("QUERY_CACHE_REDIS_MAX_ENTRIES", "100000")
+)
+EMBEDDING_CACHE_TTL_SECONDS = int(
+    os.environ.get("EMBEDDING_CACHE_TTL_SECONDS", str(7 * 24 * 3600))
+)
+QUERY_OPTIMIZER_CACHE_TTL_SECONDS = int(
+    os.environ.get("QUERY_OPTIMIZER_CACHE_TTL_SECONDS", "3600")
+)
+# Bump when the embedding model or optimizer prompt changes
+QUERY_CACHE_VERSION = "v1"
+
+
+def cache_enabled_for(encryption_type: str | None) -> bool:
+    """
+    AdvancedEncryption notebooks never touch the cache: their queries and
+    rewrites must not be stored outside the notebook.
+    """
+    return QUERY_CACHE_ENABLED and encryption_type != Encryption.AdvancedEncryption
+
+
+def normalise_query(text: str) -> str:
+    """
+    Fold case, Unicode forms and whitespace so trivially different spellings
+    of a question share a cache entry.
+    """
+    return " ".join(unicodedata.normalize("NFKC", text).casefold().split())
+
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def embedding_cache_key(query: str) -> str:
+    return _sha256(normalise_query(query))
+
+
+def query_optimizer_cache_key(context: Any, user_input: str) -> str:
+    """
+    Key a rewrite by the notebook context it was resolved against and the
+    user input, so a new message in the conversation invalidates it.
+    """
+    context_hash = _sha256(json.dumps(context, sort_keys=True, default=str))
+    return _sha256(f"{context_hash}\n{normalise_query(user_input)}")
+
+
+def encode_embedding(embedding: list[float]) -> str:
+    return base64.b64encode(array("f", embedding).tobytes()).decode()
+
+
+def decode_embedding(value: str) -> list[float]:
+    embedding = array("f")
+    embedding.frombytes(base64.b64decode(value))
+    return embedding.tolist()
+
+
+class TwoLevelCache:
+    """
+    In-process LRU (L1) in front of Redis (L2).
+
+    L1 holds up to QUERY_CACHE_L1_MAX_ENTRIES values for at most
+    QUERY_CACHE_L1_TTL_SECONDS. In Redis every value has the cache's TTL, and
+    a sorted set of last use keeps at most QUERY_CACHE_REDIS_MAX_ENTRIES of
+    them by evicting the least recently used. Redis errors count as misses.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        ttl_seconds: int,
+        encode: Callable[[Any], str] = json.dumps,
+        decode: Callable[[str], Any] = json.loads,
+    ):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.encode = encode
+        self.decode = decode
+        self.prefix = f"query_cache:{QUERY_CACHE_VERSION}:{name}"
+        self.lru_key = f"{self.prefix}:lru"
+        self.local: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self.stats = {"l1_hits": 0, "l2_hits": 0, "misses": 0, "bypassed": 0}
+
+    def _local_get(self, key: str) -> Any | None:
+        entry = self.local.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self.local[key]
+            return None
+        self.local.move_to_end(key)
+        return value
+
+    def _local_set(self, key: str, value: Any):
+        ttl = min(QUERY_CACHE_L1_TTL_SECONDS, self.ttl_seconds)
+        self.local[key] = (time.monotonic() + ttl, value)
+        self.local.move_to_end(key)
+        while len(self.local) > QUERY_CACHE_L1_MAX_ENTRIES:
+            self.local.popitem(last=False)
+
+    async def get_many(self, keys: list[str]) -> list[Any | None]:
+        values = [self._local_get(key) for key in keys]
+        self.stats["l1_hits"] += sum(value is not None for value in values)
+
+        missing = [index for index, value in enumerate(values) if value is None]
+        if missing:
+            try:
+                found = await self._redis_get([keys[index] for index in missing])
+            except Exception as e:
+                print(f"⚠️ {self.name} cache read failed: {e}", flush=True)
+                found = [None] * len(missing)
+            for index, value in zip(missing, found, strict=True):
+                if value is not None:
+                    values[index] = value
+                    self._local_set(keys[index], value)
+                    self.stats["l2_hits"] += 1
+                else:
+                    self.stats["misses"] += 1
+        return values
+
+    async def get(self, key: str) -> Any | None:
+        return (await self.get_many([key]))[0]
+
+    async def set_many(self, items: dict[str, Any]):
+        for key, value in items.items():
+            self._local_set(key, value)
+        if not items:
+            return
+        try:
+            await self._redis_set(items)
+        except Exception as e:
+            print(f"⚠️ {self.name} cache write failed: {e}", flush=True)
+
+    async def set(self, key: str, value: Any):
+        await self.set_many({key: value})
+
+    def record_bypass(self, count: int = 1):
+        self.stats["bypassed"] += count
+
+    async def _redis_get(self, keys: list[str]) -> list[Any | None]:
+        client = get_async_redis_client()
+        raw_values = await client.mget([f"{self.prefix}:{key}" for key in keys])
+        hits = {key: raw for key, raw in zip(keys, raw_values, strict=True) if raw}
+        if hits:
+            # Refresh last use of hits only, so it never resurrects evicted keys
+            await client.zadd(self.lru_key, dict.fromkeys(hits, time.time()), xx=True)
+        return [self.decode(hits[key]) if key in hits else None for key in keys]
+
+    async def _redis_set(self, items: dict[str, Any]):
+        client = get_async_redis_client()
+        now = time.time()
+        async with client.pipeline(transaction=False) as pipe:
+            for key, value in items.items():
+                pipe.set(
+                    f"{self.prefix}:{key}", self.encode(value), ex=self.ttl_seconds
+                )
+            pipe.zadd(self.lru_key, dict.fromkeys(items, now))
+            # Forget entries Redis has already expired
+            pipe.zremrangebyscore(self.lru_key, "-inf", now - self.ttl_seconds)
+            pipe.zcard(self.lru_key)
+            *_, size = await pipe.execute()
+
+        excess = size - QUERY_CACHE_REDIS_MAX_ENTRIES
+        if excess > 0:
+            evicted = [key for key, _ in await client.zpopmin(self.lru_key, excess)]
+            if evicted:
+                await client.delete(*(f"{self.prefix}:{key}" for key in evicted))
+
+    def snapshot(self) -> dict:
+        lookups = self.stats["l1_hits"] + self.stats["l2_hits"] + self.stats["misses"]
+        hits = self.stats["l1_hits"] + self.stats["l2_hits"]
+        return {
+            **self.stats,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "l1_entries": len(self.local),
+        }
+
+
+embedding_cache = TwoLevelCache(
+    "embedding",
+    EMBEDDING_CACHE_TTL_SECONDS,
+    encode=encode_embedding,
+    decode=decode_embedding,
+)
+query_optimizer_cache = TwoLevelCache(
+    "query_optimizer", QUERY_OPTIMIZER_CACHE_TTL_SECONDS
+)
+
+
+def cache_stats() -> dict:
+    """
+    Hit and miss counters of this process's caches, for sizing them.
+    """
+    return {
+        "enabled": QUERY_CACHE_ENABLED,
+        "caches": {
+            cache.name: cache.snapshot()
+            for cache in (embedding_cache, query_optimizer_cache)
+        },
+    }
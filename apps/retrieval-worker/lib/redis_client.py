@@ -1,22 +1,27 @@
 import os
 
 import redis
+import redis.asyncio
 
+_CLIENT_OPTIONS = {
+    "decode_responses": True,
+    "socket_connect_timeout": 5,
+    "socket_keepalive": True,
+    "health_check_interval": 30,
+    "retry_on_timeout": True,
+}
 
-def _create_redis_client():
-    """Create a Redis client with connection pooling."""
+
+def _get_redis_url() -> str:
     redis_url = os.environ.get("REDIS_URL")
     if not redis_url:
         raise RuntimeError("REDIS_URL environment variable is not set")
+    return redis_url
+
 
-    return redis.from_url(
-        redis_url,
-        decode_responses=True,
-        socket_connect_timeout=5,
-        socket_keepalive=True,
-        health_check_interval=30,
-        retry_on_timeout=True,
-    )
+def _create_redis_client():
+    """Create a Redis client with connection pooling."""
+    return redis.from_url(_get_redis_url(), **_CLIENT_OPTIONS)
 
 
 # Singleton Redis client instance - can be imported directly
@@ -54,3 +59,29 @@ def reset_redis_client():
 def get_redis_client():
     """Get the Redis client instance (lazy initialization)."""
     return _initialize_client()
+
+
+# Singleton asyncio Redis client, used by the request pipeline so cache
+# lookups do not block the event loop serving other chats
+async_redis_client = None
+
+
+def get_async_redis_client():
+    """Get the asyncio Redis client instance (lazy initialization)."""
+    global async_redis_client
+    if async_redis_client is None:
+        async_redis_client = redis.asyncio.from_url(_get_redis_url(), **_CLIENT_OPTIONS)
+        print("🔌 Async Redis client initialized", flush=True)
+    return async_redis_client
+
+
+async def close_async_redis_client():
+    """Close the asyncio Redis connection and reset the singleton."""
+    global async_redis_client
+    if async_redis_client:
+        try:
+            await async_redis_client.aclose()
+            print("🔌 Async Redis connection closed", flush=True)
+        except Exception:
+            pass  # Ignore errors during cleanup
+        async_redis_client = None
@@ -8,6 +8,8 @@ class MessageData(BaseModel):
     content: str = Field(..., min_length=1)
     encryption_type: str | None = None
     encryption_key: str | None = None
+    # Also send the answer as "token" events while it is generated
+    stream: bool = False
 
     class Config:
         extra = "forbid"
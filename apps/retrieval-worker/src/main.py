@@ -1,3 +1,4 @@
+import json
 import threading
 from contextlib import asynccontextmanager
 from pathlib import Path
@@ -11,7 +12,11 @@ load_dotenv(dotenv_path=env_path)
 
 from fastapi import FastAPI  # noqa: E402
 from fastapi.responses import StreamingResponse  # noqa: E402
-from lib.process_request import process_request  # noqa: E402
+from lib.context_jobs import drain_context_updates  # noqa: E402
+from lib.llm_client import query_embedder  # noqa: E402
+from lib.process_request import AnswerToken, process_request  # noqa: E402
+from lib.query_cache import cache_stats  # noqa: E402
+from lib.redis_client import close_async_redis_client  # noqa: E402
 from modal_services import app as modal_app  # noqa: E402
 from schemas import MessageData  # noqa: E402
 from utils.db_client import close_db, init_db  # noqa: E402
@@ -46,8 +51,13 @@ async def lifespan(_app: FastAPI):
     modal_ready.wait()
 
     await init_db()
+    # Load a local query embedder before the first chat instead of during it
+    await query_embedder.warmup()
     yield
+    # Finish summaries and context updates of answers already sent
+    await drain_context_updates()
     await close_db()
+    await close_async_redis_client()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -58,6 +68,12 @@ def search(q: str):
     return {"status": "ok", "uv_worker": True, "query": q}
 
 
+@app.get("/cache/stats")
+def get_cache_stats():
+    """Hit rates of this worker's query embedding and rewrite caches."""
+    return cache_stats()
+
+
 @app.post("/chat")
 async def chat(request: MessageData):
     notebook_id = request.notebook_id
@@ -66,6 +82,7 @@ async def chat(request: MessageData):
     user_message_id = request.user_message_id
     encryption_type = request.encryption_type
     encryption_key = request.encryption_key
+    stream = request.stream
 
     async def generate():
         """Generator function that yields status updates in SSE format."""
@@ -77,7 +94,13 @@ async def chat(request: MessageData):
                 user_message_id,
                 encryption_type,
                 encryption_key,
+                stream,
             ):
+                if isinstance(status, AnswerToken):
+                    # Answer text is JSON encoded so newlines survive the
+                    # line-based SSE framing: "event: token\ndata: "...""
+                    yield f"event: token\ndata: {json.dumps(status)}\n\n"
+                    continue
                 # Send status in SSE format: "data: status\n\n"
                 yield f"data: {status}\n\n"
         except Exception as e:
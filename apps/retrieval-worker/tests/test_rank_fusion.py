@@ -0,0 +1,56 @@
+from utils.rank_fusion import reciprocal_rank_fusion
+
+
+def test_items_found_by_both_retrievers_rank_first():
+    fused = reciprocal_rank_fusion(
+        {"vector": ["a", "b", "c"], "keyword": ["c", "d"]},
+        weights={"vector": 1.0, "keyword": 1.0},
+        k=60,
+    )
+
+    assert fused == ["c", "a", "b", "d"]
+
+
+def test_ties_keep_first_seen_order():
+    # Same rank in equally weighted lists gives equal scores
+    fused = reciprocal_rank_fusion(
+        {"vector": ["a", "b"], "keyword": ["x", "y"]},
+        weights={"vector": 1.0, "keyword": 1.0},
+        k=60,
+    )
+
+    assert fused == ["a", "x", "b", "y"]
+
+
+def test_weights_favour_one_retriever():
+    rankings = {"vector": ["a", "b"], "keyword": ["b", "a"]}
+
+    assert reciprocal_rank_fusion(rankings, {"vector": 2.0, "keyword": 1.0}) == [
+        "a",
+        "b",
+    ]
+    assert reciprocal_rank_fusion(rankings, {"vector": 1.0, "keyword": 2.0}) == [
+        "b",
+        "a",
+    ]
+
+
+def test_zero_weight_ignores_a_retriever():
+    fused = reciprocal_rank_fusion(
+        {"vector": ["a"], "keyword": ["b", "c"]},
+        weights={"vector": 1.0, "keyword": 0.0},
+    )
+
+    assert fused == ["a"]
+
+
+def test_unknown_retrievers_weigh_one_and_limit_truncates():
+    fused = reciprocal_rank_fusion(
+        {"vector": ["a", "b"], "other": ["c", "b"]},
+        weights={"vector": 1.0},
+        k=1,
+        limit=2,
+    )
+
+    # b: 1/3 + 1/3, a: 1/2, c: 1/2 (a seen first)
+    assert fused == ["b", "a"]
@@ -0,0 +1,74 @@
+import random
+import re
+
+import pytest
+from schemas import FinalisedCitations
+from utils.prepare_answer import (
+    StreamingCitationRewriter,
+    clean_response,
+    renumber_citations,
+    replace_with_citation,
+)
+
+CITATIONS = {
+    "<cit_1>": FinalisedCitations(
+        how_it_answers="States the revenue figure",
+        sourceId="source-1",
+        chunkId="12",
+        real_text='Revenue grew [see](http://x) to "$4M"',
+    ),
+    "<cit_2>": FinalisedCitations(
+        how_it_answers="Explains the latency target",
+        sourceId="source-2",
+        chunkId="40",
+    ),
+}
+
+MODEL_OUTPUTS = [
+    "## Revenue\n\nRevenue grew to $4M <cit_1>. Latency fell <cit_2><cit_1>.",
+    "Slashes before markers \\<cit_1> and /<cit_2> are dropped.   Spaces  collapse.",
+    "A stray marker <cit_7> and a partial one at the end <cit_",
+    "Repeated <cit_2> markers <cit_2> get new numbers <cit_1>.\n\n- item <cit_1>\n",
+    "No citations at all, just text.   ",
+]
+
+
+def buffered(text: str) -> str:
+    # prepare_answer's pipeline; the streamed answer is additionally stripped
+    result = replace_with_citation(text, CITATIONS)
+    result = renumber_citations(result)
+    return clean_response(result).strip()
+
+
+def streamed(pieces: list[str]) -> str:
+    rewriter = StreamingCitationRewriter(CITATIONS)
+    output = [rewriter.feed(piece) for piece in pieces]
+    output.append(rewriter.flush())
+    return "".join(output)
+
+
+def random_split(text: str, rng: random.Random) -> list[str]:
+    cuts = sorted(rng.sample(range(1, len(text)), k=min(len(text) - 1, 12)))
+    return [
+        text[start:end]
+        for start, end in zip([0, *cuts], [*cuts, len(text)], strict=True)
+    ]
+
+
+@pytest.mark.parametrize("text", MODEL_OUTPUTS)
+def test_one_character_tokens_match_buffered_rewrite(text):
+    assert streamed(list(text)) == buffered(text)
+
+
+@pytest.mark.parametrize("text", MODEL_OUTPUTS)
+def test_random_token_boundaries_match_buffered_rewrite(text):
+    rng = random.Random(text)
+    for _ in range(50):
+        assert streamed(random_split(text, rng)) == buffered(text)
+
+
+def test_citations_are_numbered_in_order_of_appearance():
+    answer = streamed(["A <cit_2>", " B <ci", "t_1> C <cit_2>"])
+
+    labels = re.findall(r'data-source-id="([^"]+)"[^>]*>\[(\d+)\]', answer)
+    assert labels == [("source-2", "1"), ("source-1", "2"), ("source-2", "3")]
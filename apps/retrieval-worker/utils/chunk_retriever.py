@@ -1,14 +1,48 @@
-import asyncio
+import json
 import re
 
 from generated.db.enums import Encryption
-from lib.llm_client import remote_embedder
+from lib.llm_client import query_embedder
+from lib.query_cache import cache_enabled_for, embedding_cache, embedding_cache_key
 from schemas.query_optimizer import OptimizedQuery
 from utils.db_client import get_db
+from utils.rank_fusion import reciprocal_rank_fusion
+from utils.retrieval_config import (
+    FULLTEXT_CONFIG,
+    FULLTEXT_RANK_NORMALIZATION,
+    FUSED_PARENTS_PER_QUERY,
+    KEYWORD_SEARCH_MODE,
+    KEYWORD_SEARCH_MODES,
+    VECTOR_SEARCH_MODE,
+    vector_search_statements,
+)
+
+
+def _collect_parent_ids(rows: list[dict]) -> list[str]:
+    """
+    Flatten the parentIds of already ranked rows, keeping first-seen order.
+    """
+    parent_ids: dict[str, None] = {}
+    for row in rows:
+        for pid in row.get("parentIds") or []:
+            parent_ids.setdefault(pid, None)
+    return list(parent_ids)
+
+
+def _websearch_query(keywords: list[str]) -> str:
+    """
+    Build a websearch_to_tsquery string that matches ANY keyword. Each keyword is
+    quoted so multi-word keywords ("react native") are matched as phrases.
+    """
+    terms = [k.replace('"', " ").strip() for k in keywords]
+    return " OR ".join(f'"{term}"' for term in dict.fromkeys(terms) if term)
 
 
 async def retrieve_keyword_chunks(
-    notebook_id: str, keywords: list[str], limit: int = 20
+    notebook_id: str,
+    keywords: list[str],
+    limit: int = 20,
+    mode: str = KEYWORD_SEARCH_MODE,
 ) -> list[str]:
     db = get_db()
     clean_keys = list({k.strip() for k in keywords if k.strip()})
@@ -16,6 +50,30 @@ async def retrieve_keyword_chunks(
     if not clean_keys:
         return []
 
+    if mode == "fulltext":
+        # GIN index on the generated tsvector column, ranked by cover density
+        chunks_raw = await db.query_raw(
+            f"""
+            SELECT
+                dc."parentIds"
+            FROM "DocumentChunk" dc,
+                websearch_to_tsquery('{FULLTEXT_CONFIG}'::regconfig, $2) AS query
+            WHERE dc."notebookId" = $1
+              AND dc."contentTsv" @@ query
+            ORDER BY ts_rank_cd(dc."contentTsv", query, {FULLTEXT_RANK_NORMALIZATION}) DESC
+            LIMIT $3;
+            """,
+            notebook_id,
+            _websearch_query(clean_keys),
+            limit,
+        )
+        return _collect_parent_ids(chunks_raw)
+
+    if mode != "regex":
+        raise ValueError(
+            f"Invalid keyword search mode '{mode}'. Allowed values: {', '.join(KEYWORD_SEARCH_MODES)}"
+        )
+
     # 2. Build the "Filter" Regex (Fast Index Scan)
     # Finds chunks containing AT LEAST one keyword
     # Pattern: "key1|key2|key3"
@@ -42,8 +100,7 @@ async def retrieve_keyword_chunks(
         SELECT
             dc."parentIds"
         FROM "DocumentChunk" dc
-        JOIN "Source" s ON dc."sourceId" = s.id
-        WHERE s."notebookId" = $1
+        WHERE dc."notebookId" = $1
           AND dc.content ~* $2
         ORDER BY ({score_clause}) DESC
         LIMIT {limit};
@@ -51,41 +108,204 @@ async def retrieve_keyword_chunks(
 
     chunks_raw = await db.query_raw(sql, *query_params)
 
-    # Collect unique parent IDs from all matching chunks.
-    parent_ids: set[str] = set()
-    for row in chunks_raw:
-        # Each row is expected to have a "parentIds" array column.
-        for pid in row.get("parentIds") or []:
-            parent_ids.add(pid)
-
-    return list(parent_ids)
+    return _collect_parent_ids(chunks_raw)
 
 
 async def retrieve_vector_chunks(
-    notebook_id: str, embeddings: list[float], limit: int = 20
+    notebook_id: str,
+    embeddings: list[float],
+    limit: int = 20,
+    search_mode: str = VECTOR_SEARCH_MODE,
+    ef_search: int | None = None,
 ) -> list[str]:
     db = get_db()
-    vector_chunks_raw = await db.query_raw(
-        """
-        SELECT
-            dc."parentIds"
-        FROM "DocumentChunk" dc
-        JOIN "Source" s ON dc."sourceId" = s.id
-        WHERE s."notebookId" = $1
-        ORDER BY dc.embedding <=> $2::vector ASC
-        LIMIT $3;
-        """,
-        notebook_id,
-        embeddings,
-        limit,
-    )
+    # SET LOCAL only lasts for the surrounding transaction, so the search
+    # settings never leak into other queries on the shared connection
+    async with db.tx() as transaction:
+        for statement in vector_search_statements(search_mode, ef_search):
+            await transaction.execute_raw(statement)
 
-    parent_ids: set[str] = set()
-    for row in vector_chunks_raw:
-        for pid in row.get("parentIds") or []:
-            parent_ids.add(pid)
+        vector_chunks_raw = await transaction.query_raw(
+            """
+            SELECT
+                dc."parentIds"
+            FROM "DocumentChunk" dc
+            WHERE dc."notebookId" = $1
+            ORDER BY dc.embedding <=> $2::vector ASC
+            LIMIT $3;
+            """,
+            notebook_id,
+            embeddings,
+            limit,
+        )
 
-    return list(parent_ids)
+    return _collect_parent_ids(vector_chunks_raw)
+
+
+def _keyword_spec(query_index: int, keywords: list[str], mode: str) -> dict | None:
+    """
+    Build the per-query keyword spec consumed by the batched SQL for `mode`.
+    """
+    clean_keys = list({k.strip() for k in keywords if k.strip()})
+    if not clean_keys:
+        return None
+
+    if mode == "fulltext":
+        return {"query_index": query_index, "query": _websearch_query(clean_keys)}
+
+    escaped_keys = [re.escape(k) for k in clean_keys]
+    return {
+        "query_index": query_index,
+        "pattern": f"({'|'.join(escaped_keys)})",
+        "keywords": escaped_keys,
+    }
+
+
+# Per keyword mode: the CTE decoding the $3 jsonb specs and the LATERAL hit query.
+# Both must expose `score` where higher is better.
+_KEYWORD_QUERIES_SQL = {
+    "fulltext": f"""
+        keyword_queries AS (
+            SELECT
+                (k.spec->>'query_index')::int AS query_index,
+                websearch_to_tsquery('{FULLTEXT_CONFIG}'::regconfig, k.spec->>'query') AS tsquery
+            FROM jsonb_array_elements($3::jsonb) AS k(spec)
+        )""",
+    "regex": """
+        keyword_queries AS (
+            SELECT
+                (k.spec->>'query_index')::int AS query_index,
+                k.spec->>'pattern' AS pattern,
+                ARRAY(SELECT jsonb_array_elements_text(k.spec->'keywords')) AS keywords
+            FROM jsonb_array_elements($3::jsonb) AS k(spec)
+        )""",
+}
+_KEYWORD_HITS_SQL = {
+    "fulltext": f"""
+            SELECT
+                dc."parentIds",
+                ts_rank_cd(dc."contentTsv", k.tsquery, {FULLTEXT_RANK_NORMALIZATION})::float8 AS score
+            FROM "DocumentChunk" dc
+            WHERE dc."notebookId" = $1
+              AND dc."contentTsv" @@ k.tsquery
+            ORDER BY score DESC
+            LIMIT $4""",
+    "regex": """
+            SELECT
+                dc."parentIds",
+                (SELECT count(*) FROM unnest(k.keywords) kw WHERE dc.content ~* kw)::float8 AS score
+            FROM "DocumentChunk" dc
+            WHERE dc."notebookId" = $1
+              AND dc.content ~* k.pattern
+            ORDER BY score DESC
+            LIMIT $4""",
+}
+
+
+async def retrieve_hybrid_chunks(
+    notebook_id: str,
+    optimized_queries: list[OptimizedQuery],
+    limit: int = 20,
+    include_keywords: bool = True,
+    keyword_mode: str = KEYWORD_SEARCH_MODE,
+) -> list[dict[str, list[str]]]:
+    """
+    Run vector and keyword retrieval for every optimized query in a single SQL
+    statement. Each query's embedding and keyword set is fanned out with a
+    LATERAL join, and every row is tagged with the query it belongs to.
+
+    Returns one {"vector": [...], "keyword": [...]} entry per optimized query,
+    each holding parent IDs ordered by that retriever's rank.
+    """
+    db = get_db()
+    if keyword_mode not in KEYWORD_SEARCH_MODES:
+        raise ValueError(
+            f"Invalid keyword search mode '{keyword_mode}'. Allowed values: {', '.join(KEYWORD_SEARCH_MODES)}"
+        )
+
+    query_embeddings = [
+        "[" + ",".join(map(repr, query.embeddings or [])) + "]"
+        for query in optimized_queries
+    ]
+    keyword_specs = []
+    if include_keywords:
+        for query_index, query in enumerate(optimized_queries):
+            spec = _keyword_spec(query_index, query.keywords, keyword_mode)
+            if spec:
+                keyword_specs.append(spec)
+
+    sql = f"""
+        WITH vector_queries AS (
+            SELECT (q.ordinality - 1)::int AS query_index, q.embedding::vector AS embedding
+            FROM unnest($2::text[]) WITH ORDINALITY AS q(embedding, ordinality)
+        ),{_KEYWORD_QUERIES_SQL[keyword_mode]}
+        SELECT v.query_index, 'vector' AS retriever, hit.score, hit."parentIds"
+        FROM vector_queries v
+        CROSS JOIN LATERAL (
+            SELECT dc."parentIds", (dc.embedding <=> v.embedding)::float8 AS score
+            FROM "DocumentChunk" dc
+            WHERE dc."notebookId" = $1
+            ORDER BY dc.embedding <=> v.embedding ASC
+            LIMIT $4
+        ) hit
+        UNION ALL
+        SELECT k.query_index, 'keyword' AS retriever, hit.score, hit."parentIds"
+        FROM keyword_queries k
+        CROSS JOIN LATERAL ({_KEYWORD_HITS_SQL[keyword_mode]}
+        ) hit;
+    """
+
+    async with db.tx() as transaction:
+        for statement in vector_search_statements():
+            await transaction.execute_raw(statement)
+
+        rows = await transaction.query_raw(
+            sql, notebook_id, query_embeddings, json.dumps(keyword_specs), limit
+        )
+
+    # Vector scores are distances (lower is better), keyword scores are relevance
+    rows_by_query: list[dict[str, list[dict]]] = [
+        {"vector": [], "keyword": []} for _ in optimized_queries
+    ]
+    for row in rows:
+        rows_by_query[row["query_index"]][row["retriever"]].append(row)
+
+    results: list[dict[str, list[str]]] = []
+    for query_rows in rows_by_query:
+        query_rows["vector"].sort(key=lambda row: row["score"])
+        query_rows["keyword"].sort(key=lambda row: row["score"], reverse=True)
+        results.append(
+            {
+                retriever: _collect_parent_ids(retriever_rows)
+                for retriever, retriever_rows in query_rows.items()
+            }
+        )
+
+    return results
+
+
+async def embed_queries(texts: list[str], encryption_type: str) -> list[list[float]]:
+    """
+    Embed queries, reusing cached embeddings of the same normalised text and
+    embedding only the misses, in one call.
+    """
+    if not cache_enabled_for(encryption_type):
+        embedding_cache.record_bypass(len(texts))
+        return await query_embedder.embed_queries(texts)
+
+    keys = [embedding_cache_key(text) for text in texts]
+    embeddings = await embedding_cache.get_many(keys)
+    missing = [index for index, embedding in enumerate(embeddings) if embedding is None]
+    if missing:
+        new_embeddings = await query_embedder.embed_queries(
+            [texts[index] for index in missing]
+        )
+        for index, embedding in zip(missing, new_embeddings, strict=True):
+            embeddings[index] = embedding
+        await embedding_cache.set_many(
+            {keys[index]: embeddings[index] for index in missing}
+        )
+    return embeddings
 
 
 async def retrieve_chunks(
@@ -95,49 +315,28 @@ async def retrieve_chunks(
     if not optimized_query:
         return optimized_query
 
-    # Generate embeddings for all optimized queries in parallel to reduce latency.
-    embedding_tasks = [
-        remote_embedder.generate_embeddings.remote.aio(query.optimized_query)
-        for query in optimized_query
-    ]
-    embeddings_results = await asyncio.gather(*embedding_tasks)
+    # Embed every optimized query in one call; the remote embedder also
+    # coalesces them with concurrent chats' queries into a single encode.
+    embeddings_results = await embed_queries(
+        [query.optimized_query for query in optimized_query], encryption_type
+    )
     for query, emb in zip(optimized_query, embeddings_results, strict=True):
         query.embeddings = emb
 
     limit_per_query = 100 // len(optimized_query)
 
-    # For each optimized query, fetch vector- and keyword-based parent IDs in parallel,
-    # and do this concurrently across all queries to minimize latency.
-    if encryption_type != Encryption.AdvancedEncryption:
-        parent_tasks = [
-            asyncio.gather(
-                retrieve_vector_chunks(
-                    notebook_id, query.embeddings or [], limit_per_query
-                ),
-                retrieve_keyword_chunks(notebook_id, query.keywords, limit_per_query),
-            )
-            for query in optimized_query
-        ]
-    else:
-        parent_tasks = [
-            asyncio.gather(
-                retrieve_vector_chunks(
-                    notebook_id, query.embeddings or [], limit_per_query
-                ),
-            )
-            for query in optimized_query
-        ]
-
-    parent_results = await asyncio.gather(*parent_tasks)
+    # Keyword search is skipped for AdvancedEncryption because chunk content is
+    # stored encrypted, leaving vector search only.
+    parent_results = await retrieve_hybrid_chunks(
+        notebook_id,
+        optimized_query,
+        limit_per_query,
+        include_keywords=encryption_type != Encryption.AdvancedEncryption,
+    )
 
     for query, result in zip(optimized_query, parent_results, strict=True):
-        if encryption_type != Encryption.AdvancedEncryption:
-            vector_parent_ids, keyword_parent_ids = result
-            # Attach the unique set of parent IDs associated with this optimized query.
-            query.parentIds = list(set(vector_parent_ids) | set(keyword_parent_ids))
-        else:
-            vector_parent_ids = result[0]
-            # Attach the parent IDs from vector search only.
-            query.parentIds = list(set(vector_parent_ids))
+        # Fuse both rankings and keep only the best parents, so the reranker
+        # scores a fixed number of candidates instead of the whole union.
+        query.parentIds = reciprocal_rank_fusion(result, limit=FUSED_PARENTS_PER_QUERY)
 
     return optimized_query
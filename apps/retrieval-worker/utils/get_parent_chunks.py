@@ -44,6 +44,10 @@ async def get_parent_chunks(
                     chunk.content = decrypt_data(chunk.content, encryption_key)
 
         for query, parent_chunks_raw in zip(queries_with_ids, results, strict=True):
+            # find_many does not preserve the IN list order; restore the fused
+            # retrieval rank so downstream stages see the best candidates first
+            rank = {pid: i for i, pid in enumerate(query.parentIds)}
+            parent_chunks_raw.sort(key=lambda chunk: rank.get(chunk.id, len(rank)))
             query.parentChunks = [
                 ParentChunk(
                     id=chunk.id,
@@ -1,5 +1,6 @@
 import re
 import uuid
+from collections.abc import AsyncIterator
 
 from lib.llm_client import remote_llm
 from schemas import FinalisedCitations
@@ -57,32 +58,92 @@ def replace_with_citation(
         # Replace the literal marker string, e.g. "<cit_1>"
         pattern = re.escape(marker)
 
-        # Prefer real_text, fall back to how_it_answers
-        summary_source = (citation.real_text or citation.how_it_answers or "").strip()
-        # Remove markdown syntax and square brackets from the summary so that
-        # the data-summary attribute only contains plain text.
-        # - Turn markdown links [text](url) into just "text"
-        summary_source = re.sub(r"\[([^\]]+)\]\([^)]+\)", r"\1", summary_source)
-        # - Strip remaining markdown control characters / brackets / list markers
-        summary_source = re.sub(r"[\[\]\*_`>#\-]", "", summary_source)
-        # - Remove any line breaks / excessive whitespace so the summary is a single line
-        summary_source = " ".join(summary_source.split())
-        summary_escaped = summary_source.replace('"', "&quot;").replace("'", "&apos;")
-
-        def _replace(
-            _match,
-            source_id=citation.sourceId,
-            chunk_id=citation.chunkId,
-            summary=summary_escaped,
-        ):
-            citation_uuid = str(uuid.uuid4())
-            return f'<span data-citation="true" data-source-id="{source_id}" data-chunk-id="{chunk_id}" data-summary="{summary}">[{citation_uuid}]</span>'
+        def _replace(_match, citation=citation):
+            return citation_span(citation, str(uuid.uuid4()))
 
         final_response = re.sub(pattern, _replace, final_response)
 
     return final_response
 
 
+def citation_span(citation: FinalisedCitations, label: str) -> str:
+    """
+    Build the HTML span for one citation, displaying `label` in brackets.
+    """
+    # Prefer real_text, fall back to how_it_answers
+    summary_source = (citation.real_text or citation.how_it_answers or "").strip()
+    # Remove markdown syntax and square brackets from the summary so that
+    # the data-summary attribute only contains plain text.
+    # - Turn markdown links [text](url) into just "text"
+    summary_source = re.sub(r"\[([^\]]+)\]\([^)]+\)", r"\1", summary_source)
+    # - Strip remaining markdown control characters / brackets / list markers
+    summary_source = re.sub(r"[\[\]\*_`>#\-]", "", summary_source)
+    # - Remove any line breaks / excessive whitespace so the summary is a single line
+    summary_source = " ".join(summary_source.split())
+    summary_escaped = summary_source.replace('"', "&quot;").replace("'", "&apos;")
+
+    return f'<span data-citation="true" data-source-id="{citation.sourceId}" data-chunk-id="{citation.chunkId}" data-summary="{summary_escaped}">[{label}]</span>'
+
+
+# A complete marker plus any slashes the model put in front of it
+_CITATION_MARKER = re.compile(r"([\\/]*)<cit_(\d+)>")
+# The tail of the buffer that could still grow into a marker, e.g. "\\<cit_1"
+_PARTIAL_MARKER = re.compile(r"[\\/]*(?:<(?:c(?:i(?:t(?:_\d*)?)?)?)?)?$")
+
+
+class StreamingCitationRewriter:
+    """
+    Applies replace_with_citation, renumber_citations and clean_response to a
+    token stream. Text is released as soon as it can no longer be part of a
+    <cit_N> marker, so the concatenated output matches the buffered pipeline.
+    """
+
+    def __init__(self, citations_map: dict[str, FinalisedCitations]):
+        self.citations_map = citations_map
+        self._pending = ""
+        self._citation_count = 0
+        self._last_char = ""
+
+    def _replace_marker(self, match: re.Match) -> str:
+        citation = self.citations_map.get(f"<cit_{match.group(2)}>")
+        if citation is None:
+            # clean_response only drops the backslashes right before a stray marker
+            return match.group(1).rstrip("\\") + " "
+        # Every occurrence gets the next display number, as renumber_citations does
+        self._citation_count += 1
+        return citation_span(citation, str(self._citation_count))
+
+    def _release(self, text: str) -> str:
+        text = re.sub(r"  +", " ", text)
+        # Collapse spaces across the boundary with what was already sent
+        if self._last_char == " ":
+            text = text.lstrip(" ")
+        if text:
+            self._last_char = text[-1]
+        return text
+
+    def feed(self, delta: str) -> str:
+        """
+        Add a generated delta and return the text that is now safe to send.
+        """
+        buffer = self._pending + delta
+        tail_start = _PARTIAL_MARKER.search(buffer).start()
+        ready = _CITATION_MARKER.sub(self._replace_marker, buffer[:tail_start])
+        # Trailing whitespace is held back so the finished answer is stripped
+        # and runs of spaces can still be collapsed
+        kept = ready.rstrip()
+        self._pending = ready[len(kept) :] + buffer[tail_start:]
+        return self._release(kept)
+
+    def flush(self) -> str:
+        """
+        Return whatever is still held back once generation has finished.
+        """
+        remaining = _CITATION_MARKER.sub(self._replace_marker, self._pending)
+        self._pending = ""
+        return self._release(remaining.rstrip())
+
+
 def build_prompt(
     citation_map: dict[str, FinalisedCitations],
     user_query: str,
@@ -202,3 +263,33 @@ async def prepare_answer(
     print("Result after cleaning: ", result)
 
     return result
+
+
+async def prepare_answer_stream(
+    extracted_citations: list[FinalisedCitations],
+    user_query: str,
+    enhanced_queries: list[str],
+) -> AsyncIterator[str]:
+    """
+    Streaming variant of prepare_answer. Yields answer text as the model
+    generates it, with citation markers already rewritten; the yielded pieces
+    concatenate to the final answer.
+    """
+    citation_map: dict[str, FinalisedCitations] = {
+        f"<cit_{idx + 1}>": citation for idx, citation in enumerate(extracted_citations)
+    }
+    prompt = build_prompt(citation_map, user_query, enhanced_queries)
+    rewriter = StreamingCitationRewriter(citation_map)
+
+    async for delta in remote_llm.generate_stream.remote_gen.aio(
+        prompt=prompt,
+        max_tokens=4000,
+        temperature=0.7,
+    ):
+        text = rewriter.feed(delta)
+        if text:
+            yield text
+
+    text = rewriter.flush()
+    if text:
+        yield text
@@ -3,7 +3,12 @@ import uuid
 
 from generated.db.enums import Encryption
 from lib.llm_client import remote_llm
-from schemas.query_optimizer import OptimizedQuery, QueryOptimizer
+from lib.query_cache import (
+    cache_enabled_for,
+    query_optimizer_cache,
+    query_optimizer_cache_key,
+)
+from schemas.query_optimizer import LLMOptimizedQuery, OptimizedQuery, QueryOptimizer
 from utils.db_client import get_db
 from utils.encryption import decrypt_data
 
@@ -107,19 +112,36 @@ async def prepare_question(
                 for summary in context["summaries"]
             ]
 
-    response_text = await remote_llm.generate.remote.aio(
-        prompt=build_query_optimizer_prompt(content, context),
-        max_tokens=8192,
-        temperature=0.5,
-        json_schema=json_schema_str,
-    )
+    # The same input against the same conversation context gives the same
+    # rewrite, so repeated questions skip the LLM call
+    cache_key = None
+    cached_queries = None
+    if cache_enabled_for(record.encryption if record else None):
+        cache_key = query_optimizer_cache_key(context, content)
+        cached_queries = await query_optimizer_cache.get(cache_key)
+    else:
+        query_optimizer_cache.record_bypass()
+
+    if cached_queries is not None:
+        llm_queries = [LLMOptimizedQuery.model_validate(q) for q in cached_queries]
+    else:
+        response_text = await remote_llm.generate.remote.aio(
+            prompt=build_query_optimizer_prompt(content, context),
+            max_tokens=8192,
+            temperature=0.5,
+            json_schema=json_schema_str,
+        )
 
-    # Parse LLM output according to the LLM-facing schema.
-    parsed = QueryOptimizer.model_validate_json(response_text)
+        # Parse LLM output according to the LLM-facing schema.
+        llm_queries = QueryOptimizer.model_validate_json(response_text).queries
+        if cache_key:
+            await query_optimizer_cache.set(
+                cache_key, [q.model_dump() for q in llm_queries]
+            )
 
     # Convert to internal OptimizedQuery objects and add local-only fields.
     optimized_queries: list[OptimizedQuery] = []
-    for q in parsed.queries:
+    for q in llm_queries:
         optimized_queries.append(
             OptimizedQuery(
                 optimized_query=q.optimized_query,
@@ -0,0 +1,39 @@
+from utils.retrieval_config import (
+    KEYWORD_FUSION_WEIGHT,
+    RRF_K,
+    VECTOR_FUSION_WEIGHT,
+)
+
+DEFAULT_FUSION_WEIGHTS = {
+    "vector": VECTOR_FUSION_WEIGHT,
+    "keyword": KEYWORD_FUSION_WEIGHT,
+}
+
+
+def reciprocal_rank_fusion(
+    rankings: dict[str, list[str]],
+    weights: dict[str, float] | None = None,
+    k: int = RRF_K,
+    limit: int | None = None,
+) -> list[str]:
+    """
+    Fuse several ranked ID lists with weighted reciprocal rank fusion.
+
+    Every ID scores sum(weight / (k + rank)) over the retrievers that returned
+    it, with 1-based ranks. Only ranks are used, so distances and text-search
+    scores never have to be put on a common scale. Ties keep the order in which
+    IDs were first seen.
+    """
+    weights = weights or DEFAULT_FUSION_WEIGHTS
+    scores: dict[str, float] = {}
+
+    for retriever, ranked_ids in rankings.items():
+        weight = weights.get(retriever, 1.0)
+        if weight <= 0:
+            continue
+        for rank, item_id in enumerate(ranked_ids, start=1):
+            scores[item_id] = scores.get(item_id, 0.0) + weight / (k + rank)
+
+    # sorted() is stable, so equal scores stay in first-seen order
+    fused = sorted(scores, key=scores.__getitem__, reverse=True)
+    return fused[:limit] if limit is not None else fused
@@ -0,0 +1,64 @@
+import os
+
+# --- VECTOR SEARCH ---
+# "hnsw"    -> approximate search on DocumentChunk_embedding_hnsw_idx (default)
+# "ivfflat" -> approximate search, for deployments that built an IVFFlat index instead
+# "exact"   -> index scans disabled, brute-force distance over the notebook's chunks
+VECTOR_SEARCH_MODES = ("hnsw", "ivfflat", "exact")
+VECTOR_SEARCH_MODE = os.environ.get("VECTOR_SEARCH_MODE", "hnsw")
+
+# Candidate list size per HNSW query; higher is slower but closer to exact
+HNSW_EF_SEARCH = int(os.environ.get("HNSW_EF_SEARCH", "100"))
+# pgvector >= 0.8 keeps scanning the graph until enough rows pass the notebook
+# filter. Set to "off" (or empty) on older pgvector versions.
+HNSW_ITERATIVE_SCAN = os.environ.get("HNSW_ITERATIVE_SCAN", "relaxed_order")
+# Number of IVFFlat lists probed per query
+IVFFLAT_PROBES = int(os.environ.get("IVFFLAT_PROBES", "10"))
+
+
+def vector_search_statements(
+    mode: str = VECTOR_SEARCH_MODE, ef_search: int | None = None
+) -> list[str]:
+    """
+    Returns the SET LOCAL statements that configure a vector search transaction.
+    """
+    if mode not in VECTOR_SEARCH_MODES:
+        raise ValueError(
+            f"Invalid vector search mode '{mode}'. Allowed values: {', '.join(VECTOR_SEARCH_MODES)}"
+        )
+
+    if mode == "exact":
+        # Bitmap scans on the notebookId index stay available, only the ANN
+        # index (which supports plain index scans only) is ruled out
+        return ["SET LOCAL enable_indexscan = off"]
+
+    if mode == "ivfflat":
+        return [f"SET LOCAL ivfflat.probes = {int(IVFFLAT_PROBES)}"]
+
+    statements = [f"SET LOCAL hnsw.ef_search = {int(ef_search or HNSW_EF_SEARCH)}"]
+    if HNSW_ITERATIVE_SCAN and HNSW_ITERATIVE_SCAN != "off":
+        statements.append(f"SET LOCAL hnsw.iterative_scan = {HNSW_ITERATIVE_SCAN}")
+    return statements
+
+
+# --- KEYWORD SEARCH ---
+# "regex"    -> case-insensitive regex filter scored by keyword match count (default)
+# "fulltext" -> ranked search on the generated DocumentChunk."contentTsv" column
+KEYWORD_SEARCH_MODES = ("fulltext", "regex")
+KEYWORD_SEARCH_MODE = os.environ.get("KEYWORD_SEARCH_MODE", "regex")
+
+# Must match the configuration used to generate "contentTsv" in the migration
+FULLTEXT_CONFIG = "english"
+# ts_rank_cd normalisation: 1 divides by 1 + log(document length), which
+# approximates BM25's length normalisation on top of cover-density ranking
+FULLTEXT_RANK_NORMALIZATION = 1
+
+
+# --- RANK FUSION ---
+# Reciprocal rank fusion constant; larger values flatten the gap between top ranks
+RRF_K = int(os.environ.get("RRF_K", "60"))
+# Relative trust in each retriever when their rankings are fused
+VECTOR_FUSION_WEIGHT = float(os.environ.get("VECTOR_FUSION_WEIGHT", "1.0"))
+KEYWORD_FUSION_WEIGHT = float(os.environ.get("KEYWORD_FUSION_WEIGHT", "1.0"))
+# Fused parents kept per optimized query, i.e. what the reranker has to score
+FUSED_PARENTS_PER_QUERY = int(os.environ.get("FUSED_PARENTS_PER_QUERY", "20"))
@@ -1,5 +1,7 @@
 import { supabase } from "./supabase";
 import { randomUUID } from "crypto";
+import { mkdir, writeFile } from "fs/promises";
+import path from "path";
 
 export async function uploadFile({
   buffer,
@@ -25,3 +27,38 @@ export async function uploadFile({
   if (error) throw error;
   return data;
 }
+
+/**
+ * Stores a file for the ingestion worker to pick up and returns its storage
+ * path. The worker deletes it once the source has been processed.
+ * With OBJECT_STORAGE_BACKEND=local the file is written under
+ * LOCAL_OBJECT_STORAGE_DIR instead, which the worker must share.
+ */
+export async function stageIngestionFile({
+  buffer,
+  mimeType,
+  storagePath,
+}: {
+  buffer: Buffer;
+  mimeType: string;
+  storagePath: string;
+}) {
+  if (process.env.OBJECT_STORAGE_BACKEND === "local") {
+    const root =
+      process.env.LOCAL_OBJECT_STORAGE_DIR || "/tmp/krag-object-storage";
+    const filePath = path.join(root, storagePath);
+    await mkdir(path.dirname(filePath), { recursive: true });
+    await writeFile(filePath, buffer);
+    return storagePath;
+  }
+
+  const { data, error } = await supabase.storage
+    .from("files")
+    .upload(storagePath, buffer, {
+      contentType: mimeType,
+      upsert: true,
+    });
+
+  if (error) throw error;
+  return data.path;
+}
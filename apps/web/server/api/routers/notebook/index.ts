@@ -3,10 +3,12 @@ import { CreateNotebook } from "./create-notebook";
 import { GetNotebook } from "./get-notebook";
 import { GetNotebooks } from "./get-notebooks";
 import { deleteNotebook } from "./delete-notebook";
+import { SetAnswerCache } from "./set-answer-cache";
 
 export const notebookRouter = createTRPCRouter({
   createNotebook: CreateNotebook,
   getNotebook: GetNotebook,
   getNotebooks: GetNotebooks,
   deleteNotebook: deleteNotebook,
+  setAnswerCache: SetAnswerCache,
 });
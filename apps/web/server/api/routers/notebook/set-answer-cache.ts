@@ -0,0 +1,25 @@
+import { protectedProcedure } from "@/server/api/trpc";
+import { TRPCError } from "@trpc/server";
+import { z } from "zod";
+
+export const SetAnswerCache = protectedProcedure
+  .input(z.object({ notebookId: z.string(), enabled: z.boolean() }))
+  .mutation(async ({ input, ctx }) => {
+    const { notebookId, enabled } = input;
+    const userId = ctx.session.user.id;
+    const notebook = await ctx.db.notebook.findUnique({
+      where: { id: notebookId, userId },
+      select: { id: true },
+    });
+    if (!notebook) {
+      throw new TRPCError({ code: "NOT_FOUND", message: "Notebook not found" });
+    }
+
+    // Encrypted notebooks are never cached by the retrieval worker, whatever
+    // this flag says
+    await ctx.db.notebook.update({
+      where: { id: notebookId, userId },
+      data: { answerCacheEnabled: enabled },
+    });
+    return { success: true };
+  });
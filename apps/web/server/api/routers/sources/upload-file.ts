@@ -3,6 +3,7 @@ import { protectedProcedure } from "../../trpc";
 import { z } from "zod";
 import { FileProcessingStatus, FileType } from "@repo/db";
 import { redis } from "@/lib/redis";
+import { stageIngestionFile } from "@/lib/upload-file";
 import { v4 as uuidv4 } from "uuid";
 export const uploadFile = protectedProcedure
   .input(
@@ -43,10 +44,24 @@ export const uploadFile = protectedProcedure
 
     const id = uuidv4();
 
+    // The PDF goes to object storage and only its path is queued, keeping
+    // multi-MB payloads out of Redis
+    let storagePath: string | null = null;
+    if (!websiteUrl && fileBase64) {
+      const base64 = fileBase64.includes(",")
+        ? (fileBase64.split(",")[1] ?? "")
+        : fileBase64;
+      storagePath = await stageIngestionFile({
+        buffer: Buffer.from(base64, "base64"),
+        mimeType: "application/pdf",
+        storagePath: `uploads/${userId}/${id}.pdf`,
+      });
+    }
+
     const queueMessage = {
       id,
       mimeType: websiteUrl ? "text/html" : "application/pdf",
-      base64: fileBase64 || "",
+      storage_path: storagePath,
       user_id: userId,
       url: websiteUrl,
       type: websiteUrl ? "url" : "pdf",
@@ -0,0 +1,19 @@
+-- AlterTable
+ALTER TABLE "DocumentChunk" ADD COLUMN     "notebookId" TEXT;
+
+-- Backfill from the owning source
+UPDATE "DocumentChunk" dc
+SET "notebookId" = s."notebookId"
+FROM "Source" s
+WHERE dc."sourceId" = s.id;
+
+ALTER TABLE "DocumentChunk" ALTER COLUMN "notebookId" SET NOT NULL;
+
+-- CreateIndex
+CREATE INDEX "DocumentChunk_notebookId_idx" ON "DocumentChunk"("notebookId");
+
+-- AddForeignKey
+ALTER TABLE "DocumentChunk" ADD CONSTRAINT "DocumentChunk_notebookId_fkey" FOREIGN KEY ("notebookId") REFERENCES "notebook"("id") ON DELETE CASCADE ON UPDATE CASCADE;
+
+-- CreateIndex (not expressible in schema.prisma, see the DocumentChunk model)
+CREATE INDEX IF NOT EXISTS "DocumentChunk_embedding_hnsw_idx" ON "DocumentChunk" USING hnsw (embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64);
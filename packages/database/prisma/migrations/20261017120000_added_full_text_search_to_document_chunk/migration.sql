@@ -0,0 +1,6 @@
+-- AlterTable
+-- The text search configuration must match FULLTEXT_CONFIG in the retrieval worker
+ALTER TABLE "DocumentChunk" ADD COLUMN     "contentTsv" tsvector GENERATED ALWAYS AS (to_tsvector('english'::regconfig, content)) STORED;
+
+-- CreateIndex
+CREATE INDEX "DocumentChunk_contentTsv_idx" ON "DocumentChunk" USING GIN ("contentTsv");
@@ -0,0 +1,2 @@
+-- AlterTable
+ALTER TABLE "notebook" ADD COLUMN     "answerCacheEnabled" BOOLEAN NOT NULL DEFAULT true;
@@ -1,4 +1,11 @@
 from .modal_service import (
+    BGE_M3_MAX_CONTAINERS,
+    BGE_M3_MAX_INPUTS,
+    FLORENCE_MAX_BATCH_SIZE,
+    FLORENCE_MAX_CONTAINERS,
+    FLORENCE_MAX_INPUTS,
+    MARKER_MAX_CONTAINERS,
+    MARKER_MAX_INPUTS,
     BGEM3Embedder,
     BGEM3EmbedderCPU,
     FlorenceSummarizer,
@@ -6,14 +13,23 @@ from .modal_service import (
     MXBAIRerankerV2,
     Qwen2_5_14BAWQ,
     app,
+    pdf_upload_volume,
 )
 
 __all__ = [
     "app",
+    "BGE_M3_MAX_CONTAINERS",
+    "BGE_M3_MAX_INPUTS",
+    "FLORENCE_MAX_BATCH_SIZE",
+    "FLORENCE_MAX_CONTAINERS",
+    "FLORENCE_MAX_INPUTS",
+    "MARKER_MAX_CONTAINERS",
+    "MARKER_MAX_INPUTS",
     "BGEM3Embedder",
     "BGEM3EmbedderCPU",
     "FlorenceSummarizer",
     "MarkerParser",
     "MXBAIRerankerV2",
     "Qwen2_5_14BAWQ",
+    "pdf_upload_volume",
 ]
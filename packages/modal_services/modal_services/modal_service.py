@@ -1,5 +1,10 @@
 from __future__ import annotations
 
+import queue
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import Future
 from typing import TYPE_CHECKING
 
 import modal
@@ -112,18 +117,107 @@ qwen_14b_awq_image = (
 # App
 app = modal.App("ingestion-worker")
 
+# MarkerParser capacity; callers size their PDF shards from these
+MARKER_MAX_CONTAINERS = 6
+MARKER_MAX_INPUTS = 4
+
+# PDFs parsed in page ranges are uploaded here once by the caller, and every
+# MarkerParser call reads the whole document from the volume
+pdf_upload_volume = modal.Volume.from_name(
+    "ingestion-pdf-uploads", create_if_missing=True
+)
+
+# FlorenceSummarizer capacity. Each input is a batch of images, so few
+# concurrent inputs keep the GPU busy; callers size their batches from these.
+FLORENCE_MAX_CONTAINERS = 3
+FLORENCE_MAX_INPUTS = 2
+FLORENCE_MAX_BATCH_SIZE = 16
+# Rough VRAM needed per image in a batch with 3 beams and 1024 new tokens
+FLORENCE_IMAGE_VRAM_BYTES = 768 * 1024 * 1024
+
+# BGEM3Embedder capacity. Each input is a list of texts encoded in batches
+# planned from a VRAM budget split between the concurrent inputs.
+BGE_M3_MAX_CONTAINERS = 4
+BGE_M3_MAX_INPUTS = 4
+BGE_M3_MAX_BATCH_SIZE = 128
+BGE_M3_MAX_LENGTH = 8192
+# Rough fp16 inference VRAM of a batch: per token (hidden states and FFN
+# activations) plus per token pair (attention scores of all heads)
+BGE_M3_TOKEN_VRAM_BYTES = 48 * 1024
+BGE_M3_ATTENTION_VRAM_BYTES = 16 * 2
+
+# BGEM3EmbedderCPU query micro-batching: concurrent chats' queries are merged
+# into one encode call, waiting at most this long for others to join
+QUERY_EMBEDDING_MAX_INPUTS = 16
+QUERY_EMBEDDING_MAX_BATCH_SIZE = 32
+QUERY_EMBEDDING_MAX_WAIT_MS = 10
+
+
+class _MicroBatcher:
+    """
+    Coalesces texts submitted from concurrent input threads into a single
+    `encode` call. A batch closes once it holds `max_batch_size` texts or
+    `max_wait_ms` after its first request arrived, and each caller gets back
+    the vectors for its own texts.
+    """
+
+    def __init__(
+        self,
+        encode: Callable[[list[str]], list[list[float]]],
+        max_batch_size: int,
+        max_wait_ms: int,
+    ):
+        self._encode = encode
+        self._max_batch_size = max_batch_size
+        self._max_wait = max_wait_ms / 1000
+        self._requests: queue.Queue[tuple[list[str], Future]] = queue.Queue()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, texts: list[str]) -> list[list[float]]:
+        future: Future = Future()
+        self._requests.put((texts, future))
+        return future.result()
+
+    def _run(self):
+        while True:
+            batch = [self._requests.get()]
+            size = len(batch[0][0])
+            deadline = time.monotonic() + self._max_wait
+            while size < self._max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self._requests.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(request)
+                size += len(request[0])
+
+            try:
+                vectors = self._encode([text for texts, _ in batch for text in texts])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            offset = 0
+            for texts, future in batch:
+                future.set_result(vectors[offset : offset + len(texts)])
+                offset += len(texts)
+
 
 # Marker Parser
 @app.cls(
     gpu="L4",
     image=pdf_parser_image,
-    max_containers=6,
+    max_containers=MARKER_MAX_CONTAINERS,
     cpu=8.0,
     scaledown_window=60,
     retries=3,
     secrets=[modal.Secret.from_dotenv()],
 )
-@modal.concurrent(max_inputs=4)
+@modal.concurrent(max_inputs=MARKER_MAX_INPUTS)
 class MarkerParser:
     @modal.enter()
     def setup(self):
@@ -134,31 +228,53 @@ class MarkerParser:
         from marker.converters.pdf import PdfConverter  # type: ignore
         from marker.models import create_model_dict  # type: ignore
 
+        # Load the models once; page-range converters reuse them
+        self.artifact_dict = create_model_dict()
+
         # Initialize the converter once
         self.converter = PdfConverter(
-            artifact_dict=create_model_dict(),
+            artifact_dict=self.artifact_dict,
         )
 
     @modal.method()
     def parse_secure_pdf(
-        self, pdf_data: bytes
+        self,
+        pdf_data: bytes | None,
+        page_range: tuple[int, int] | None = None,
+        pdf_path: str | None = None,
     ) -> tuple[str, dict[str, bytes], list[str]]:
         """
         Runs for every request.
+        With page_range, only pages [start, end) of pdf_data are converted,
+        so callers can send the whole document instead of rewriting shards.
+        With pdf_path, the document is read from pdf_upload_volume instead of
+        being sent with every call.
         """
         import os
         import re
         import tempfile
         import uuid
 
+        from marker.converters.pdf import PdfConverter  # type: ignore
         from marker.output import text_from_rendered  # type: ignore
 
+        if pdf_path is not None:
+            pdf_data = b"".join(pdf_upload_volume.read_file(pdf_path))
+
+        converter = self.converter
+        if page_range is not None:
+            start_page, end_page = page_range
+            converter = PdfConverter(
+                artifact_dict=self.artifact_dict,
+                config={"page_range": list(range(start_page, end_page))},
+            )
+
         with tempfile.NamedTemporaryFile(suffix=".pdf", delete=True) as temp_pdf:
             temp_pdf.write(pdf_data)
             temp_pdf.flush()
             os.fsync(temp_pdf.file.fileno())
 
-            rendered = self.converter(temp_pdf.name)
+            rendered = converter(temp_pdf.name)
 
             text, _, images = text_from_rendered(rendered)
 
@@ -197,13 +313,13 @@ class MarkerParser:
 @app.cls(
     gpu="L4",
     image=florence_image,
-    max_containers=3,
+    max_containers=FLORENCE_MAX_CONTAINERS,
     retries=3,
     cpu=4,
     scaledown_window=60,
     secrets=[modal.Secret.from_dotenv()],
 )
-@modal.concurrent(max_inputs=6)
+@modal.concurrent(max_inputs=FLORENCE_MAX_INPUTS)
 class FlorenceSummarizer:
     @modal.enter()
     def setup(self):
@@ -222,18 +338,33 @@ class FlorenceSummarizer:
 
         self.processor = AutoProcessor.from_pretrained(model_id, trust_remote_code=True)
 
-    @modal.method()
-    def summarize_image(self, image_bytes: bytes) -> str:
-        import io
-
-        from PIL import Image  # type: ignore
-
-        image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+        # Split the VRAM left after loading the model between concurrent inputs.
+        # Halved for the rest of the container's life if a batch still OOMs.
+        if self.device == "cuda":
+            free_bytes, _ = torch.cuda.mem_get_info()
+            per_input_bytes = free_bytes // FLORENCE_MAX_INPUTS
+            self.batch_size = max(
+                1,
+                min(
+                    FLORENCE_MAX_BATCH_SIZE,
+                    per_input_bytes // FLORENCE_IMAGE_VRAM_BYTES,
+                ),
+            )
+        else:
+            self.batch_size = 1
+        print(f"Florence batch size: {self.batch_size}")
 
+    def _caption_batch(self, images: list) -> list[str]:
+        """
+        Caption PIL images with a single padded `generate` call.
+        """
         prompt = "<MORE_DETAILED_CAPTION>"
-        inputs = self.processor(text=prompt, images=image, return_tensors="pt").to(
-            self.device, self.torch_dtype
-        )
+        inputs = self.processor(
+            text=[prompt] * len(images),
+            images=images,
+            return_tensors="pt",
+            padding=True,
+        ).to(self.device, self.torch_dtype)
 
         generated_ids = self.model.generate(
             input_ids=inputs["input_ids"],
@@ -243,55 +374,240 @@ class FlorenceSummarizer:
             num_beams=3,
         )
 
-        generated_text = self.processor.batch_decode(
+        generated_texts = self.processor.batch_decode(
             generated_ids, skip_special_tokens=False
-        )[0]
-        parsed_answer = self.processor.post_process_generation(
-            generated_text, task=prompt, image_size=(image.width, image.height)
         )
+        return [
+            self.processor.post_process_generation(
+                generated_text, task=prompt, image_size=(image.width, image.height)
+            )[prompt]
+            for generated_text, image in zip(generated_texts, images, strict=True)
+        ]
 
-        return parsed_answer["<MORE_DETAILED_CAPTION>"]
+    @modal.method()
+    def summarize_image(self, image_bytes: bytes) -> str:
+        import io
+
+        from PIL import Image  # type: ignore
+
+        image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+        return self._caption_batch([image])[0]
+
+    @modal.method()
+    def summarize_images(self, images: list[bytes]) -> list[str]:
+        """
+        Caption a list of images, in order, in batches of up to
+        `self.batch_size`. A batch that runs out of VRAM is retried at half
+        the size, down to one image.
+        """
+        import io
+
+        import torch  # type: ignore
+        from PIL import Image  # type: ignore
+
+        decoded = [Image.open(io.BytesIO(data)).convert("RGB") for data in images]
+        captions: list[str] = []
+
+        start = 0
+        while start < len(decoded):
+            batch = decoded[start : start + self.batch_size]
+            try:
+                captions.extend(self._caption_batch(batch))
+            except torch.cuda.OutOfMemoryError:
+                if len(batch) == 1:
+                    raise
+                torch.cuda.empty_cache()
+                self.batch_size = max(1, len(batch) // 2)
+                print(f"Florence OOM, batch size lowered to {self.batch_size}")
+                continue
+            start += len(batch)
+
+        return captions
 
 
 @app.cls(
     gpu="T4",
     image=bge_m3_image,
-    max_containers=4,
+    max_containers=BGE_M3_MAX_CONTAINERS,
     cpu=4.0,
     scaledown_window=60,
     secrets=[modal.Secret.from_dotenv()],
 )
-@modal.concurrent(max_inputs=32)
+@modal.concurrent(max_inputs=BGE_M3_MAX_INPUTS)
 class BGEM3Embedder:
     @modal.enter()
     def setup(self):
         """
         Loads the BGE-M3 model into GPU memory once per container start.
         """
+        import torch  # type: ignore
         from FlagEmbedding import BGEM3FlagModel  # type: ignore
 
         # Load model in FP16 for speed and lower VRAM usage
         self.model = BGEM3FlagModel("BAAI/bge-m3", use_fp16=True, device="cuda")
 
+        # Split the VRAM left after loading the model between concurrent inputs.
+        # Halved for the rest of the container's life if a batch still OOMs.
+        free_bytes, _ = torch.cuda.mem_get_info()
+        self.vram_budget = int(free_bytes * 0.8) // BGE_M3_MAX_INPUTS
+
+    def _token_lengths(self, texts: list[str]) -> list[int]:
+        """
+        Token count of every text as encoded, with [CLS] and [SEP].
+        """
+        return [
+            len(ids)
+            for ids in self.model.tokenizer(
+                texts, truncation=True, max_length=BGE_M3_MAX_LENGTH
+            )["input_ids"]
+        ]
+
+    def _plan_batches(self, order: list[int], lengths: list[int]) -> list[list[int]]:
+        """
+        Cut texts, in the given order, into batches whose padded size fits
+        the VRAM budget. Sorted longest first, each batch is a bucket of
+        similar lengths: long texts go a few at a time and short ones up to
+        BGE_M3_MAX_BATCH_SIZE at once.
+        """
+        batches: list[list[int]] = []
+        batch: list[int] = []
+        padded_length = 0
+        for index in order:
+            length = max(padded_length, lengths[index])
+            batch_bytes = (
+                (len(batch) + 1)
+                * length
+                * (BGE_M3_TOKEN_VRAM_BYTES + BGE_M3_ATTENTION_VRAM_BYTES * length)
+            )
+            if batch and (
+                batch_bytes > self.vram_budget or len(batch) == BGE_M3_MAX_BATCH_SIZE
+            ):
+                batches.append(batch)
+                batch = []
+                length = lengths[index]
+            batch.append(index)
+            padded_length = length
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _encode(self, texts: list[str], sort_by_length: bool = True):
+        """
+        Dense float32 embeddings of texts, one row per text in input order.
+
+        With sort_by_length, texts are bucketed by token length so each batch
+        is padded to a similar length instead of to its longest outlier. A
+        batch that runs out of VRAM is split in two and the budget halved.
+        """
+        import numpy as np
+        import torch  # type: ignore
+
+        dense = np.empty((len(texts), 1024), dtype=np.float32)
+        if not texts:
+            return dense
+
+        lengths = self._token_lengths(texts)
+        order = list(range(len(texts)))
+        if sort_by_length:
+            order.sort(key=lengths.__getitem__, reverse=True)
+
+        pending = self._plan_batches(order, lengths)
+        pending.reverse()
+        while pending:
+            batch = pending.pop()
+            try:
+                # BGE-M3 can output Dense, Sparse, and ColBERT vectors.
+                # For standard ingestion, we typically only need the Dense vector.
+                output = self.model.encode(
+                    [texts[index] for index in batch],
+                    batch_size=len(batch),
+                    max_length=BGE_M3_MAX_LENGTH,
+                    return_dense=True,
+                )
+            except torch.cuda.OutOfMemoryError:
+                if len(batch) == 1:
+                    raise
+                torch.cuda.empty_cache()
+                self.vram_budget //= 2
+                middle = len(batch) // 2
+                pending.extend([batch[middle:], batch[:middle]])
+                print(f"BGE-M3 OOM, VRAM budget lowered to {self.vram_budget} bytes")
+                continue
+            dense[batch] = np.asarray(output["dense_vecs"], dtype=np.float32).reshape(
+                len(batch), -1
+            )
+        return dense
+
     @modal.method()
     def generate_embeddings(
-        self, texts: list[str], batch_size: int = 12
+        self, texts: list[str], sort_by_length: bool = True
     ) -> list[list[float]]:
         """
         Generates dense embeddings for a list of text strings.
-        Returns a list of list of floats.
+        Returns a list of list of floats, in the order of `texts`.
         """
-        # BGE-M3 can output Dense, Sparse, and ColBERT vectors.
-        # For standard ingestion, we typically only need the Dense vector.
-        output = self.model.encode(
-            texts,
-            batch_size=batch_size,
-            max_length=8192,
-            return_dense=True,
-        )
+        return self._encode(texts, sort_by_length).tolist()
 
-        # Output['dense_vecs'] is a numpy array, convert to list for serialization
-        return output["dense_vecs"].tolist()
+    @modal.method()
+    def generate_embeddings_packed(
+        self, texts: list[str], dtype: str = "float32", sort_by_length: bool = True
+    ) -> bytes:
+        """
+        Same embeddings as generate_embeddings, as one packed row-major buffer
+        of `dtype` ("float32" or "float16") values, 1024 per text. Much
+        smaller to send than nested lists; read it with memoryview.cast.
+        """
+        if dtype not in ("float32", "float16"):
+            raise ValueError(
+                f"Invalid embedding dtype '{dtype}'. Allowed values: float32, float16"
+            )
+        return self._encode(texts, sort_by_length).astype(dtype).tobytes()
+
+
+def _length_order(tokenizer, texts: list[str]) -> list[int]:
+    """
+    Indexes of texts from the most to the fewest tokens.
+    """
+    lengths = [
+        len(ids)
+        for ids in tokenizer(
+            texts, add_special_tokens=False, truncation=True, max_length=8192
+        )["input_ids"]
+    ]
+    return sorted(range(len(texts)), key=lengths.__getitem__, reverse=True)
+
+
+def _dense_embeddings(
+    model, texts: str | list[str], batch_size: int, sort_by_length: bool
+) -> list[float] | list[list[float]]:
+    """
+    Dense vectors of a BGEM3FlagModel for one text (a single vector) or a
+    list of texts (one vector per text, in order).
+    """
+    import numpy as np
+
+    # A single string has nothing to order; encode returns one vector for it
+    order = (
+        _length_order(model.tokenizer, texts)
+        if sort_by_length and isinstance(texts, list) and len(texts) > 1
+        else None
+    )
+    # BGE-M3 can output Dense, Sparse, and ColBERT vectors.
+    # For standard ingestion, we typically only need the Dense vector.
+    output = model.encode(
+        [texts[index] for index in order] if order else texts,
+        batch_size=batch_size,
+        max_length=8192,
+        return_dense=True,
+    )
+
+    dense = output["dense_vecs"]
+    if order:
+        unsorted = np.empty_like(dense)
+        unsorted[order] = dense
+        dense = unsorted
+    # Output['dense_vecs'] is a numpy array, convert to list for serialization
+    return dense.tolist()
 
 
 @app.cls(
@@ -302,7 +618,7 @@ class BGEM3Embedder:
     scaledown_window=5,
     secrets=[modal.Secret.from_dotenv()],
 )
-@modal.concurrent(max_inputs=2)
+@modal.concurrent(max_inputs=QUERY_EMBEDDING_MAX_INPUTS)
 class BGEM3EmbedderCPU:
     @modal.enter()
     def setup(self):
@@ -313,27 +629,46 @@ class BGEM3EmbedderCPU:
 
         # Load model in FP16 for speed and lower VRAM usage
         self.model = BGEM3FlagModel("BAAI/bge-m3", use_fp16=False, device="cpu")
+        self.query_batcher = _MicroBatcher(
+            self._encode_queries,
+            QUERY_EMBEDDING_MAX_BATCH_SIZE,
+            QUERY_EMBEDDING_MAX_WAIT_MS,
+        )
 
-    @modal.method()
-    def generate_embeddings(
-        self, texts: list[str], batch_size: int = 12
-    ) -> list[list[float]]:
-        """
-        Generates dense embeddings for a list of text strings.
-        Returns a list of list of floats.
-        """
-        # BGE-M3 can output Dense, Sparse, and ColBERT vectors.
-        # For standard ingestion, we typically only need the Dense vector.
+    def _encode_queries(self, texts: list[str]) -> list[list[float]]:
+        # One forward pass for the whole coalesced batch
         output = self.model.encode(
             texts,
-            batch_size=batch_size,
+            batch_size=QUERY_EMBEDDING_MAX_BATCH_SIZE,
             max_length=8192,
             return_dense=True,
         )
-
-        # Output['dense_vecs'] is a numpy array, convert to list for serialization
         return output["dense_vecs"].tolist()
 
+    @modal.method()
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        """
+        Generates dense embeddings for a request's queries, in order. Queries
+        from concurrent requests on this container share one encode call.
+        """
+        if not texts:
+            return []
+        return self.query_batcher.submit(texts)
+
+    @modal.method()
+    def generate_embeddings(
+        self, texts: str | list[str], batch_size: int = 12, sort_by_length: bool = True
+    ) -> list[float] | list[list[float]]:
+        """
+        Generates dense embeddings for a text string or a list of them.
+        Returns a list of floats for a string, and a list of lists of floats
+        in the order of `texts` for a list.
+
+        With sort_by_length, texts are batched by token length, so each batch
+        is padded to a similar length instead of to its longest outlier.
+        """
+        return _dense_embeddings(self.model, texts, batch_size, sort_by_length)
+
 
 @app.cls(
     gpu="L4",
@@ -483,16 +818,12 @@ class Qwen2_5_14BAWQ:
 
         self.engine = AsyncLLMEngine.from_engine_args(engine_args)
 
-    @modal.method()
-    async def generate(
+    def _sampling_params(
         self,
-        prompt: str,
-        max_tokens: int = 2048,
-        temperature: float = 0.1,
+        max_tokens: int,
+        temperature: float,
         json_schema: str | dict | None = None,
-    ) -> str:
-        import uuid
-
+    ):
         from vllm import SamplingParams  # type: ignore
         from vllm.sampling_params import GuidedDecodingParams  # type: ignore
 
@@ -502,7 +833,7 @@ class Qwen2_5_14BAWQ:
 
         loop_breaker = GeneralizedLoopBreaker(min_pattern_len=1, max_pattern_len=8)
 
-        sampling_params = SamplingParams(
+        return SamplingParams(
             temperature=temperature,
             max_tokens=max_tokens,
             top_p=0.95,
@@ -511,6 +842,17 @@ class Qwen2_5_14BAWQ:
             logits_processors=[loop_breaker],
         )
 
+    @modal.method()
+    async def generate(
+        self,
+        prompt: str,
+        max_tokens: int = 2048,
+        temperature: float = 0.1,
+        json_schema: str | dict | None = None,
+    ) -> str:
+        import uuid
+
+        sampling_params = self._sampling_params(max_tokens, temperature, json_schema)
         request_id = str(uuid.uuid4())
 
         results_generator = self.engine.generate(prompt, sampling_params, request_id)
@@ -520,3 +862,41 @@ class Qwen2_5_14BAWQ:
             final_output = request_output
 
         return final_output.outputs[0].text.strip()
+
+    @modal.method(is_generator=True)
+    async def generate_stream(
+        self,
+        prompt: str,
+        max_tokens: int = 2048,
+        temperature: float = 0.1,
+    ):
+        """
+        Streaming variant of generate: yields text deltas as vLLM produces them.
+        Each vLLM output carries the cumulative text, so only the new suffix is
+        sent. Leading whitespace is dropped to match generate's strip().
+        """
+        import uuid
+
+        sampling_params = self._sampling_params(max_tokens, temperature)
+        request_id = str(uuid.uuid4())
+
+        results_generator = self.engine.generate(prompt, sampling_params, request_id)
+
+        sent = 0
+        started = False
+        finished = False
+        try:
+            async for request_output in results_generator:
+                finished = request_output.finished
+                text = request_output.outputs[0].text
+                delta = text[sent:]
+                sent = len(text)
+                if not started:
+                    delta = delta.lstrip()
+                    started = bool(delta)
+                if delta:
+                    yield delta
+        finally:
+            # Free the sequence's KV cache if the caller stops consuming early
+            if not finished:
+                await self.engine.abort(request_id)
@@ -0,0 +1,54 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("modal")
+
+from modal_services.modal_service import _dense_embeddings  # noqa: E402
+
+
+class FakeBGEM3Model:
+    """
+    Stands in for BGEM3FlagModel: one token per word, and a text's vector is
+    its word count, so the order of the returned vectors can be checked.
+    """
+
+    def __init__(self):
+        self.encoded = []
+
+    def tokenizer(self, texts, **kwargs):
+        return {"input_ids": [text.split() for text in texts]}
+
+    def encode(self, texts, **kwargs):
+        self.encoded.append(texts)
+        if isinstance(texts, str):
+            return {"dense_vecs": np.array([len(texts.split()), 0.0])}
+        return {"dense_vecs": np.array([[len(text.split()), 0.0] for text in texts])}
+
+
+def test_single_string_returns_one_vector():
+    model = FakeBGEM3Model()
+
+    embedding = _dense_embeddings(model, "what is a knowledge graph", 12, True)
+
+    assert embedding == [5.0, 0.0]
+    assert model.encoded == ["what is a knowledge graph"]
+
+
+def test_list_is_encoded_by_length_and_returned_in_input_order():
+    model = FakeBGEM3Model()
+    texts = ["one", "one two three", "one two"]
+
+    embeddings = _dense_embeddings(model, texts, 12, True)
+
+    assert embeddings == [[1.0, 0.0], [3.0, 0.0], [2.0, 0.0]]
+    assert model.encoded == [["one two three", "one two", "one"]]
+
+
+def test_list_without_sorting_is_encoded_as_given():
+    model = FakeBGEM3Model()
+    texts = ["one", "one two three"]
+
+    embeddings = _dense_embeddings(model, texts, 12, False)
+
+    assert embeddings == [[1.0, 0.0], [3.0, 0.0]]
+    assert model.encoded == [texts]